@@ -1,47 +1,23 @@
+import numpy
 import pandas as pd
 
 
+# Order types which open a long position
+BUY_ORDER_TYPES = ['BUY', 'BUY_STOP']
+# Order types which open a short position
+SELL_ORDER_TYPES = ['SELL', 'SELL_STOP']
+
+
 # Function to calculate the Sharpe Ratio on stocks
-def calc_sharpe(trade_dataframe, start_date, end_date, annual_risk_free_rate=0.033):
+def calc_sharpe(trade_dataframe, start_date, end_date, annual_risk_free_rate=0.033, compact=False):
     """
     Function to calculate the Sharpe Ratio on stocks
     :param trade_dataframe: Dataframe containing trade data
     :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param compact: Skip the risk free columns which are the same for every trade, see calc_returns
     """
-    # Break the annual risk free rate into a daily rate
-    rfr = 1 + annual_risk_free_rate
-    rfr = rfr**(1/365)
-    daily_rfr = rfr - 1
-    # Add a column to the dataframe for daily_rfr
-    trade_dataframe['daily_rfr'] = daily_rfr
-    # For each row, calculate the number of days from the start of dataframe, using candle_timestamp
-    trade_dataframe['days_from_start'] = trade_dataframe['exit_time'] - start_date
-    # Convert days_from_start to a float
-    trade_dataframe['days_from_start'] = trade_dataframe['days_from_start'].dt.days
-    # Multiply daily_rfr by days_from_start to get the cumulative risk free rate
-    trade_dataframe['cumulative_rfr'] = trade_dataframe['daily_rfr'] * trade_dataframe['days_from_start']
-    # Calculate wins and losses
-    trade_dataframe = calc_wins(trade_dataframe)
-    # Add a column to the dataframe for excess_return
-    trade_dataframe['excess_return'] = 0
-    # Create a column to the dataframe called rfr_amount
-    trade_dataframe['rfr_amount'] = 0
-    # Set rfr_amount to be 1000000 * cumulative_rfr
-    trade_dataframe['rfr_amount'] = 1000000 * trade_dataframe['cumulative_rfr']
-    # Iterate through the dataframe
-    for index, row in trade_dataframe.iterrows():
-        # If the trade type was a BUY or BUY_STOP
-        if row['order_type'] == 'BUY' or row['order_type'] == 'BUY_STOP':
-            # Calculate the excess return
-            trade_dataframe.loc[index, 'excess_return'] = ((row['exit_price'] - row['entry_price'])/row['entry_price']) * 1000000 - row['rfr_amount']
-            # Calculate the raw return
-            trade_dataframe.loc[index, 'raw_return'] = ((row['exit_price'] - row['entry_price'])/row['entry_price']) * 1000000
-        # If the trade type was a SELL or SELL_STOP
-        elif row['order_type'] == 'SELL' or row['order_type'] == 'SELL_STOP':
-            # Calculate the excess return
-            trade_dataframe.loc[index, 'excess_return'] = ((row['entry_price'] - row['exit_price'])/row['entry_price']) * 1000000 - row['rfr_amount']
-            # Calculate the raw return
-            trade_dataframe.loc[index, 'raw_return'] = ((row['entry_price'] - row['exit_price'])/row['entry_price']) * 1000000
+    # Calculate the return of each trade
+    trade_dataframe, daily_rfr = calc_returns(trade_dataframe, start_date, annual_risk_free_rate, compact=compact)
     # Sum the raw_return
     raw_return = trade_dataframe['raw_return'].sum()
     # Now summarize the dataframe
@@ -75,27 +51,87 @@ def calc_sharpe(trade_dataframe, start_date, end_date, annual_risk_free_rate=0.0
     return return_object
 
 
+# Function to calculate the return of each trade
+def calc_returns(trade_dataframe, start_date, annual_risk_free_rate=0.033, compact=False):
+    """
+    Function to calculate the raw and excess return of each trade on a 1,000,000 notional,
+    along with wins and the risk free amount for the days since start_date
+    :param trade_dataframe: Dataframe containing trade data
+    :param start_date: Date the risk free rate starts accumulating from
+    :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param compact: Only add rfr_amount, without the daily_rfr, days_from_start and cumulative_rfr columns.
+    daily_rfr is the same for every trade and is returned instead, default is False
+    :return: Tuple of (trade dataframe with the return columns added, daily risk free rate)
+    """
+    # Break the annual risk free rate into a daily rate
+    rfr = 1 + annual_risk_free_rate
+    rfr = rfr**(1/365)
+    daily_rfr = rfr - 1
+    if compact:
+        # Same steps as below on arrays, so rfr_amount has the same values
+        days_from_start = (trade_dataframe['exit_time'] - start_date).dt.days.to_numpy()
+        trade_dataframe = calc_wins(trade_dataframe)
+        trade_dataframe['rfr_amount'] = 1000000 * (daily_rfr * days_from_start)
+    else:
+        # Add a column to the dataframe for daily_rfr
+        trade_dataframe['daily_rfr'] = daily_rfr
+        # For each row, calculate the number of days from the start of dataframe, using candle_timestamp
+        trade_dataframe['days_from_start'] = trade_dataframe['exit_time'] - start_date
+        # Convert days_from_start to a float
+        trade_dataframe['days_from_start'] = trade_dataframe['days_from_start'].dt.days
+        # Multiply daily_rfr by days_from_start to get the cumulative risk free rate
+        trade_dataframe['cumulative_rfr'] = trade_dataframe['daily_rfr'] * trade_dataframe['days_from_start']
+        # Calculate wins and losses
+        trade_dataframe = calc_wins(trade_dataframe)
+        # Create a column to the dataframe called rfr_amount
+        trade_dataframe['rfr_amount'] = 0
+        # Set rfr_amount to be 1000000 * cumulative_rfr
+        trade_dataframe['rfr_amount'] = 1000000 * trade_dataframe['cumulative_rfr']
+    # Get the direction of each trade, 1 for BUY/BUY_STOP, -1 for SELL/SELL_STOP and 0 for anything else
+    direction = _trade_direction(trade_dataframe)
+    # Calculate the raw return for every trade in one pass. Unknown order types are left as NaN
+    price_move = direction * (trade_dataframe['exit_price'].to_numpy(dtype=float) - trade_dataframe['entry_price'].to_numpy(dtype=float))
+    raw_return = numpy.where(direction != 0, (price_move / trade_dataframe['entry_price'].to_numpy(dtype=float)) * 1000000, numpy.nan)
+    trade_dataframe['raw_return'] = raw_return
+    # Calculate the excess return. Unknown order types keep an excess return of 0
+    trade_dataframe['excess_return'] = numpy.where(direction != 0, raw_return - trade_dataframe['rfr_amount'].to_numpy(dtype=float), 0.0)
+    return trade_dataframe, daily_rfr
+
+
 # Function to calculate wins and losses
 def calc_wins(trade_dataframe):
     """
     Function to calculate wins and losses for trades
     :param trade_dataframe: Dataframe containing trade data
     """
+    # Get the direction of each trade, 1 for BUY/BUY_STOP, -1 for SELL/SELL_STOP and 0 for anything else
+    direction = _trade_direction(trade_dataframe)
+    # A BUY wins when the exit is above the entry, a SELL wins when the exit is below the entry
+    entry_price = trade_dataframe['entry_price'].to_numpy()
+    exit_price = trade_dataframe['exit_price'].to_numpy()
+    win = ((direction == 1) & (exit_price > entry_price)) | ((direction == -1) & (exit_price < entry_price))
     # Add a column to the dataframe for win
-    trade_dataframe['win'] = 0
-    # Iterate through the dataframe
-    for index, row in trade_dataframe.iterrows():
-        # If the trade type was a BUY or BUY_STOP
-        if row['order_type'] == 'BUY' or row['order_type'] == 'BUY_STOP':
-            # If the trade was a win
-            if row['exit_price'] > row['entry_price']:
-                # Set the win column to 1
-                trade_dataframe.loc[index, 'win'] = 1
-        # If the trade type was a SELL or SELL_STOP
-        elif row['order_type'] == 'SELL' or row['order_type'] == 'SELL_STOP':
-            # If the trade was a win
-            if row['exit_price'] < row['entry_price']:
-                # Set the win column to 1
-                trade_dataframe.loc[index, 'win'] = 1
+    trade_dataframe['win'] = win.astype('int64')
     # Return the dataframe
     return trade_dataframe
+
+
+# Function to get the direction of each trade
+def _trade_direction(trade_dataframe):
+    """
+    Function to get the direction of each trade as an array
+    :param trade_dataframe: Dataframe containing trade data
+    :return: numpy array with 1 for BUY/BUY_STOP, -1 for SELL/SELL_STOP and 0 for any other order type
+    """
+    order_type = trade_dataframe['order_type']
+    if isinstance(order_type.dtype, pd.CategoricalDtype):
+        # Find the direction of each category once, then look it up by code. Missing values have code -1
+        categories = order_type.cat.categories
+        directions = numpy.zeros(len(categories) + 1, dtype='int8')
+        directions[:-1][categories.isin(BUY_ORDER_TYPES)] = 1
+        directions[:-1][categories.isin(SELL_ORDER_TYPES)] = -1
+        return directions[order_type.cat.codes.to_numpy()]
+    direction = numpy.zeros(len(trade_dataframe), dtype='int8')
+    direction[order_type.isin(BUY_ORDER_TYPES).to_numpy()] = 1
+    direction[order_type.isin(SELL_ORDER_TYPES).to_numpy()] = -1
+    return direction
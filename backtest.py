@@ -0,0 +1,183 @@
+import numpy
+import pandas as pd
+import analysis
+import indicators
+import candle_store
+
+
+# Rules which can generate signals, see calc_signals
+RULES = ['ema_cross', 'rsi', 'ichimoku_cloud']
+# Positions a backtest can take. long only buys, short only sells and both reverses between the two
+DIRECTIONS = ['long', 'short', 'both']
+# Prices trades are filled at. close fills at the close of the signal candle, next_open at the open of the next candle
+FILLS = ['close', 'next_open']
+
+
+# Function to calculate the signal of a rule for every candle
+def calc_signals(candle_dataframe, rule):
+    """
+    Function to calculate the signal of a rule for every candle in one vectorized pass. A signal is set
+    when its condition is met and held until the opposite condition is met, so each candle only depends
+    on itself and the candles before it. Rules are dictionaries with a 'rule' key and its settings:
+    - {'rule': 'ema_cross', 'fast': 12, 'slow': 26, 'value': 'candle_close'}: bullish while the fast EMA
+      is above the slow EMA, bearish while it's below
+    - {'rule': 'rsi', 'period': 14, 'lower': 30, 'upper': 70, 'value': 'candle_close'}: bullish once the
+      RSI falls below lower, bearish once it rises above upper
+    - {'rule': 'ichimoku_cloud', 'tenkan': 9, 'kijun': 26, 'senoku': 52}: bullish once the close is above
+      both spanA_shifted and spanB_shifted, bearish once it's below both, see indicators.calc_cloud
+    Indicators are calculated with the selected backend, see indicators.set_backend
+    :param candle_dataframe: Dataframe containing candlestick data sorted by candle_timestamp
+    :param rule: Dictionary of the rule
+    :return: Array of 1 for bullish, -1 for bearish and 0 before the first signal
+    """
+    kwargs = dict(rule)
+    name = kwargs.pop('rule', None)
+    if name == 'ema_cross':
+        fast = int(kwargs.get('fast', 12))
+        slow = int(kwargs.get('slow', 26))
+        value = kwargs.get('value', 'candle_close')
+        if fast >= slow:
+            raise ValueError(f"fast must be shorter than slow, got {fast} and {slow}")
+        # Calculate on a copy of the one column, so the candles aren't changed
+        values = candle_dataframe[[value]].copy()
+        fast_ema = indicators.calc_ema(values, period=fast, value=value, accuracy_filter=False)[f'ema_{fast}'].to_numpy(dtype=float)
+        slow_ema = indicators.calc_ema(values, period=slow, value=value, accuracy_filter=False)[f'ema_{slow}'].to_numpy(dtype=float)
+        return _hold_signals(fast_ema > slow_ema, fast_ema < slow_ema)
+    if name == 'rsi':
+        period = int(kwargs.get('period', 14))
+        lower = float(kwargs.get('lower', 30))
+        upper = float(kwargs.get('upper', 70))
+        value = kwargs.get('value', 'candle_close')
+        if lower >= upper:
+            raise ValueError(f"lower must be below upper, got {lower} and {upper}")
+        rsi = indicators.calc_rsi(candle_dataframe[[value]].copy(), period=period, value=value)['rsi'].to_numpy(dtype=float)
+        return _hold_signals(rsi < lower, rsi > upper)
+    if name == 'ichimoku_cloud':
+        span_a, span_b = indicators.calc_cloud(
+            candle_dataframe,
+            tenkan=int(kwargs.get('tenkan', 9)),
+            kijun=int(kwargs.get('kijun', 26)),
+            senoku=int(kwargs.get('senoku', 52)),
+            high_value=kwargs.get('high_value', 'high'),
+            low_value=kwargs.get('low_value', 'low')
+        )
+        close = candle_dataframe[kwargs.get('close_value', 'candle_close')].to_numpy(dtype=float)
+        # NaN spans before the cloud has values compare as False, so give no signal
+        return _hold_signals(close > numpy.maximum(span_a, span_b), close < numpy.minimum(span_a, span_b))
+    raise ValueError(f"invalid rule {name}, must be one of {RULES}")
+
+
+# Function to hold each signal until the opposite one
+def _hold_signals(bullish, bearish):
+    """
+    Function to turn the candles meeting each condition into a signal for every candle, carrying the
+    last signal forward through candles which meet neither
+    :param bullish: Boolean array of candles meeting the bullish condition
+    :param bearish: Boolean array of candles meeting the bearish condition
+    :return: Array of 1 for bullish, -1 for bearish and 0 before the first signal
+    """
+    events = bullish | bearish
+    # Position of the last candle meeting either condition, -1 before the first
+    last = numpy.maximum.accumulate(numpy.where(events, numpy.arange(len(events)), -1))
+    signal = numpy.where(bullish, 1, -1).astype('int8')
+    return numpy.where(last >= 0, signal[numpy.maximum(last, 0)], 0).astype('int8')
+
+
+# Function to turn signals into positions
+def calc_positions(signals, direction='long'):
+    """
+    Function to turn signals into the position held after each candle
+    :param signals: Array from calc_signals
+    :param direction: long holds 1 while bullish, short holds -1 while bearish, both holds the signal. Default is long
+    :return: Array of 1 for long, -1 for short and 0 for no position
+    """
+    if direction == 'long':
+        return (signals == 1).astype('int8')
+    if direction == 'short':
+        return -(signals == -1).astype('int8')
+    if direction == 'both':
+        return signals.astype('int8')
+    raise ValueError(f"invalid direction {direction}, must be one of {DIRECTIONS}")
+
+
+# Function to generate trades from positions
+def generate_trades(candle_dataframe, positions, fill='close', close_final=True):
+    """
+    Function to generate one trade for every run of candles holding the same position, with array operations.
+    A trade opens on the candle its position starts and closes on the candle the position changes, filled
+    at that candle's close or the next candle's open.
+    :param candle_dataframe: Dataframe containing candlestick data sorted by candle_timestamp
+    :param positions: Array from calc_positions
+    :param fill: close or next_open, see FILLS. Default is close
+    :param close_final: Close a trade still open at the last candle at its close, default is True. False leaves it out
+    :return: Dataframe of trades with entry_time, exit_time, entry_price, exit_price and order_type, BUY or SELL,
+    the columns analysis.calc_sharpe and analysis.calc_wins use
+    """
+    if fill not in FILLS:
+        raise ValueError(f"invalid fill {fill}, must be one of {FILLS}")
+    candles = len(positions)
+    close = candle_dataframe['candle_close'].to_numpy(dtype=float)
+    prices = close if fill == 'close' else candle_dataframe['candle_open'].to_numpy(dtype=float)
+    offset = 0 if fill == 'close' else 1
+    # Each run of the same position starts where the position changes and ends where the next run starts
+    changes = numpy.flatnonzero(positions[1:] != positions[:-1]) + 1
+    starts = numpy.concatenate(([0], changes)) if candles > 0 else numpy.empty(0, dtype=int)
+    ends = numpy.concatenate((changes, [candles])) if candles > 0 else numpy.empty(0, dtype=int)
+    held = positions[starts] != 0
+    sides = positions[starts[held]]
+    entries = starts[held] + offset
+    exits = ends[held] + offset
+    # Trades with no candle left to enter on are left out, and trades open at the end are closed or left out
+    still_open = exits > candles - 1
+    keep = (entries <= candles - 1) & (close_final | ~still_open)
+    sides, entries, exits, still_open = sides[keep], entries[keep], exits[keep], still_open[keep]
+    exits = numpy.minimum(exits, candles - 1)
+    timestamps = _timestamps(candle_dataframe)
+    return pd.DataFrame({
+        'entry_time': timestamps[entries],
+        'exit_time': timestamps[exits],
+        'entry_price': prices[entries],
+        'exit_price': numpy.where(still_open, close[exits], prices[exits]),
+        'order_type': numpy.where(sides == 1, 'BUY', 'SELL')
+    })
+
+
+# Function to read the candle timestamps as datetimes
+def _timestamps(candle_dataframe):
+    timestamps = candle_dataframe['candle_timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, unit='ms')
+    return timestamps.to_numpy()
+
+
+# Function to backtest a rule and analyse its trades
+def run_backtest(candle_dataframe, rule, direction='long', fill='close', close_final=True, start_date=None, annual_risk_free_rate=0.033, compact=False):
+    """
+    Function to generate the trades of a rule and calculate their Sharpe Ratio, ROI and win rate in one call,
+    the same as sending the trades to calc_sharpe and calc_wins
+    :param candle_dataframe: Dataframe containing candlestick data sorted by candle_timestamp, or a reference to stored candles, see candle_store.resolve
+    :param rule: Dictionary of the rule, see calc_signals
+    :param direction: long, short or both, see calc_positions. Default is long
+    :param fill: close or next_open, see generate_trades. Default is close
+    :param close_final: Close a trade still open at the last candle, default is True
+    :param start_date: Date the risk free rate starts accumulating from, default is the date of the first candle
+    :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param compact: Skip the risk free columns which are the same for every trade, see analysis.calc_returns
+    :return: Dictionary of trades (dataframe of trades with their returns and wins), sharpe_data (from analysis.calc_sharpe),
+    wins, losses and win_rate
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    positions = calc_positions(calc_signals(candle_dataframe, rule), direction)
+    trades = generate_trades(candle_dataframe, positions, fill, close_final)
+    if start_date is None:
+        start_date = pd.Timestamp(_timestamps(candle_dataframe)[0]).normalize() if len(candle_dataframe) > 0 else pd.Timestamp(0)
+    sharpe_data = analysis.calc_sharpe(trades, start_date, None, annual_risk_free_rate, compact=compact)
+    # calc_sharpe adds the win column to the trades
+    wins = int(trades['win'].sum())
+    return {
+        'trades': trades,
+        'sharpe_data': sharpe_data,
+        'wins': wins,
+        'losses': len(trades) - wins,
+        'win_rate': wins / len(trades) if len(trades) > 0 else numpy.nan
+    }
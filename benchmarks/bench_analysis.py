@@ -0,0 +1,125 @@
+"""
+Benchmark for analysis.calc_wins and analysis.calc_sharpe.
+
+Compares the vectorized implementations against the original iterrows versions
+and confirms both produce the same results.
+
+Usage:
+    python benchmarks/bench_analysis.py
+    python benchmarks/bench_analysis.py --sizes 10000 100000 --legacy-max 100000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy
+import pandas
+
+# Make the function app modules importable when run from the repo root or the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import analysis
+
+
+# Function to build a synthetic trade dataframe
+def make_trades(size, seed=42):
+    """
+    Function to build a synthetic trade dataframe
+    :param size: Number of trades to generate
+    :param seed: Seed for the random number generator
+    """
+    rng = numpy.random.default_rng(seed)
+    start = pandas.Timestamp('2023-01-01')
+    entry_time = start + pandas.to_timedelta(rng.integers(0, 365 * 86400, size), unit='s')
+    exit_time = entry_time + pandas.to_timedelta(rng.integers(60, 3 * 86400, size), unit='s')
+    entry_price = rng.uniform(90, 110, size).round(2)
+    trade_dataframe = pandas.DataFrame({
+        'order_type': rng.choice(['BUY', 'BUY_STOP', 'SELL', 'SELL_STOP'], size),
+        'entry_price': entry_price,
+        'exit_price': (entry_price * rng.normal(1, 0.01, size)).round(2),
+        'entry_time': entry_time,
+        'exit_time': exit_time
+    })
+    return trade_dataframe.sort_values(by='exit_time')
+
+
+# Original row by row implementation of calc_wins, kept for comparison
+def legacy_calc_wins(trade_dataframe):
+    trade_dataframe['win'] = 0
+    for index, row in trade_dataframe.iterrows():
+        if row['order_type'] == 'BUY' or row['order_type'] == 'BUY_STOP':
+            if row['exit_price'] > row['entry_price']:
+                trade_dataframe.loc[index, 'win'] = 1
+        elif row['order_type'] == 'SELL' or row['order_type'] == 'SELL_STOP':
+            if row['exit_price'] < row['entry_price']:
+                trade_dataframe.loc[index, 'win'] = 1
+    return trade_dataframe
+
+
+# Original row by row implementation of the calc_sharpe return loop, kept for comparison
+def legacy_calc_sharpe(trade_dataframe, start_date, end_date, annual_risk_free_rate=0.033):
+    daily_rfr = (1 + annual_risk_free_rate)**(1/365) - 1
+    trade_dataframe['daily_rfr'] = daily_rfr
+    trade_dataframe['days_from_start'] = (trade_dataframe['exit_time'] - start_date).dt.days
+    trade_dataframe['cumulative_rfr'] = trade_dataframe['daily_rfr'] * trade_dataframe['days_from_start']
+    trade_dataframe = legacy_calc_wins(trade_dataframe)
+    # Start as float so newer pandas versions accept the row by row float assignment
+    trade_dataframe['excess_return'] = 0.0
+    trade_dataframe['rfr_amount'] = 1000000 * trade_dataframe['cumulative_rfr']
+    for index, row in trade_dataframe.iterrows():
+        if row['order_type'] == 'BUY' or row['order_type'] == 'BUY_STOP':
+            trade_dataframe.loc[index, 'excess_return'] = ((row['exit_price'] - row['entry_price'])/row['entry_price']) * 1000000 - row['rfr_amount']
+            trade_dataframe.loc[index, 'raw_return'] = ((row['exit_price'] - row['entry_price'])/row['entry_price']) * 1000000
+        elif row['order_type'] == 'SELL' or row['order_type'] == 'SELL_STOP':
+            trade_dataframe.loc[index, 'excess_return'] = ((row['entry_price'] - row['exit_price'])/row['entry_price']) * 1000000 - row['rfr_amount']
+            trade_dataframe.loc[index, 'raw_return'] = ((row['entry_price'] - row['exit_price'])/row['entry_price']) * 1000000
+    raw_return = trade_dataframe['raw_return'].sum()
+    grouped = trade_dataframe.groupby([trade_dataframe['exit_time'].dt.date]).agg(
+        {'exit_time': 'count', 'excess_return': 'sum', 'rfr_amount': 'first'}
+    )
+    return {
+        'roi': raw_return / (grouped['exit_time'].max() * 1000000),
+        'sharpe_ratio': (grouped['excess_return'].mean() - daily_rfr) / grouped['excess_return'].std(),
+        'daily_breakdown': grouped.to_json(orient='index'),
+        'raw_return': raw_return
+    }
+
+
+# Function to time a callable
+def time_call(function, *args, **kwargs):
+    """
+    Function to time a single call
+    :return: Tuple of (seconds taken, result)
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vectorized calc_wins and calc_sharpe')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=1000000, help='Largest size to run the iterrows versions on')
+    args = parser.parse_args()
+    start_date = pandas.Timestamp('2023-01-01')
+    print(f"{'function':<12}{'trades':>10}{'vectorized_s':>15}{'iterrows_s':>15}{'speedup':>10}")
+    for size in args.sizes:
+        trades = make_trades(size)
+        for name, new_function, old_function, call_args in [
+            ('calc_wins', analysis.calc_wins, legacy_calc_wins, ()),
+            ('calc_sharpe', analysis.calc_sharpe, legacy_calc_sharpe, (start_date, None)),
+        ]:
+            new_time, new_result = time_call(new_function, trades.copy(), *call_args)
+            if size > args.legacy_max:
+                print(f"{name:<12}{size:>10}{new_time:>15.4f}{'skipped':>15}{'-':>10}")
+                continue
+            old_time, old_result = time_call(old_function, trades.copy(), *call_args)
+            # Confirm the vectorized version returns exactly the same values
+            if isinstance(new_result, dict):
+                assert new_result == old_result, f'{name} results differ at {size} trades'
+            else:
+                assert (new_result['win'].to_numpy() == old_result['win'].to_numpy()).all(), f'{name} results differ at {size} trades'
+            print(f"{name:<12}{size:>10}{new_time:>15.4f}{old_time:>15.4f}{old_time / new_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
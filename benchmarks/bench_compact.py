@@ -0,0 +1,106 @@
+"""
+Report on compact dtypes against the default dtypes.
+
+Runs the indicator and analysis calculations on the same data with and without
+compact_dtypes, and prints the memory held by the input dataframe, the peak memory
+allocated by the calculation and the largest difference in the results.
+
+Usage:
+    python benchmarks/bench_compact.py
+    python benchmarks/bench_compact.py --sizes 100000 1000000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+import numpy
+import pandas
+
+# Make the function app modules importable when run from the repo root or the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import analysis
+import compact_dtypes
+import indicators
+import metrics
+from bench_analysis import make_trades
+from bench_kernels import make_candles
+
+START_DATE = pandas.Timestamp('2023-01-01')
+
+
+# Function to pull the numbers out of a calculation result
+def result_values(result):
+    """
+    Function to flatten a calculation result into one float array, so results can be compared
+    :param result: Dataframe, dictionary of numbers or dictionary of window metrics
+    """
+    if isinstance(result, pandas.DataFrame):
+        return numpy.concatenate([result[column].to_numpy(dtype=float) for column in result.columns if result[column].dtype.kind == 'f'])
+    values = []
+    for value in result.values():
+        if isinstance(value, dict):
+            values.append(result_values(value))
+        elif isinstance(value, numpy.ndarray) and value.dtype.kind == 'f':
+            values.append(value)
+        elif isinstance(value, (int, float, numpy.number)) and not isinstance(value, bool):
+            values.append(numpy.array([value], dtype=float))
+    return numpy.concatenate(values) if values else numpy.empty(0)
+
+
+# The calculations to compare, each as (name of the data, calculation taking the data and compact)
+CALCULATIONS = {
+    'calc_rsi': ('candles', lambda candles, compact: indicators.calc_rsi(candles, period=14)),
+    'calc_ema': ('candles', lambda candles, compact: indicators.calc_ema(candles, period=20, accuracy_filter=False)),
+    'calc_ichimoku': ('candles', lambda candles, compact: indicators.calc_ichimoku(candles, new_columns_only=True)),
+    'calc_sharpe': ('trades', lambda trades, compact: {
+        key: value for key, value in analysis.calc_sharpe(trades, START_DATE, None, compact=compact).items() if key != 'daily_breakdown'
+    }),
+    'calc_rolling_metrics': ('trades', lambda trades, compact: metrics.calc_rolling_metrics(trades, START_DATE, windows=[20], compact=compact)),
+}
+
+
+# Function to run a calculation and measure its memory
+def run(calculation, data, compact):
+    """
+    Function to run a calculation on a copy of the data, with compact dtypes or without
+    :return: Tuple of (bytes held by the input dataframe, peak bytes allocated, result values)
+    """
+    data = data.copy()
+    if compact:
+        data = compact_dtypes.compact_trades(data) if 'order_type' in data.columns else compact_dtypes.compact_candles(data)
+    held = int(data.memory_usage(index=False, deep=True).sum())
+    tracemalloc.start()
+    result = calculation(data, compact)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return held, peak, result_values(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare compact dtypes against the default dtypes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    print(f"{'function':<22}{'rows':>9}{'input_MB':>10}{'compact_MB':>12}{'peak_MB':>10}{'compact_MB':>12}{'max_abs_delta':>15}{'max_rel_delta':>15}")
+    # Run each calculation once first, so JIT compiling and imports aren't counted in the peak
+    warmup = {'candles': make_candles(200), 'trades': make_trades(200)}
+    for data_name, calculation in CALCULATIONS.values():
+        run(calculation, warmup[data_name], False)
+        run(calculation, warmup[data_name], True)
+    for size in args.sizes:
+        data = {'candles': make_candles(size), 'trades': make_trades(size)}
+        for name, (data_name, calculation) in CALCULATIONS.items():
+            held, peak, values = run(calculation, data[data_name], False)
+            compact_held, compact_peak, compact_values = run(calculation, data[data_name], True)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                delta = numpy.abs(compact_values - values)
+                relative = delta / numpy.abs(values)
+            max_delta = numpy.nanmax(delta) if numpy.isfinite(delta).any() else 0.0
+            max_relative = numpy.nanmax(relative[numpy.isfinite(relative)]) if numpy.isfinite(relative).any() else 0.0
+            print(
+                f"{name:<22}{size:>9}{held / 1e6:>10.2f}{compact_held / 1e6:>12.2f}"
+                f"{peak / 1e6:>10.2f}{compact_peak / 1e6:>12.2f}{max_delta:>15.3g}{max_relative:>15.3g}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark and equivalence check for the indicator backends.
+
+Runs calc_rsi, calc_ema and calc_ichimoku with the pandas_ta backend and the native
+kernel backend, checks the outputs agree, and reports the time per call for each.
+
+Usage:
+    python benchmarks/bench_kernels.py
+    python benchmarks/bench_kernels.py --sizes 500 2000 --repeat 50
+"""
+import argparse
+import os
+import sys
+import time
+import numpy
+import pandas
+
+# Make the function app modules importable when run from the repo root or the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import indicators
+import kernels
+
+
+# Function to build a synthetic candle dataframe
+def make_candles(size, seed=42):
+    """
+    Function to build a synthetic candle dataframe with a random walk close
+    :param size: Number of candles to generate
+    :param seed: Seed for the random number generator
+    """
+    rng = numpy.random.default_rng(seed)
+    close = 100 + numpy.cumsum(rng.normal(0, 1, size))
+    return pandas.DataFrame({
+        'candle_timestamp': pandas.to_datetime(1600000000000 + numpy.arange(size) * 60000, unit='ms'),
+        'candle_open': close + rng.normal(0, 0.2, size),
+        'high': close + numpy.abs(rng.normal(0, 1, size)),
+        'low': close - numpy.abs(rng.normal(0, 1, size)),
+        'candle_close': close
+    })
+
+
+# The calculations to compare
+CALCULATIONS = {
+    'calc_rsi': lambda candles: indicators.calc_rsi(candles, period=14),
+    'calc_ema': lambda candles: indicators.calc_ema(candles, period=20, accuracy_filter=False),
+    'calc_ichimoku': lambda candles: indicators.calc_ichimoku(candles)
+}
+
+
+# Function to time a calculation with a backend
+def time_backend(backend, calculation, candles, repeat):
+    """
+    Function to time a calculation with the given backend
+    :return: Tuple of (median seconds per call, result of the last call)
+    """
+    indicators.set_backend(backend)
+    timings = []
+    for _ in range(repeat):
+        candle_copy = candles.copy()
+        start = time.perf_counter()
+        result = calculation(candle_copy)
+        timings.append(time.perf_counter() - start)
+    return float(numpy.median(timings)), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pandas_ta and native indicator backends')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Largest relative difference allowed between backends')
+    args = parser.parse_args()
+    print(f"numba JIT: {'on' if kernels.load_numba() else 'off'}")
+    print(f"{'function':<15}{'candles':>10}{'pandas_ta_ms':>15}{'native_ms':>12}{'speedup':>10}{'max_rel_diff':>15}")
+    for size in args.sizes:
+        candles = make_candles(size)
+        for name, calculation in CALCULATIONS.items():
+            # Run the native kernels once first so JIT compile time isn't counted
+            time_backend('native', calculation, candles, 1)
+            native_time, native_result = time_backend('native', calculation, candles, args.repeat)
+            pandas_ta_time, pandas_ta_result = time_backend('pandas_ta', calculation, candles, args.repeat)
+            # Compare every column the calculation added
+            assert list(native_result.columns) == list(pandas_ta_result.columns), f'{name} columns differ'
+            assert native_result.index.equals(pandas_ta_result.index), f'{name} rows differ'
+            max_difference = 0.0
+            for column in native_result.columns.difference(candles.columns):
+                expected = pandas_ta_result[column].to_numpy(dtype=float)
+                actual = native_result[column].to_numpy(dtype=float)
+                assert (numpy.isnan(expected) == numpy.isnan(actual)).all(), f'{name} {column} NaN positions differ'
+                scale = numpy.maximum(numpy.abs(expected), 1.0)
+                difference = numpy.nanmax(numpy.abs(actual - expected) / scale, initial=0.0)
+                max_difference = max(max_difference, float(difference))
+            assert max_difference <= args.tolerance, f'{name} differs by {max_difference} at {size} candles'
+            print(f"{name:<15}{size:>10}{pandas_ta_time * 1000:>15.3f}{native_time * 1000:>12.3f}"
+                  f"{pandas_ta_time / native_time:>9.1f}x{max_difference:>15.2e}")
+    indicators.set_backend('pandas_ta')
+
+
+if __name__ == '__main__':
+    main()
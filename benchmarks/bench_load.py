@@ -0,0 +1,110 @@
+"""
+Load test of the async routes and the compute pool.
+
+For each number of compute workers, starts a fresh interpreter with COMPUTE_WORKERS set,
+and sends a mix of small calc-rsi requests and large calc-ichimoku requests to the async
+handlers in process, with a fixed number of requests in flight. Prints the throughput,
+the p50 and p99 latency of the small and large requests, and the number of large requests
+turned away by admission control. Throughput should grow with the workers up to the
+number of cores, and the small requests should stay fast while large ones are running.
+
+Usage:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --workers 1 2 4 8 --requests 400 --concurrency 32 --large-share 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# Function run in the fresh interpreter to send the requests
+def child(args):
+    """
+    Function to send the requests to the handlers and print a JSON dictionary of the results
+    """
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bench_suite
+    import compute_pool
+    import function_app
+    handlers = {}
+    for function in function_app.app.get_functions():
+        for binding in function.get_bindings():
+            route = getattr(binding, 'route', None)
+            if route is not None:
+                handlers[route] = function.get_user_function()
+    bodies = {
+        'small': ('calc-rsi', {'rsi_length': 14, 'candlestick_data': bench_suite.records(bench_suite.make_candles(args.small_candles))}),
+        'large': ('calc-ichimoku', {'candlestick_data': bench_suite.records(bench_suite.make_candles(args.large_candles))})
+    }
+    requests = {kind: bench_suite.make_request(route, body) for kind, (route, body) in bodies.items()}
+    random = numpy.random.default_rng(0)
+    kinds = numpy.where(random.random(args.requests) < args.large_share, 'large', 'small')
+
+    async def send_all():
+        latencies = {'small': [], 'large': []}
+        statuses = {}
+        limit = asyncio.Semaphore(args.concurrency)
+
+        async def send(kind):
+            async with limit:
+                route = bodies[kind][0]
+                start = time.perf_counter()
+                response = await handlers[route](requests[kind])
+                latencies[kind].append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # Warm up the kernels and the pools before timing
+        await asyncio.gather(*(handlers[route](request) for (route, _), request in zip(bodies.values(), requests.values())))
+        start = time.perf_counter()
+        await asyncio.gather(*(send(kind) for kind in kinds))
+        return time.perf_counter() - start, latencies, statuses
+
+    elapsed, latencies, statuses = asyncio.run(send_all())
+    result = {'elapsed': elapsed, 'statuses': statuses, 'pool': compute_pool.stats()}
+    for kind, values in latencies.items():
+        result[kind] = [float(numpy.percentile(values, 50)), float(numpy.percentile(values, 99))] if values else [numpy.nan, numpy.nan]
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the async routes with different numbers of compute workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--large-share', type=float, default=0.1, help='Share of the requests which are large')
+    parser.add_argument('--small-candles', type=int, default=500)
+    parser.add_argument('--large-candles', type=int, default=100000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+    print(f"cores: {os.cpu_count()}")
+    print(f"{'workers':>8}{'req/s':>9}{'small_p50_ms':>14}{'small_p99_ms':>14}{'large_p50_ms':>14}{'large_p99_ms':>14}{'rejected':>10}")
+    for workers in args.workers:
+        environment = dict(os.environ, COMPUTE_WORKERS=str(workers), RESULT_CACHE_ENABLED='false', REQUEST_TIMING_SAMPLE_RATE='0')
+        environment['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))
+        arguments = [
+            sys.executable, os.path.abspath(__file__), '--child', '--requests', str(args.requests),
+            '--concurrency', str(args.concurrency), '--large-share', str(args.large_share),
+            '--small-candles', str(args.small_candles), '--large-candles', str(args.large_candles)
+        ]
+        output = subprocess.run(arguments, cwd=ROOT, env=environment, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        rejected = result['statuses'].get('503', 0)
+        print(
+            f"{workers:>8}{args.requests / result['elapsed']:>9.1f}{result['small'][0] * 1000:>14.1f}{result['small'][1] * 1000:>14.1f}"
+            f"{result['large'][0] * 1000:>14.1f}{result['large'][1] * 1000:>14.1f}{rejected:>10}"
+        )
+
+
+if __name__ == '__main__':
+    main()
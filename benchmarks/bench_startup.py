@@ -0,0 +1,151 @@
+"""
+Report on the cold start of the function app.
+
+Imports function_app in a fresh interpreter with python -X importtime and prints the
+cumulative import time of each module it imports directly and of the large libraries.
+Then, for each route, starts a fresh interpreter which imports function_app and times the
+first and second request, with and without startup.warm_up run first, along with the
+time the warm up took.
+
+numba writes compiled kernels to its cache, so later processes only load them. Pass
+--cold-cache to give every process an empty cache, as a new instance of the app has.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --routes calc-sweep calc-ema --backend native --cold-cache
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Libraries which take a large share of the import time, reported as well as the app modules
+LIBRARIES = ['numpy', 'pandas', 'pyarrow', 'azure.functions', 'numba', 'pandas_ta']
+DEFAULT_ROUTES = ['calc-rsi', 'calc-ema', 'calc-ichimoku', 'calc-sweep', 'calc-sharpe']
+
+
+# Function to run a Python snippet in a fresh interpreter
+def run_python(arguments, environment):
+    """
+    Function to run the interpreter in the repo root with the arguments
+    :return: The completed process, with stdout and stderr as text
+    """
+    return subprocess.run(
+        [sys.executable, *arguments], cwd=ROOT, env=environment, capture_output=True, text=True, check=True
+    )
+
+
+# Function to measure the import time of each module
+def import_times(environment):
+    """
+    Function to import function_app with -X importtime and read the cumulative time of each module
+    :return: Dictionary of module name to cumulative import time in milliseconds
+    """
+    result = run_python(['-X', 'importtime', '-c', 'import function_app'], environment)
+    times = {}
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:       123 |       4567 |   module"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.setdefault(name.strip(), int(cumulative) / 1000)
+    return times
+
+
+# Function to find the modules function_app imports directly
+def app_modules():
+    """
+    Function to read the modules imported at the top of function_app.py
+    :return: List of module names
+    """
+    modules = []
+    with open(os.path.join(ROOT, 'function_app.py')) as file:
+        for line in file:
+            if line.startswith('import '):
+                modules.append(line.split()[1])
+    return modules
+
+
+# Function run in the fresh interpreter to time the first requests to a route
+def child(route, warm):
+    """
+    Function to import function_app, optionally warm up, then time the first and second request to the route
+    Prints a JSON dictionary of the timings in seconds
+    """
+    start = time.perf_counter()
+    import function_app
+    import startup
+    imported = time.perf_counter() - start
+    warm_up = startup.warm_up()['total_seconds'] if warm else 0.0
+    # Built after the timed import, so building the body doesn't count towards it
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bench_suite
+    dataset, make_body = bench_suite.ROUTE_BODIES[route]
+    data = bench_suite.make_candles(2000) if dataset == 'candles' else bench_suite.make_trades(2000)
+    body = make_body(data)
+    handler = bench_suite.route_handlers()[route]
+    requests = []
+    for _ in range(2):
+        start = time.perf_counter()
+        handler(bench_suite.make_request(route, body))
+        requests.append(time.perf_counter() - start)
+    print(json.dumps({'import': imported, 'warm_up': warm_up, 'first': requests[0], 'second': requests[1]}))
+
+
+# Function to time the first requests to a route in a fresh interpreter
+def first_requests(route, warm, environment, cold_cache):
+    """
+    Function to run child in a fresh interpreter
+    :return: Dictionary of import, warm_up, first and second request times in seconds
+    """
+    environment = dict(environment)
+    with tempfile.TemporaryDirectory() as cache_directory:
+        if cold_cache:
+            environment['NUMBA_CACHE_DIR'] = cache_directory
+        result = run_python([os.path.abspath(__file__), '--child', route, '--warm' if warm else '--cold'], environment)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report on the cold start of the function app')
+    parser.add_argument('--routes', nargs='+', default=DEFAULT_ROUTES)
+    parser.add_argument('--backend', choices=['pandas_ta', 'native'], default=None, help='Sets INDICATOR_BACKEND')
+    parser.add_argument('--cold-cache', action='store_true', help='Give every process an empty numba cache')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, ROOT)
+        child(args.child, args.warm)
+        return
+    environment = dict(os.environ, RESULT_CACHE_ENABLED='false', WARM_UP_ON_START='false')
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))
+    if args.backend:
+        environment['INDICATOR_BACKEND'] = args.backend
+
+    times = import_times(environment)
+    print(f"{'module':<24}{'import_ms':>11}")
+    print(f"{'function_app':<24}{times.get('function_app', 0.0):>11.1f}")
+    modules = app_modules()
+    for module in modules + [library for library in LIBRARIES if library not in modules]:
+        if module in times:
+            print(f"{module:<24}{times[module]:>11.1f}")
+    print('Modules imported on first use, not at startup: ' + ', '.join(module for module in LIBRARIES if module not in times))
+
+    print(f"\n{'route':<24}{'mode':>6}{'import_ms':>11}{'warm_up_ms':>12}{'first_ms':>10}{'second_ms':>11}")
+    for route in args.routes:
+        for warm in [False, True]:
+            result = first_requests(route, warm, environment, args.cold_cache)
+            print(
+                f"{route:<24}{'warm' if warm else 'cold':>6}{result['import'] * 1000:>11.1f}{result['warm_up'] * 1000:>12.1f}"
+                f"{result['first'] * 1000:>10.1f}{result['second'] * 1000:>11.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
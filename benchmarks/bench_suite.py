@@ -0,0 +1,402 @@
+"""
+Benchmark suite for the indicator and analysis functions and every function app route.
+
+Generates synthetic candle and trade data at several sizes, times each indicators, metrics and
+analysis function, and drives each function_app handler in process with HttpRequest objects.
+Each route is also split into its parse, compute and serialize phases. Reports throughput,
+p50 and p99 latency and peak traced memory as JSON, and can compare against an earlier report.
+
+Usage:
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --sizes 1000 10000 --repeat 10 --compare baseline.json
+    python benchmarks/bench_suite.py --only calc-rsi calc_sharpe
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy
+import pandas
+
+# Make the function app modules importable when run from the repo root or the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Time the calculations rather than cache lookups
+os.environ['RESULT_CACHE_ENABLED'] = 'false'
+import azure.functions as func
+import analysis
+import backtest
+import function_app
+import indicator_state
+import indicators
+import metrics
+import resample
+import wire_format
+from bench_analysis import make_trades
+from bench_kernels import make_candles
+
+
+# Date the synthetic trades start from
+START_DATE = pandas.Timestamp('2023-01-01')
+# Indicators requested by the multiple indicator benchmarks
+INDICATOR_SPECS = [
+    {'indicator': 'ema', 'period': 20},
+    {'indicator': 'ema', 'period': 50},
+    {'indicator': 'rsi', 'period': 14},
+    {'indicator': 'ichimoku'}
+]
+# Number of symbols the multiple symbol benchmarks split the candles into
+SYMBOLS = 8
+# Number of strategies the portfolio benchmarks spread the trades over
+STRATEGIES = 100
+
+
+# Function to split candles into several symbols
+def make_symbol_candles(candles):
+    """
+    Function to split candles into SYMBOLS equal runs, one per symbol
+    :param candles: Candle dataframe from make_candles
+    :return: Dictionary of symbol to candle dataframe
+    """
+    bounds = numpy.linspace(0, len(candles), SYMBOLS + 1).astype(int)
+    return {
+        f'SYM{number}': candles.iloc[bounds[number]:bounds[number + 1]].reset_index(drop=True)
+        for number in range(SYMBOLS)
+    }
+
+
+# Function to spread trades over several strategies
+def with_strategies(trades):
+    """
+    Function to add a strategy column, assigning the trades to STRATEGIES strategies in turn
+    :param trades: Trade dataframe from make_trades
+    """
+    return trades.assign(strategy=[f'STRAT{number % STRATEGIES}' for number in range(len(trades))])
+
+
+# Functions to benchmark, as name to (dataset, function of the dataset)
+FUNCTIONS = {
+    'indicators.calc_rsi': ('candles', lambda candles: indicators.calc_rsi(candles, period=14)),
+    'indicators.calc_ema': ('candles', lambda candles: indicators.calc_ema(candles, period=20)),
+    'indicators.calc_ichimoku': ('candles', lambda candles: indicators.calc_ichimoku(candles)),
+    'indicators.calc_indicators': ('candles', lambda candles: indicators.calc_indicators(candles, INDICATOR_SPECS)),
+    'indicators.calc_sweep': ('candles', lambda candles: indicators.calc_sweep(candles, 'ema', range(5, 201))),
+    'resample.calc_multi_timeframe': (
+        'candles', lambda candles: resample.calc_multi_timeframe(candles, ['5m', '1h', '1d'], INDICATOR_SPECS)
+    ),
+    'indicators.calc_indicators_multi': (
+        'candles', lambda candles: indicators.calc_indicators_multi(make_symbol_candles(candles), INDICATOR_SPECS, max_workers=1)
+    ),
+    'indicator_state.IndicatorState.update': (
+        'candles', lambda candles: indicator_state.IndicatorState(INDICATOR_SPECS).update(candles)
+    ),
+    'backtest.run_backtest': (
+        'candles', lambda candles: backtest.run_backtest(candles, {'rule': 'ema_cross', 'fast': 12, 'slow': 26}, direction='both')
+    ),
+    'analysis.calc_wins': ('trades', lambda trades: analysis.calc_wins(trades)),
+    'analysis.calc_returns': ('trades', lambda trades: analysis.calc_returns(trades, START_DATE)),
+    'analysis.calc_sharpe': ('trades', lambda trades: analysis.calc_sharpe(trades, START_DATE, None)),
+    'metrics.calc_rolling_metrics': (
+        'trades', lambda trades: metrics.calc_rolling_metrics(trades, START_DATE, windows=(20, 60), expanding=True)
+    ),
+    'metrics.calc_portfolio': ('trades', lambda trades: metrics.calc_portfolio(with_strategies(trades), START_DATE))
+}
+
+
+# Function to convert a dataframe into the JSON records string the routes accept
+def records(dataframe):
+    """
+    Function to convert a dataframe to a JSON records string with datetimes as milliseconds
+    :param dataframe: Dataframe to convert
+    """
+    return dataframe.to_json(orient='records')
+
+
+# Functions to build the JSON body of each route from the candles or trades
+ROUTE_BODIES = {
+    'calc-rsi': ('candles', lambda candles: {'rsi_length': 14, 'candlestick_data': records(candles)}),
+    'calc-ema': ('candles', lambda candles: {'ema_length': 20, 'candlestick_data': records(candles)}),
+    'calc-ichimoku': ('candles', lambda candles: {'candlestick_data': records(candles)}),
+    'calc-indicators': ('candles', lambda candles: {'indicators': INDICATOR_SPECS, 'candlestick_data': records(candles)}),
+    'calc-sweep': ('candles', lambda candles: {'sweep_indicator': 'ema', 'candlestick_data': records(candles)}),
+    'calc-multi-timeframe': ('candles', lambda candles: {
+        'timeframes': ['5m', '1h', '1d'], 'indicators': INDICATOR_SPECS, 'candlestick_data': records(candles)
+    }),
+    'calc-indicators-multi': ('candles', lambda candles: {
+        'indicators': INDICATOR_SPECS,
+        'symbols': {symbol: records(part) for symbol, part in make_symbol_candles(candles).items()}
+    }),
+    'update-indicators': ('candles', lambda candles: {'indicators': INDICATOR_SPECS, 'candlestick_data': records(candles)}),
+    'calc-backtest': ('candles', lambda candles: {
+        'rule': {'rule': 'ema_cross', 'fast': 12, 'slow': 26}, 'direction': 'both', 'candlestick_data': records(candles)
+    }),
+    'calc-sharpe': ('trades', lambda trades: {
+        'start_date': str(START_DATE.date()), 'end_date': '2024-01-01', 'trade_data': records(trades)
+    }),
+    'calc-rolling-metrics': ('trades', lambda trades: {
+        'start_date': str(START_DATE.date()), 'windows': [20, 60], 'expanding': True, 'trade_data': records(trades)
+    }),
+    'calc-wins': ('trades', lambda trades: {'trade_data': records(trades)}),
+    'calc-portfolio': ('trades', lambda trades: {'start_date': str(START_DATE.date()), 'trade_data': records(with_strategies(trades))})
+}
+
+
+# Functions which run the compute phase of each route on the parsed request, returning (payload, dataframe)
+def _compute_candles(function):
+    def compute(params, dataframe):
+        dataframe['candle_timestamp'] = pandas.to_datetime(dataframe['candle_timestamp'], unit='ms')
+        return {}, function(dataframe.sort_values(by='candle_timestamp'), params)
+    return compute
+
+
+def _compute_multi(params, dataframe):
+    symbol_candles = {}
+    for symbol, candlestick_data in params['symbols'].items():
+        candles = pandas.DataFrame(json.loads(candlestick_data))
+        candles['candle_timestamp'] = pandas.to_datetime(candles['candle_timestamp'], unit='ms')
+        symbol_candles[symbol] = candles.sort_values(by='candle_timestamp')
+    # The default pool, the same as the route
+    results, errors = indicators.calc_indicators_multi(symbol_candles, params['indicators'])
+    return {'symbol_errors': errors}, pandas.concat(results, names=['symbol']).reset_index(level=0)
+
+
+def _compute_trades(function):
+    def compute(params, dataframe):
+        dataframe['exit_time'] = pandas.to_datetime(dataframe['exit_time'], unit='ms')
+        if 'entry_time' in dataframe.columns:
+            dataframe['entry_time'] = pandas.to_datetime(dataframe['entry_time'], unit='ms')
+        return function(dataframe, params)
+    return compute
+
+
+def _compute_sharpe(dataframe, params):
+    result = analysis.calc_sharpe(dataframe, pandas.to_datetime(params['start_date']), pandas.to_datetime(params['end_date']))
+    return {key: float(value) if isinstance(value, (float, numpy.floating)) else value for key, value in result.items()}, None
+
+
+def _compute_rolling(dataframe, params):
+    results = metrics.calc_rolling_metrics(dataframe, pandas.to_datetime(params['start_date']), windows=params['windows'], expanding=True)
+    payload = {
+        str(key): {name: function_app.json_array(array) for name, array in value.items()}
+        for key, value in results.items() if isinstance(value, dict)
+    }
+    return payload, None
+
+
+ROUTE_COMPUTE = {
+    'calc-rsi': _compute_candles(lambda candles, params: indicators.calc_rsi(candles, period=14)),
+    'calc-ema': _compute_candles(lambda candles, params: indicators.calc_ema(candles, period=20)),
+    'calc-ichimoku': _compute_candles(lambda candles, params: indicators.calc_ichimoku(candles)),
+    'calc-indicators': _compute_candles(lambda candles, params: indicators.calc_indicators(candles, params['indicators'])),
+    'calc-sweep': _compute_candles(lambda candles, params: indicators.calc_sweep(candles, 'ema', range(5, 201))),
+    'calc-indicators-multi': _compute_multi,
+    'update-indicators': _compute_candles(
+        lambda candles, params: indicator_state.IndicatorState(params['indicators']).update(candles)
+    ),
+    'calc-sharpe': _compute_trades(_compute_sharpe),
+    'calc-rolling-metrics': _compute_trades(_compute_rolling),
+    'calc-wins': _compute_trades(lambda trades, params: ({}, analysis.calc_wins(trades)))
+}
+
+
+# Function to find the handler of a route
+def route_handlers():
+    """
+    Function to find the handler of every route registered on the function app. Async handlers are
+    wrapped to run on an event loop, so every handler can be called with the request and returns the response
+    :return: Dictionary of route to handler function
+    """
+    handlers = {}
+    for function in function_app.app.get_functions():
+        for binding in function.get_bindings():
+            route = getattr(binding, 'route', None)
+            if route is not None:
+                handlers[route] = sync_handler(function.get_user_function())
+    return handlers
+
+
+# Function to call an async handler like a synchronous one
+def sync_handler(handler):
+    """
+    Function to wrap an async handler so it runs to completion when called
+    :param handler: Handler function, async or not
+    """
+    if not inspect.iscoroutinefunction(handler):
+        return handler
+    return lambda req: asyncio.run(handler(req))
+
+
+# Function to build a request for a route
+def make_request(route, body):
+    """
+    Function to build a JSON POST request for a route
+    :param route: Name of the route
+    :param body: Dictionary of the JSON body
+    """
+    return func.HttpRequest(
+        method='POST',
+        url=f'/api/{route}',
+        headers={'Content-Type': wire_format.JSON_CONTENT_TYPE},
+        body=json.dumps(body).encode('utf-8')
+    )
+
+
+# Function to time repeated calls
+def measure(function, make_args, repeat):
+    """
+    Function to time repeated calls, then run once more with tracemalloc to find the peak memory.
+    The arguments are rebuilt before each call and not timed, as the functions modify their input.
+    :param function: Function to time
+    :param make_args: Function returning the arguments tuple for one call
+    :param repeat: Number of timed calls
+    :return: Dictionary of timings in milliseconds and peak memory in bytes
+    """
+    # Run once first so imports and JIT compiling aren't counted
+    function(*make_args())
+    timings = []
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    args = make_args()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings = numpy.array(timings) * 1000
+    return {
+        'p50_ms': float(numpy.percentile(timings, 50)),
+        'p99_ms': float(numpy.percentile(timings, 99)),
+        'mean_ms': float(timings.mean()),
+        'peak_bytes': int(peak)
+    }
+
+
+# Function to find the median time of a phase
+def phase_median(function, make_args, repeat):
+    timings = []
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return float(numpy.median(timings) * 1000)
+
+
+# Function to benchmark a route and its phases
+def bench_route(route, handler, body, repeat):
+    """
+    Function to benchmark a whole route call, then its parse, compute and serialize phases on their own
+    :param route: Name of the route
+    :param handler: Handler function of the route
+    :param body: Dictionary of the JSON body
+    :param repeat: Number of timed calls
+    """
+    request = make_request(route, body)
+    result = measure(handler, lambda: (request,), repeat)
+    response = handler(request)
+    result['status_code'] = response.status_code
+    result['response_bytes'] = len(response.get_body())
+    result['request_bytes'] = len(request.get_body())
+    data_key = 'trade_data' if 'trade_data' in body else 'candlestick_data'
+    if route in ROUTE_COMPUTE:
+        compute = ROUTE_COMPUTE[route]
+        params, dataframe = wire_format.read_request(request, data_key)
+        payload, output = compute(params, None if dataframe is None else dataframe.copy())
+        result['phases_ms'] = {
+            'parse': phase_median(lambda: wire_format.read_request(request, data_key), tuple, repeat),
+            'compute': phase_median(compute, lambda: (params, None if dataframe is None else dataframe.copy()), repeat),
+            'serialize': phase_median(lambda: wire_format.make_response(request, payload, output, data_key), tuple, repeat)
+        }
+    return result
+
+
+# Function to compare a report against a baseline
+def compare(report, baseline, threshold):
+    """
+    Function to compare the p50 latency of each benchmark with a baseline report
+    :param report: Report from this run
+    :param baseline: Report from an earlier run
+    :param threshold: Ratio of p50 latencies above which a benchmark counts as a regression
+    :return: List of (name, size, baseline p50, p50, ratio) for each regression
+    """
+    regressions = []
+    for section in ['functions', 'routes']:
+        for name, sizes in report[section].items():
+            for size, result in sizes.items():
+                previous = baseline.get(section, {}).get(name, {}).get(size)
+                if previous is None:
+                    continue
+                ratio = result['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] > 0 else 1.0
+                print(f"{name:<40}{size:>10}{previous['p50_ms']:>12.3f}{result['p50_ms']:>12.3f}{ratio:>9.2f}x", file=sys.stderr)
+                if ratio > threshold:
+                    regressions.append((name, size, previous['p50_ms'], result['p50_ms'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every indicator and analysis function and every route')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of candles and trades')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed calls per benchmark')
+    parser.add_argument('--only', nargs='+', help='Names of the functions or routes to run')
+    parser.add_argument('--backend', choices=indicators.BACKENDS, default=indicators.get_backend())
+    parser.add_argument('--output', help='File to write the JSON report to, default is stdout')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='p50 ratio counted as a regression, default is 1.25')
+    args = parser.parse_args()
+    indicators.set_backend(args.backend)
+    handlers = route_handlers()
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'pandas': pandas.__version__,
+            'backend': args.backend,
+            'platform': platform.platform()
+        },
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+        'functions': {},
+        'routes': {}
+    }
+    for size in args.sizes:
+        datasets = {'candles': make_candles(size), 'trades': make_trades(size)}
+        for name, (dataset, function) in FUNCTIONS.items():
+            if args.only and name not in args.only:
+                continue
+            data = datasets[dataset]
+            result = measure(function, lambda: (data.copy(),), args.repeat)
+            result['rows_per_second'] = size / (result['p50_ms'] / 1000) if result['p50_ms'] > 0 else None
+            report['functions'].setdefault(name, {})[str(size)] = result
+            print(f"{name:<40}{size:>10}{result['p50_ms']:>12.3f}ms", file=sys.stderr)
+        for route, (dataset, make_body) in ROUTE_BODIES.items():
+            if args.only and route not in args.only:
+                continue
+            result = bench_route(route, handlers[route], make_body(datasets[dataset]), args.repeat)
+            result['rows_per_second'] = size / (result['p50_ms'] / 1000) if result['p50_ms'] > 0 else None
+            result['requests_per_second'] = 1000 / result['p50_ms'] if result['p50_ms'] > 0 else None
+            report['routes'].setdefault(route, {})[str(size)] = result
+            print(f"{route:<40}{size:>10}{result['p50_ms']:>12.3f}ms", file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"{'benchmark':<40}{'size':>10}{'base_p50':>12}{'p50':>12}{'ratio':>10}", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks slower than {args.threshold}x the baseline", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
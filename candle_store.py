@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from urllib.parse import quote
+import numpy
+import pandas
+
+
+# Reference to a range of stored candles, which can be passed in place of a candle dataframe.
+# start and end are inclusive, and either can be None for the first or last stored candle
+CandleRef = namedtuple('CandleRef', ['symbol', 'timeframe', 'start', 'end'], defaults=[None, None])
+
+# Type every stored timestamp is kept as, milliseconds since the epoch
+TIMESTAMP_DTYPE = numpy.dtype('<i8')
+# Type every other stored column is kept as
+VALUE_DTYPE = numpy.dtype('<f8')
+
+
+# Append-only store of candles in memory-mapped column files
+class CandleStore:
+    """
+    Candles stored on disk by symbol and timeframe, one raw little-endian file per column, read through
+    memory maps so a range of candles is sliced without copying it. Each symbol and timeframe has a
+    meta.json file with the column types and the number of rows, which is only updated once every
+    column has been written, so readers never see a partly written append. Appends from more than one
+    process at the same time aren't supported.
+    :param path: Directory holding the store, created if it doesn't exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Memory maps of each symbol and timeframe, as (rows, dictionary of column to array)
+        self._maps = {}
+
+    def append(self, symbol, timeframe, candle_dataframe):
+        """
+        Function to add new candles to the end of the stored candles. Candles at or before the last
+        stored candle are skipped, so overlapping uploads are safe. The first append sets the columns,
+        later appends must have the same columns.
+        :param symbol: Symbol of the candles, such as BTCUSD
+        :param timeframe: Timeframe of the candles, such as 1m or 1h
+        :param candle_dataframe: Dataframe of candles with candle_timestamp as datetimes or milliseconds
+        :return: Number of candles added
+        """
+        directory = self._directory(symbol, timeframe)
+        timestamps = _timestamp_array(candle_dataframe['candle_timestamp'])
+        order = numpy.argsort(timestamps, kind='stable')
+        with self._lock:
+            meta = self._read_meta(directory)
+            if meta is None:
+                value_columns = [column for column in candle_dataframe.columns if column != 'candle_timestamp']
+                for column in value_columns:
+                    if candle_dataframe[column].dtype.kind not in 'biuf':
+                        raise ValueError(f"column {column} must be numeric to be stored")
+                meta = {
+                    'columns': {'candle_timestamp': TIMESTAMP_DTYPE.str, **{column: VALUE_DTYPE.str for column in value_columns}},
+                    'rows': 0,
+                    'last_timestamp': None
+                }
+                os.makedirs(directory, exist_ok=True)
+            missing = [column for column in meta['columns'] if column not in candle_dataframe.columns]
+            if missing:
+                raise ValueError(f"candles for {symbol} {timeframe} must have the columns {missing}")
+            # Keep only the candles after the last stored candle, once each
+            timestamps = timestamps[order]
+            keep = numpy.ones(len(timestamps), dtype=bool)
+            keep[1:] = timestamps[1:] != timestamps[:-1]
+            if meta['last_timestamp'] is not None:
+                keep &= timestamps > meta['last_timestamp']
+            positions = order[keep]
+            if len(positions) == 0:
+                return 0
+            for column, dtype in meta['columns'].items():
+                if column == 'candle_timestamp':
+                    values = timestamps[keep]
+                else:
+                    values = candle_dataframe[column].to_numpy(dtype=float)[positions]
+                # Truncate any bytes left by an append which failed part way, then add the new values
+                with open(os.path.join(directory, f'{column}.bin'), 'ab') as column_file:
+                    column_file.truncate(meta['rows'] * numpy.dtype(dtype).itemsize)
+                    column_file.write(numpy.ascontiguousarray(values, dtype=dtype).tobytes())
+            meta['rows'] += len(positions)
+            meta['last_timestamp'] = int(timestamps[keep][-1])
+            self._write_meta(directory, meta)
+        return len(positions)
+
+    def load(self, symbol, timeframe, start=None, end=None):
+        """
+        Function to get a range of stored candles. The columns are read only views of the memory maps,
+        so no candles are copied. Columns can be replaced or added, but not changed in place.
+        :param symbol: Symbol of the candles
+        :param timeframe: Timeframe of the candles
+        :param start: First candle_timestamp to include, as milliseconds or anything pandas.Timestamp accepts. None for the first candle
+        :param end: Last candle_timestamp to include, the same as start. None for the last candle
+        :return: Dataframe with candle_timestamp as milliseconds, the same as uploaded candles, and the stored columns
+        """
+        columns = self._columns(symbol, timeframe)
+        timestamps = columns['candle_timestamp']
+        first = 0 if start is None else int(numpy.searchsorted(timestamps, _to_milliseconds(start), side='left'))
+        last = len(timestamps) if end is None else int(numpy.searchsorted(timestamps, _to_milliseconds(end), side='right'))
+        data = {column: values[first:max(first, last)] for column, values in columns.items()}
+        return pandas.DataFrame(data, copy=False)
+
+    def info(self, symbol, timeframe):
+        """
+        Function to describe the stored candles of a symbol and timeframe
+        :param symbol: Symbol of the candles
+        :param timeframe: Timeframe of the candles
+        :return: Dictionary of rows, columns, first_timestamp and last_timestamp, timestamps in milliseconds
+        """
+        columns = self._columns(symbol, timeframe)
+        timestamps = columns['candle_timestamp']
+        return {
+            'rows': len(timestamps),
+            'columns': list(columns),
+            'first_timestamp': int(timestamps[0]) if len(timestamps) > 0 else None,
+            'last_timestamp': int(timestamps[-1]) if len(timestamps) > 0 else None
+        }
+
+    def _columns(self, symbol, timeframe):
+        """
+        Function to get the memory maps of every column, reopening them after an append
+        :return: Dictionary of column to read only array
+        """
+        directory = self._directory(symbol, timeframe)
+        meta = self._read_meta(directory)
+        if meta is None:
+            raise ValueError(f"no candles stored for {symbol} {timeframe}")
+        with self._lock:
+            cached = self._maps.get(directory)
+            if cached is not None and cached[0] == meta['rows']:
+                return cached[1]
+            columns = {}
+            for column, dtype in meta['columns'].items():
+                if meta['rows'] == 0:
+                    columns[column] = numpy.empty(0, dtype=dtype)
+                    continue
+                # Read only, as the maps are shared by every request reading the same candles
+                columns[column] = numpy.memmap(
+                    os.path.join(directory, f'{column}.bin'), dtype=dtype, mode='r', shape=(meta['rows'],)
+                )
+            self._maps[directory] = (meta['rows'], columns)
+            return columns
+
+    def _directory(self, symbol, timeframe):
+        return os.path.join(self.path, _path_part(symbol, 'symbol'), _path_part(timeframe, 'timeframe'))
+
+    def _read_meta(self, directory):
+        try:
+            with open(os.path.join(directory, 'meta.json')) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, directory, meta):
+        # Replace the file in one step so readers see either the old or the new row count
+        temporary_path = os.path.join(directory, 'meta.json.tmp')
+        with open(temporary_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temporary_path, os.path.join(directory, 'meta.json'))
+
+
+# Function to turn a symbol or timeframe into a safe directory name
+def _path_part(name, label):
+    if not isinstance(name, str) or len(name) == 0:
+        raise ValueError(f"{label} must be a non empty string")
+    part = quote(name, safe='')
+    if part.startswith('.'):
+        raise ValueError(f"invalid {label} {name}")
+    return part
+
+
+# Function to convert a timestamp column into integer milliseconds
+def _timestamp_array(timestamps):
+    if pandas.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = timestamps.astype('datetime64[ms]').astype('int64')
+    return numpy.asarray(timestamps, dtype='int64')
+
+
+# Function to convert a start or end bound into milliseconds
+def _to_milliseconds(value):
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    return int(pandas.Timestamp(value).as_unit('ms').value)
+
+
+# Store used by the routes and the indicator functions, configured with the CANDLE_STORE_PATH app setting
+_store = None
+_store_lock = threading.Lock()
+
+
+# Function to get the store configured by the app settings
+def store_from_settings():
+    """
+    Function to get the store in the directory set by the CANDLE_STORE_PATH app setting, created on first use
+    :return: CandleStore, or None if CANDLE_STORE_PATH isn't set
+    """
+    global _store
+    path = os.environ.get('CANDLE_STORE_PATH')
+    if not path:
+        return None
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = CandleStore(path)
+        return _store
+
+
+# Function to get candles from a dataframe or a reference to stored candles
+def resolve(candles, store=None):
+    """
+    Function to get the candle dataframe for an indicator function, which can be passed either a
+    dataframe or a reference to stored candles, as a CandleRef or a (symbol, timeframe, start, end) tuple
+    :param candles: Dataframe, CandleRef or tuple
+    :param store: CandleStore to read references from, default is the store from the app settings
+    """
+    if not isinstance(candles, tuple):
+        return candles
+    store = store or store_from_settings()
+    if store is None:
+        raise ValueError("the candle store isn't configured, set CANDLE_STORE_PATH")
+    reference = CandleRef(*candles)
+    return store.load(reference.symbol, reference.timeframe, reference.start, reference.end)
@@ -0,0 +1,105 @@
+import os
+import numpy
+import pandas
+import instrumentation
+
+
+# Use compact dtypes when a request doesn't set compact. Set with the COMPACT_DTYPES app setting, default is false
+COMPACT_DTYPES = os.environ.get('COMPACT_DTYPES', 'false').lower() in ['true', '1', 'yes']
+# Largest relative error allowed when a float64 column is stored as float32. Set with the COMPACT_MAX_RELATIVE_ERROR
+# app setting. float32 keeps about 7 significant digits, so the default only refuses columns float32 can't hold
+MAX_RELATIVE_ERROR = float(os.environ.get('COMPACT_MAX_RELATIVE_ERROR', 1e-6))
+# Columns which are never downcast, as they hold millisecond timestamps
+TIMESTAMP_COLUMNS = ['candle_timestamp', 'entry_time', 'exit_time']
+
+
+# Function to store float64 columns as float32 where the precision allows
+def downcast_floats(dataframe, columns, max_relative_error=None):
+    """
+    Function to store float64 columns as float32 when every value is within max_relative_error
+    of the original. Columns are replaced in place, so the dataframe isn't copied.
+    :param dataframe: Dataframe to change
+    :param columns: Columns to try
+    :param max_relative_error: Largest relative error allowed, default is MAX_RELATIVE_ERROR
+    :return: List of the columns which were downcast
+    """
+    if max_relative_error is None:
+        max_relative_error = MAX_RELATIVE_ERROR
+    downcast = []
+    for column in columns:
+        values = dataframe[column].to_numpy()
+        if values.dtype != numpy.float64:
+            continue
+        with numpy.errstate(over='ignore', invalid='ignore'):
+            narrowed = values.astype(numpy.float32)
+        widened = narrowed.astype(numpy.float64)
+        # Values which round trip exactly, including NaN and infinity, have no error
+        inexact = ~((widened == values) | (numpy.isnan(values) & numpy.isnan(widened)))
+        if inexact.any():
+            with numpy.errstate(invalid='ignore'):
+                error = numpy.abs(widened[inexact] - values[inexact]) / numpy.abs(values[inexact])
+            # Overflow to infinity gives an error of infinity or NaN, so the column is kept
+            if not error.max() <= max_relative_error:
+                continue
+        dataframe[column] = narrowed
+        downcast.append(column)
+    return downcast
+
+
+# Function to store integer columns in the smallest integer type which holds them
+def downcast_integers(dataframe, columns):
+    """
+    Function to store integer columns in the smallest integer type which holds every value, in place
+    :param dataframe: Dataframe to change
+    :param columns: Columns to try
+    :return: List of the columns which were downcast
+    """
+    downcast = []
+    for column in columns:
+        if dataframe[column].dtype.kind not in 'iu':
+            continue
+        narrowed = pandas.to_numeric(dataframe[column], downcast='integer')
+        if narrowed.dtype != dataframe[column].dtype:
+            dataframe[column] = narrowed
+            downcast.append(column)
+    return downcast
+
+
+# Function to use compact dtypes for candles
+def compact_candles(candle_dataframe, max_relative_error=None):
+    """
+    Function to store the price and volume columns of candles as float32 where the precision allows,
+    and other integer columns in the smallest integer type. Timestamps are left as they are.
+    :param candle_dataframe: Dataframe of candles, changed in place
+    :param max_relative_error: Largest relative error allowed for float32 columns, default is MAX_RELATIVE_ERROR
+    """
+    before = _memory_bytes(candle_dataframe)
+    columns = [column for column in candle_dataframe.columns if column not in TIMESTAMP_COLUMNS]
+    downcast_floats(candle_dataframe, columns, max_relative_error)
+    downcast_integers(candle_dataframe, columns)
+    instrumentation.record(compact_saved_bytes=before - _memory_bytes(candle_dataframe))
+    return candle_dataframe
+
+
+# Function to use compact dtypes for trades
+def compact_trades(trade_dataframe, max_relative_error=None):
+    """
+    Function to store order_type as a categorical, with one small integer code per trade, the prices
+    as float32 where the precision allows and other integer columns in the smallest integer type.
+    Times are left as they are.
+    :param trade_dataframe: Dataframe of trades, changed in place
+    :param max_relative_error: Largest relative error allowed for float32 columns, default is MAX_RELATIVE_ERROR
+    """
+    before = _memory_bytes(trade_dataframe)
+    if 'order_type' in trade_dataframe.columns and trade_dataframe['order_type'].dtype == object:
+        trade_dataframe['order_type'] = trade_dataframe['order_type'].astype('category')
+    columns = [column for column in trade_dataframe.columns if column not in TIMESTAMP_COLUMNS]
+    downcast_floats(trade_dataframe, columns, max_relative_error)
+    downcast_integers(trade_dataframe, columns)
+    instrumentation.record(compact_saved_bytes=before - _memory_bytes(trade_dataframe))
+    return trade_dataframe
+
+
+# Function to measure the memory held by a dataframe
+def _memory_bytes(dataframe):
+    return int(dataframe.memory_usage(index=False, deep=True).sum())
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of threads running requests with bodies under LARGE_REQUEST_BYTES. Set with the COMPUTE_WORKERS app setting
+COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', os.cpu_count() or 1))
+# Size of the request body, in bytes, from which a request is large. Set with the LARGE_REQUEST_BYTES app setting
+LARGE_REQUEST_BYTES = int(os.environ.get('LARGE_REQUEST_BYTES', 1000000))
+# Number of threads running large requests. Set with the LARGE_REQUEST_WORKERS app setting, default is half of COMPUTE_WORKERS
+LARGE_REQUEST_WORKERS = int(os.environ.get('LARGE_REQUEST_WORKERS', max(1, COMPUTE_WORKERS // 2)))
+# Largest number of large requests waiting for a thread before more are turned away with a 503.
+# Set with the MAX_WAITING_LARGE_REQUESTS app setting
+MAX_WAITING_LARGE_REQUESTS = int(os.environ.get('MAX_WAITING_LARGE_REQUESTS', 4 * LARGE_REQUEST_WORKERS))
+# Seconds a client turned away is asked to wait before trying again, sent as the Retry-After header
+RETRY_AFTER_SECONDS = 1
+
+# Thread pools for small and large requests, created on first use
+_pools = {}
+_pools_lock = threading.Lock()
+# Number of large requests submitted which haven't started
+_waiting_large = 0
+_waiting_lock = threading.Lock()
+
+
+# Function to get the thread pool of a lane
+def _get_pool(lane):
+    """
+    Function to get the thread pool for small or large requests, so threads are reused between requests
+    :param lane: small or large
+    """
+    pool = _pools.get(lane)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(lane)
+            if pool is None:
+                workers = COMPUTE_WORKERS if lane == 'small' else LARGE_REQUEST_WORKERS
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'compute-{lane}')
+                _pools[lane] = pool
+    return pool
+
+
+# Function to decide which lane a request runs in
+def request_lane(req):
+    """
+    Function to sort a request into the small or large lane by the size of its body
+    :param req: The HTTP request
+    :return: small or large
+    """
+    return 'large' if len(req.get_body() or b'') >= LARGE_REQUEST_BYTES else 'small'
+
+
+# Function to run a handler in its lane's thread pool
+async def run(handler, req):
+    """
+    Function to run a synchronous handler in a thread, so the event loop keeps accepting requests while
+    it runs. Small and large requests run in separate bounded pools, so large jobs queue behind each
+    other and never hold the threads small requests use. When MAX_WAITING_LARGE_REQUESTS large requests
+    are already waiting, more are turned away with a 503 rather than queued. Requests in different threads
+    only calculate at the same time while they hold no GIL: in the numba kernels of the native backend and in
+    the NumPy and pandas operations which release it. The pandas_ta backend and the plain Python kernels used
+    when numba can't be imported hold the GIL, so the threads take turns and only keep the event loop free.
+    :param handler: Handler taking the request and returning an HttpResponse
+    :param req: The HTTP request
+    """
+    global _waiting_large
+    lane = request_lane(req)
+    if lane == 'large':
+        with _waiting_lock:
+            if _waiting_large >= MAX_WAITING_LARGE_REQUESTS:
+                return _busy_response()
+            _waiting_large += 1
+    # Run with a copy of the context, so context variables set by the caller are seen in the thread
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(lane), context.run, _run_handler, handler, req, lane)
+
+
+# Function run in the pool thread
+def _run_handler(handler, req, lane):
+    global _waiting_large
+    if lane == 'large':
+        with _waiting_lock:
+            _waiting_large -= 1
+    return handler(req)
+
+
+# Function to build the response for a request turned away
+def _busy_response():
+    # Import here so this module can be used without the Functions runtime
+    import azure.functions as func
+    logging.warning('Compute pool busy, large request turned away.')
+    return func.HttpResponse(
+        "Too many large requests, try again later",
+        status_code=503,
+        headers={'Retry-After': str(RETRY_AFTER_SECONDS)}
+    )
+
+
+# Decorator to run a handler in the compute pool
+def offload(handler):
+    """
+    Decorator which turns a synchronous handler into an async handler running it with run
+    :param handler: Handler taking the request and returning an HttpResponse
+    """
+    @functools.wraps(handler)
+    async def wrapper(req):
+        return await run(handler, req)
+    return wrapper
+
+
+# Function to report on the compute pool
+def stats():
+    """
+    Function to report the pool sizes and the number of large requests waiting
+    :return: Dictionary of compute_workers, large_request_workers, large_request_bytes and waiting_large
+    """
+    return {
+        'compute_workers': COMPUTE_WORKERS,
+        'large_request_workers': LARGE_REQUEST_WORKERS,
+        'large_request_bytes': LARGE_REQUEST_BYTES,
+        'waiting_large': _waiting_large
+    }
@@ -1,207 +1,339 @@
 import azure.functions as func
 import logging
+import numpy
 import pandas
 import json
 import indicators
+import indicator_state
 import analysis
+import backtest
+import metrics
+import wire_format
+import result_cache
+import candle_store
+import compute_pool
+import instrumentation
+import request_pipeline
+import resample
+import startup
 
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+# Cache of indicator responses, configured with the RESULT_CACHE_* app settings. None when disabled
+cache = result_cache.cache_from_settings()
+# Largest number of periods calc-sweep calculates in one request
+MAX_SWEEP_PERIODS = 500
+# Largest number of timeframes calc-multi-timeframe calculates in one request
+MAX_TIMEFRAMES = 20
+# Number of candles chunked-indicators processes at a time when chunk_rows isn't sent
+DEFAULT_CHUNK_ROWS = 10000
+# Load and compile the kernels in the background as the app starts, see startup.WARM_UP_ON_START
+if startup.WARM_UP_ON_START:
+    startup.start_warm_up()
+
+
+# Function to build the response for a request
+def make_response(req, payload, dataframe=None, data_key='candlestick_data'):
+    """
+    Function to build a response with wire_format.make_response, timed as the serialize phase
+    :param req: The HTTP request
+    :param payload: Dictionary of values to return
+    :param dataframe: Dataframe to return, or None if the response has no data
+    :param data_key: Name of the payload entry holding the dataframe in JSON responses
+    """
+    if dataframe is not None:
+        instrumentation.record(output_rows=len(dataframe))
+    with instrumentation.phase('serialize'):
+        return wire_format.make_response(req, payload, dataframe, data_key)
+
+
+# Function to return the result of a request
+def respond(req, payload, dataframe=None, options=None, cache_key=None, data_key='candlestick_data'):
+    """
+    Function to limit the returned data, build the response in the format the client accepts and cache it
+    :param req: The HTTP request
+    :param payload: Dictionary of values to return
+    :param dataframe: Dataframe to return, or None if the response has no data
+    :param options: Output options from request_pipeline.output_options, or None to return every row and column
+    :param cache_key: Key from cached_response, or None to skip the cache
+    :param data_key: Name of the payload entry holding the dataframe in JSON responses
+    """
+    # Keep only the rows and columns asked for
+    if dataframe is not None and options is not None:
+        try:
+            dataframe = project_output(dataframe, options)
+        except ValueError as error:
+            return request_pipeline.error_response(error)
+    try:
+        return store_response(cache_key, make_response(req, payload, dataframe, data_key))
+    except ValueError as error:
+        return func.HttpResponse(
+            f"Unable to encode response, {error}",
+            status_code=406
+        )
+
+
+# Function to get a cached response for an indicator request
+def cached_response(req, route, candle_dataframe, params):
+    """
+    Function to look up the response for an indicator request in the cache
+    :param req: The HTTP request, used for the response format
+    :param route: Name of the route
+    :param candle_dataframe: Dataframe of candles as sent, before any conversion
+    :param params: Dictionary of the parameters which change the result
+    :return: Tuple of (cache key, cached HttpResponse or None). The key is None when the cache is disabled
+    """
+    if cache is None:
+        return None, None
+    with instrumentation.phase('cache'):
+        # The backends only agree to floating point rounding, so hosts sharing a backend with different settings don't share results
+        cache_key = result_cache.make_key(route, candle_dataframe, {
+            **params, 'response_format': wire_format.response_format(req), 'indicator_backend': indicators.get_backend()
+        })
+        response = cache.get_response(cache_key)
+    instrumentation.record(cache_hit=response is not None)
+    return cache_key, response
+
+
+# Function to store a response in the cache
+def store_response(cache_key, response):
+    """
+    Function to store a response in the cache and return it
+    :param cache_key: Key from cached_response
+    :param response: The HttpResponse to return
+    """
+    if cache is None:
+        return response
+    return cache.store_response(cache_key, response)
+
+
+# Function to drop the candle columns which are neither returned nor used
+def project_input(candle_dataframe, options, used_columns):
+    """
+    Function to drop candle columns which won't be returned and aren't used by the calculation,
+    so they aren't copied by the sort and the indicator calculations
+    :param candle_dataframe: Dataframe of candles
+    :param options: Output options from request_pipeline.output_options
+    :param used_columns: Columns the calculation needs
+    """
+    if options['columns'] is None:
+        return candle_dataframe
+    unused_columns = [
+        column for column in candle_dataframe.columns
+        if column != 'candle_timestamp' and column not in used_columns and column not in options['columns']
+    ]
+    return candle_dataframe.drop(columns=unused_columns)
+
+
+# Function to limit the returned rows and columns
+def project_output(candle_dataframe, options):
+    """
+    Function to keep only the rows and columns asked for. Rows are filtered before columns are selected,
+    so only the returned data is serialized
+    :param candle_dataframe: Dataframe of candles with the indicators added, sorted by candle_timestamp
+    :param options: Output options from request_pipeline.output_options
+    """
+    if options['after_timestamp'] is not None:
+        candle_dataframe = candle_dataframe[candle_dataframe['candle_timestamp'] > options['after_timestamp']]
+    if options['last_n'] is not None:
+        candle_dataframe = candle_dataframe.iloc[len(candle_dataframe) - min(options['last_n'], len(candle_dataframe)):]
+    if options['columns'] is not None:
+        missing_columns = [column for column in options['columns'] if column not in candle_dataframe.columns]
+        if len(missing_columns) > 0:
+            raise ValueError(f"columns {', '.join(missing_columns)} not found")
+        candle_dataframe = candle_dataframe[options['columns']]
+    return candle_dataframe
+
+
+# Function to calculate the Ichimoku Cloud over only the candles the returned rows need
+def calc_ichimoku_window(candle_dataframe, options, tenkan, kijun, senoku, **kwargs):
+    """
+    Function to calculate the Ichimoku Cloud, skipping the candles which the rows kept by last_n and
+    after_timestamp don't depend on. The returned rows have the same values as a full calculation.
+    :param candle_dataframe: Dataframe of candles sorted by candle_timestamp
+    :param options: Output options from request_pipeline.output_options
+    :param kwargs: Other arguments for indicators.calc_ichimoku
+    """
+    lookback = indicators.ichimoku_lookback(int(tenkan), int(kijun), int(senoku))
+    start = 0
+    if options['last_n'] is not None or options['after_timestamp'] is not None:
+        # Position of the first candle which could be returned. The last kijun candles never are
+        first_row = 0
+        if options['last_n'] is not None:
+            first_row = len(candle_dataframe) - int(kijun) - options['last_n']
+        if options['after_timestamp'] is not None:
+            first_row = max(first_row, int(candle_dataframe['candle_timestamp'].searchsorted(options['after_timestamp'], side='right')))
+        start = max(first_row - lookback, 0)
+    ichimoku_dataframe = indicators.calc_ichimoku(candle_dataframe.iloc[start:], tenkan=tenkan, kijun=kijun, senoku=senoku, **kwargs)
+    if start == 0:
+        return ichimoku_dataframe
+    # Drop rows which depend on candles before the start
+    complete = ichimoku_dataframe.index.isin(candle_dataframe.index[start + lookback:])
+    ichimoku_dataframe = ichimoku_dataframe.take(numpy.flatnonzero(complete))
+    # Candles with missing values remove rows, so fall back to every candle if too few rows are left
+    if options['last_n'] is not None and len(ichimoku_dataframe) < options['last_n']:
+        return indicators.calc_ichimoku(candle_dataframe, tenkan=tenkan, kijun=kijun, senoku=senoku, **kwargs)
+    return ichimoku_dataframe
+
+
+# Function to convert an array into a JSON friendly list
+def json_array(values):
+    """
+    Function to convert a numpy array into a list, with NaN as None so it serializes as null
+    :param values: numpy array
+    """
+    if values.dtype.kind == 'f':
+        return [None if numpy.isnan(value) else float(value) for value in values]
+    return values.tolist()
+
+
+# Function to update indicators a chunk of candles at a time
+def update_chunks(state, chunks, counts):
+    """
+    Function to add each chunk of candles to the indicator state and yield it with the indicators added,
+    so only one chunk is held as a dataframe. The request and response bodies are still held whole. Candles at or before the last candle seen are skipped.
+    :param state: IndicatorState, carrying the look-back of each indicator from one chunk to the next
+    :param chunks: Iterator of candle dataframes from wire_format.read_chunks
+    :param counts: Dictionary where the input_rows and skipped_rows totals are counted
+    """
+    value_columns = state.value_columns
+    for candle_dataframe in chunks:
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'] + value_columns, numeric=value_columns)
+        candle_dataframe = request_pipeline.prepare_candles(candle_dataframe)
+        with instrumentation.phase('compute'):
+            updated_dataframe = state.update(candle_dataframe)
+        counts['input_rows'] += len(candle_dataframe)
+        counts['skipped_rows'] += len(candle_dataframe) - len(updated_dataframe)
+        yield updated_dataframe
+
 
 @app.route(route="calc-rsi", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-rsi")
 def rsi(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('RSI function processed a request.')
-    # Get the RSI parameters from the request
-    period = req.get_json().get('rsi_length')
-    # Cast period into an integer
-    if period is not None:
-        period = int(period)
-    # If period is not specified, default to 14
-    if period is None:
-        period = 14
-    # Get which value from candle_open, high, low, candle_close to use
-    value = req.get_json().get('rsi_value')
-    # If value is not specified, default to candle_close
-    if value is None:
-        value = 'candle_close'
-    if value not in ['candle_open', 'high', 'low', 'candle_close', 'custom']:
-        return func.HttpResponse(
-            f"Invalid value for rsi_value: {value}",
-            status_code=400
-        )
-    # Convert candlestick_data to a pandas dataframe
-    candlestick_data = req.get_json().get('candlestick_data')
-    candle_dataframe = pandas.DataFrame(json.loads(candlestick_data))
-    # Confirm that the column for value is in the dataframe
-    if value not in candle_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in candlestick, {value} not found",
-            status_code=400
-        )
-    # Check for timestamp
-    if 'candle_timestamp' not in candle_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in candlestick, candle_timestamp not found",
-            status_code=400
-        )
-    # Make sure timestamp is in datetime format
-    candle_dataframe['candle_timestamp'] = pandas.to_datetime(candle_dataframe['candle_timestamp'], unit='ms')
-    # Sort by timestamp
-    candle_dataframe = candle_dataframe.sort_values(by='candle_timestamp')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Get the RSI length, default to 14
+        period = request_pipeline.get_int(params, 'rsi_length', 14, minimum=1)
+        # Get which value from candle_open, high, low, candle_close to use, default to candle_close
+        value = request_pipeline.get_choice(params, 'rsi_value', request_pipeline.VALUE_COLUMNS, 'candle_close')
+        # Check for candlestick_data with the timestamp and value columns
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, [value, 'candle_timestamp'], numeric=[value])
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-rsi', candle_dataframe, {'period': period, 'value': value, 'output': options})
+    if response is not None:
+        return response
+    # Drop the candle columns which won't be used or returned
+    candle_dataframe = project_input(candle_dataframe, options, [value])
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
     # Calculate the RSI
-    candle_dataframe = indicators.calc_rsi(candle_dataframe, period=period, value=value)
-    # Convert the dataframe to a dictionary
-    candlestick_data = candle_dataframe.to_json(orient='records')
+    with instrumentation.phase('compute'):
+        candle_dataframe = indicators.calc_rsi(candle_dataframe, period=period, value=value)
     # Create the return payload
     payload = {
-        'candlestick_data': candlestick_data,
         'rsi_length': period,
-        'rsi_value': value,
+        'rsi_value': value
     }
-    # Convert the payload to JSON
-    payload = json.dumps(payload)
-    # Return the payload
-    return func.HttpResponse(
-        payload,
-        status_code=200
-    )
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe, options, cache_key)
 
 
 @app.route(route="calc-ema", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-ema")
 def ema(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('EMA function processed a request.')
-    # Get the EMA parameters from the request
-    period = req.get_json().get('ema_length')
-    # Cast period into an integer
-    if period is not None:
-        period = int(period)
-    # If period is not specified, default to 20
-    if period is None:
-        period = 20
-    # Get which value from candle_open, high, low, candle_close to use
-    value = req.get_json().get('ema_value')
-    # If value is not specified, default to candle_close
-    if value is None:
-        value = 'candle_close'
-    if value not in ['candle_open', 'high', 'low', 'candle_close', 'custom']:
-        return func.HttpResponse(
-            f"Invalid value for ema_value: {value}",
-            status_code=400
-        )
-    # Convert candlestick_data to a pandas dataframe
-    candlestick_data = req.get_json().get('candlestick_data')
-    candle_dataframe = pandas.DataFrame(json.loads(candlestick_data))
-    # Confirm that the column for value is in the dataframe
-    if value not in candle_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in candlestick, {value} not found",
-            status_code=400
-        )
-    # Check for timestamp
-    if 'candle_timestamp' not in candle_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in candlestick, candle_timestamp not found",
-            status_code=400
-        )
-    # Make sure timestamp is in datetime format
-    candle_dataframe['candle_timestamp'] = pandas.to_datetime(candle_dataframe['candle_timestamp'], unit='ms')
-    # Sort by timestamp
-    candle_dataframe = candle_dataframe.sort_values(by='candle_timestamp')
-    # Check if accuracy_filter is specified
-    accuracy_filter = req.get_json().get('accuracy_filter')
-    if accuracy_filter is None:
-        accuracy_filter = True
-    else:
-        accuracy_filter = bool(accuracy_filter)
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Get the EMA length, default to 20
+        period = request_pipeline.get_int(params, 'ema_length', 20, minimum=1)
+        # Get which value from candle_open, high, low, candle_close to use, default to candle_close
+        value = request_pipeline.get_choice(params, 'ema_value', request_pipeline.VALUE_COLUMNS, 'candle_close')
+        # Check for candlestick_data with the timestamp and value columns
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, [value, 'candle_timestamp'], numeric=[value])
+        # Check if accuracy_filter is specified, default to True
+        accuracy_filter = bool(params.get('accuracy_filter', True))
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-ema', candle_dataframe, {'period': period, 'value': value, 'accuracy_filter': accuracy_filter, 'output': options})
+    if response is not None:
+        return response
+    # Drop the candle columns which won't be used or returned
+    candle_dataframe = project_input(candle_dataframe, options, [value])
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
     # Calculate the EMA
-    candle_dataframe = indicators.calc_ema(candle_dataframe, period=period, value=value, accuracy_filter=accuracy_filter)
-    # Convert the dataframe to json
-    candlestick_data = candle_dataframe.to_json(orient='records')
+    with instrumentation.phase('compute'):
+        candle_dataframe = indicators.calc_ema(candle_dataframe, period=period, value=value, accuracy_filter=accuracy_filter)
     # Create the return payload
     payload = {
-        'candlestick_data': candlestick_data,
         'ema_length': period,
         'ema_value': value,
         'accuracy_filter': accuracy_filter,
         'ema_name': f'ema_{period}'
     }
-    # Convert the payload to JSON
-    payload = json.dumps(payload)
-    # Return the payload
-    return func.HttpResponse(
-        payload,
-        status_code=200
-    )
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe, options, cache_key)
 
 
 @app.route(route="calc-ichimoku", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-ichimoku")
 def ichimoku(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Ichimoku function processed a request.')
-    # Get the Ichimoku parameters from the request
-    tenkan = req.get_json().get('tenkan')
-    # If tenkan is not specified, default to 9
-    if tenkan is None:
-        tenkan = 9
-    # Get the Ichimoku parameters from the request
-    kijun = req.get_json().get('kijun')
-    # If kijun is not specified, default to 26
-    if kijun is None:
-        kijun = 26
-    # Get the Ichimoku parameters from the request
-    senoku = req.get_json().get('senoku')
-    # If senoku is not specified, default to 52
-    if senoku is None:
-        senoku = 52
-    # Get which value from candle_open, high, low, candle_close to use
-    high_value = req.get_json().get('high_value')
-    # If value is not specified, default to high
-    if high_value is None:
-        high_value = 'high'
-    if high_value not in ['candle_open', 'high', 'low', 'candle_close', 'custom']:
-        return func.HttpResponse(
-            f"Invalid value for high_value: {high_value}",
-            status_code=400
-        )
-    # Get which value from candle_open, high, low, candle_close to use
-    low_value = req.get_json().get('low_value')
-    # If value is not specified, default to low
-    if low_value is None:
-        low_value = 'low'
-    if low_value not in ['candle_open', 'high', 'low', 'candle_close', 'custom']:
-        return func.HttpResponse(
-            f"Invalid value for low_value: {low_value}",
-            status_code=400
-        )
-    # Get which value from candle_open, high, low, candle_close to use
-    close_value = req.get_json().get('close_value')
-    # If value is not specified, default to candle_close
-    if close_value is None:
-        close_value = 'candle_close'
-    if close_value not in ['candle_open', 'high', 'low', 'candle_close', 'custom']:
-        return func.HttpResponse(
-            f"Invalid value for close_value: {close_value}",
-            status_code=400
-        )
-    # Convert candlestick_data to a pandas dataframe
-    candlestick_data = req.get_json().get('candlestick_data')
-    candle_dataframe = pandas.DataFrame(json.loads(candlestick_data))
-    # Confirm that the timestamp column is in the dataframe
-    if 'candle_timestamp' not in candle_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in candlestick, candle_timestamp not found",
-            status_code=400
-        )
-    # Make sure timestamp is in datetime format
-    candle_dataframe['candle_timestamp'] = pandas.to_datetime(candle_dataframe['candle_timestamp'], unit="ms")
-    # Sort by timestamp
-    candle_dataframe = candle_dataframe.sort_values(by='candle_timestamp')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Get the Ichimoku lengths, default to 9, 26 and 52
+        tenkan = request_pipeline.get_int(params, 'tenkan', 9, minimum=1)
+        kijun = request_pipeline.get_int(params, 'kijun', 26, minimum=1)
+        senoku = request_pipeline.get_int(params, 'senoku', 52, minimum=1)
+        # Get which values from candle_open, high, low, candle_close to use, default to high, low and candle_close
+        high_value = request_pipeline.get_choice(params, 'high_value', request_pipeline.VALUE_COLUMNS, 'high')
+        low_value = request_pipeline.get_choice(params, 'low_value', request_pipeline.VALUE_COLUMNS, 'low')
+        close_value = request_pipeline.get_choice(params, 'close_value', request_pipeline.VALUE_COLUMNS, 'candle_close')
+        # Check for candlestick_data with the timestamp column
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'])
+        # Check if only the new columns should be returned
+        new_columns_only = bool(params.get('new_columns_only', False))
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-ichimoku', candle_dataframe, {
+        'tenkan': tenkan, 'kijun': kijun, 'senoku': senoku, 'high_value': high_value,
+        'low_value': low_value, 'close_value': close_value, 'new_columns_only': new_columns_only,
+        'output': options
+    })
+    if response is not None:
+        return response
+    # Drop the candle columns which won't be used or returned
+    candle_dataframe = project_input(candle_dataframe, options, [high_value, low_value, close_value])
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
     # Calculate the Ichimoku Cloud
-    candle_dataframe = indicators.calc_ichimoku(candle_dataframe, tenkan=tenkan, kijun=kijun, senoku=senoku, high_value=high_value, low_value=low_value, close_value=close_value)
-    # Convert the dataframe to json
-    candlestick_data = candle_dataframe.to_json(orient='records')
+    with instrumentation.phase('compute'):
+        ichimoku_dataframe = calc_ichimoku_window(candle_dataframe, options, tenkan=tenkan, kijun=kijun, senoku=senoku, high_value=high_value, low_value=low_value, close_value=close_value, new_columns_only=new_columns_only)
+    if new_columns_only:
+        # Keep the timestamp so the columns can be matched back to the candles
+        ichimoku_dataframe.insert(0, 'candle_timestamp', candle_dataframe.loc[ichimoku_dataframe.index, 'candle_timestamp'])
     # Create the return payload
     payload = {
-        'candlestick_data': candlestick_data,
         'tenkan': tenkan,
         'kijun': kijun,
         'senoku': senoku,
@@ -209,10 +341,346 @@ def ichimoku(req: func.HttpRequest) -> func.HttpResponse:
         'low_value': low_value,
         'close_value': close_value,
         'isa_name': f'ISA_{tenkan}',
-        'isb_name': f'ISB_{kijun}'
+        'isb_name': f'ISB_{kijun}',
+        'new_columns_only': new_columns_only
+    }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, ichimoku_dataframe, options, cache_key)
+
+
+@app.route(route="calc-indicators", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-indicators")
+def batch_indicators(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Indicators function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Check for candlestick_data with the timestamp column
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'])
+        # Get the list of indicators to calculate and check the columns they use
+        indicator_specs, spec_columns = request_pipeline.indicator_specs(params, candle_dataframe)
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-indicators', candle_dataframe, {'indicators': indicator_specs, 'output': options})
+    if response is not None:
+        return response
+    # Drop the candle columns which won't be used or returned, keeping the default columns of each indicator
+    candle_dataframe = project_input(candle_dataframe, options, ['high', 'low', 'candle_close'] + spec_columns)
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
+    # Calculate all of the indicators
+    try:
+        with instrumentation.phase('compute'):
+            candle_dataframe = indicators.calc_indicators(candle_dataframe, indicator_specs)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Create the return payload
+    payload = {
+        'indicators': indicator_specs
+    }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe, options, cache_key)
+
+
+@app.route(route="calc-sweep", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-sweep")
+def sweep(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Sweep function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Get which indicator to sweep
+        indicator = request_pipeline.get_choice(params, 'sweep_indicator', list(indicators.SWEEP_INDICATORS), None)
+        if indicator is None:
+            raise request_pipeline.RequestError("Invalid request, sweep_indicator not found")
+        # Get the periods, either as a list or as an inclusive range
+        periods = params.get('periods')
+        if periods is None:
+            period_start = request_pipeline.get_int(params, 'period_start', 5 if indicator == 'ema' else 2)
+            period_stop = request_pipeline.get_int(params, 'period_stop', 200 if indicator == 'ema' else 50)
+            period_step = request_pipeline.get_int(params, 'period_step', 1, minimum=1)
+            periods = list(range(period_start, period_stop + 1, period_step))
+        if not isinstance(periods, list):
+            raise ValueError("periods must be a list")
+        periods = [int(period) for period in periods]
+        if len(periods) == 0 or len(periods) > MAX_SWEEP_PERIODS or min(periods) < 1:
+            raise request_pipeline.RequestError(f"Invalid periods, between 1 and {MAX_SWEEP_PERIODS} periods of at least 1 are required")
+        # Get which value from candle_open, high, low, candle_close to use, default to candle_close
+        value = request_pipeline.get_choice(params, 'sweep_value', request_pipeline.VALUE_COLUMNS, 'candle_close')
+        # Get whether to blank out the EMA warm up rows, default to False
+        accuracy_filter = bool(params.get('accuracy_filter', False))
+        # Check for candlestick_data with the timestamp and value columns
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, [value, 'candle_timestamp'], numeric=[value])
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except (TypeError, ValueError) as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-sweep', candle_dataframe, {
+        'indicator': indicator, 'periods': periods, 'value': value, 'accuracy_filter': accuracy_filter, 'output': options
+    })
+    if response is not None:
+        return response
+    # Only the timestamp and the value are needed, the sweep returns its own columns
+    candle_dataframe = candle_dataframe.drop(columns=candle_dataframe.columns.difference(['candle_timestamp', value]))
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
+    # Calculate every period in one pass
+    with instrumentation.phase('compute'):
+        sweep_dataframe = indicators.calc_sweep(candle_dataframe, indicator, periods, value=value, accuracy_filter=accuracy_filter)
+    sweep_dataframe.insert(0, 'candle_timestamp', candle_dataframe['candle_timestamp'])
+    # Create the return payload
+    payload = {
+        'sweep_indicator': indicator,
+        'periods': periods,
+        'sweep_value': value,
+        'accuracy_filter': accuracy_filter
+    }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, sweep_dataframe, options, cache_key)
+
+
+@app.route(route="calc-multi-timeframe", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-multi-timeframe")
+def multi_timeframe(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Multi timeframe function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Check for candlestick_data with the timestamp column
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'])
+        # Get the timeframes to resample into and check each one
+        timeframes = params.get('timeframes')
+        if not isinstance(timeframes, list) or len(timeframes) == 0 or len(timeframes) > MAX_TIMEFRAMES:
+            raise request_pipeline.RequestError(f"Invalid timeframes, between 1 and {MAX_TIMEFRAMES} timeframes are required")
+        for timeframe in timeframes:
+            resample.timeframe_milliseconds(timeframe)
+        # Get the timeframe of the candles, default to the shortest gap between candles
+        base_timeframe = params.get('base_timeframe')
+        if base_timeframe is not None:
+            resample.timeframe_milliseconds(base_timeframe)
+        # Get the list of indicators to calculate and check the columns they use
+        indicator_specs, spec_columns = request_pipeline.indicator_specs(params, candle_dataframe)
+        # Read the options which limit the returned data
+        options = request_pipeline.output_options(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Return the cached response if these candles and parameters were calculated recently
+    cache_key, response = cached_response(req, 'calc-multi-timeframe', candle_dataframe, {
+        'timeframes': timeframes, 'base_timeframe': base_timeframe, 'indicators': indicator_specs, 'output': options
+    })
+    if response is not None:
+        return response
+    # Drop the candle columns which won't be used or returned, keeping the columns the bars are built from
+    candle_dataframe = project_input(candle_dataframe, options, list(resample.AGGREGATIONS) + spec_columns)
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=options['compact'])
+    # Resample into every timeframe and calculate the indicators on each
+    try:
+        with instrumentation.phase('compute'):
+            candle_dataframe = resample.calc_multi_timeframe(candle_dataframe, timeframes, indicator_specs, base_timeframe)
+    except (ValueError, KeyError) as error:
+        return request_pipeline.error_response(error)
+    # Create the return payload
+    payload = {
+        'timeframes': timeframes,
+        'base_timeframe': base_timeframe,
+        'indicators': indicator_specs
+    }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe, options, cache_key)
+
+
+@app.route(route="calc-indicators-multi", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-indicators-multi")
+def multi_symbol_indicators(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Multi symbol indicators function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Get the list of indicators to calculate
+        indicator_specs, spec_columns = request_pipeline.indicator_specs(params)
+        # Check if compact dtypes should be used, which also halves the candles sent to the worker processes
+        compact = request_pipeline.compact_mode(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Candles can be sent as a dictionary of symbol to candlestick_data, or as one long candlestick_data with a symbol column
+    symbols = params.get('symbols')
+    # Errors for symbols which can't be calculated
+    symbol_errors = {}
+    if candle_dataframe is None and isinstance(symbols, dict):
+        # Get the columns the indicators need
+        required_columns = {'candle_timestamp'}
+        for spec in indicator_specs:
+            if spec['indicator'] == 'ichimoku':
+                required_columns.update([spec.get('high_value', 'high'), spec.get('low_value', 'low'), spec.get('close_value', 'candle_close')])
+            else:
+                required_columns.add(spec.get('value', 'candle_close'))
+        symbol_dataframes = []
+        for symbol, candlestick_data in symbols.items():
+            # A symbol which can't be parsed is returned in the errors and doesn't stop the others
+            try:
+                with instrumentation.phase('parse'):
+                    symbol_dataframe = pandas.DataFrame(json.loads(candlestick_data))
+            except (TypeError, ValueError) as error:
+                symbol_errors[symbol] = f"Invalid candlestick_data, {error}"
+                continue
+            missing_columns = sorted(required_columns.difference(symbol_dataframe.columns))
+            if len(missing_columns) > 0:
+                symbol_errors[symbol] = f"Invalid columns in candlestick, {', '.join(missing_columns)} not found"
+                continue
+            symbol_dataframe['symbol'] = symbol
+            symbol_dataframes.append(symbol_dataframe)
+        if len(symbol_dataframes) > 0:
+            candle_dataframe = pandas.concat(symbol_dataframes, ignore_index=True)
+        else:
+            candle_dataframe = pandas.DataFrame(columns=['symbol', 'candle_timestamp'])
+        instrumentation.record(input_rows=len(candle_dataframe))
+    try:
+        if candle_dataframe is None:
+            raise request_pipeline.RequestError("Invalid request, candlestick_data or symbols not found")
+        # Check for the symbol and timestamp columns
+        request_pipeline.require_columns(candle_dataframe, ['symbol', 'candle_timestamp'])
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Convert the timestamps of every symbol at once, and sort by symbol then timestamp if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, sort_by=('symbol', 'candle_timestamp'), kind='stable', compact=compact)
+    # Calculate the indicators for every symbol
+    with instrumentation.phase('compute'):
+        results, errors = indicators.calc_indicators_multi(candle_dataframe, indicator_specs)
+    errors.update(symbol_errors)
+    # Combine the results back into one long dataframe
+    if len(results) > 0:
+        candle_dataframe = pandas.concat(results.values(), ignore_index=True)
+    else:
+        candle_dataframe = candle_dataframe.iloc[0:0]
+    # Create the return payload
+    payload = {
+        'indicators': indicator_specs,
+        'symbols': list(results.keys()),
+        'errors': errors
     }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe)
+
+
+@app.route(route="update-indicators", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("update-indicators")
+def update_indicators(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Update indicators function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Restore the indicator state if a token was sent, otherwise start a new one from the indicators
+        state_token = params.get('state')
+        if state_token is not None:
+            state = indicator_state.IndicatorState.from_token(state_token)
+        else:
+            if not isinstance(params.get('indicators'), list) or len(params['indicators']) == 0:
+                raise request_pipeline.RequestError("Invalid request, indicators or state not found")
+            indicator_specs, _ = request_pipeline.indicator_specs(params)
+            state = indicator_state.IndicatorState(indicator_specs)
+        # Check for candlestick_data with the timestamp and the columns used by the indicators
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        value_columns = state.value_columns
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'] + value_columns, numeric=value_columns)
+    except (ValueError, TypeError, KeyError) as error:
+        return request_pipeline.error_response(error)
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe)
+    # Update the indicators with the candles which haven't been seen yet
+    with instrumentation.phase('compute'):
+        candle_dataframe = state.update(candle_dataframe)
+    # Create the return payload
+    payload = {
+        'state': state.to_token(),
+        'columns': state.columns
+    }
+    # Return the payload with the dataframe in the format the client accepts
+    return respond(req, payload, candle_dataframe)
+
+
+@app.route(route="chunked-indicators", methods=["POST"])
+@compute_pool.offload
+@instrumentation.timed("chunked-indicators")
+def chunked_indicators(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Chunked indicators function processed a request.')
+    try:
+        # Open the NDJSON or Arrow candles, which are parsed a chunk at a time as they're used
+        chunk_rows = request_pipeline.get_int(req.params, 'chunk_rows', DEFAULT_CHUNK_ROWS, minimum=1)
+        params, chunks = wire_format.read_chunks(req, chunk_rows)
+        # Restore the indicator state if a token was sent, otherwise start a new one from the indicators
+        state_token = params.get('state')
+        if state_token is not None:
+            state = indicator_state.IndicatorState.from_token(state_token)
+        else:
+            if not isinstance(params.get('indicators'), list) or len(params['indicators']) == 0:
+                raise request_pipeline.RequestError("Invalid request, indicators or state not found")
+            indicator_specs, _ = request_pipeline.indicator_specs(params)
+            state = indicator_state.IndicatorState(indicator_specs)
+        # Compute and encode each chunk in turn. The whole body is built before returning,
+        # so a bad chunk still gives an error response
+        counts = {'input_rows': 0, 'skipped_rows': 0}
+        response = wire_format.make_chunked_response(req, update_chunks(state, chunks, counts))
+    except (ValueError, TypeError, KeyError) as error:
+        return request_pipeline.error_response(error)
+    instrumentation.record(**counts, output_rows=counts['input_rows'] - counts['skipped_rows'])
+    # Return the state and counts in headers, as the body only holds candles
+    response.headers['X-Indicator-State'] = state.to_token()
+    response.headers['X-Indicator-Columns'] = ','.join(state.columns)
+    response.headers['X-Skipped-Rows'] = str(counts['skipped_rows'])
+    return response
+
+
+@app.route(route="store-candles", methods=["POST"])
+@compute_pool.offload
+@instrumentation.timed("store-candles")
+def store_candles(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Store candles function processed a request.')
+    store = candle_store.store_from_settings()
+    if store is None:
+        return func.HttpResponse("Invalid request, the candle store isn't configured", status_code=400)
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        symbol = request_pipeline.get_required(params, 'symbol')
+        timeframe = request_pipeline.get_required(params, 'timeframe')
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp'])
+        # Add the candles after the last stored candle
+        with instrumentation.phase('compute'):
+            appended = store.append(symbol, timeframe, candle_dataframe)
+    except (ValueError, TypeError, KeyError) as error:
+        return request_pipeline.error_response(error)
+    # Create the return payload
+    payload = {'symbol': symbol, 'timeframe': timeframe, 'appended': appended, **store.info(symbol, timeframe)}
+    return make_response(req, payload)
+
+
+@app.route(route="cache-stats", methods=["GET"])
+@instrumentation.timed("cache-stats")
+def cache_stats(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Cache stats function processed a request.')
+    # Create the return payload, with the compute pool sizes and queue to help size the workers as well
+    if cache is None:
+        payload = {'enabled': False}
+    else:
+        payload = {'enabled': True, **cache.stats()}
+    payload['compute_pool'] = compute_pool.stats()
     # Convert the payload to JSON
-    payload = json.dumps(payload)
+    with instrumentation.phase('serialize'):
+        payload = json.dumps(payload)
     # Return the payload
     return func.HttpResponse(
         payload,
@@ -220,126 +688,139 @@ def ichimoku(req: func.HttpRequest) -> func.HttpResponse:
     )
 
 
+@app.warm_up_trigger('warmup')
+def warm_up(warmup) -> None:
+    logging.info('Warm up function processed a request.')
+    startup.warm_up()
+
+
 @app.route(route="calc-sharpe", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-sharpe")
 def sharpe(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Sharpe function processed a request.')
-    # Get the Sharpe parameters from the request
-    annual_risk_free_rate = req.get_json().get('annual_risk_free_rate')
-    # If annual_risk_free_rate is not specified, default to 0.033
-    if annual_risk_free_rate is None:
-        annual_risk_free_rate = 0.033
-    # Get the start_date from the request
-    start_date = req.get_json().get('start_date')
-    # If start_date is not specified, return an error
-    if start_date is None:
-        return func.HttpResponse(
-            f"Invalid request, start_date not found",
-            status_code=400
-        )
-    # Get the end_date from the request
-    end_date = req.get_json().get('end_date')
-    # If end_date is not specified, return an error
-    if end_date is None:
-        return func.HttpResponse(
-            f"Invalid request, end_date not found",
-            status_code=400
-        )
-    # Convert trade_data to a pandas dataframe
-    trade_data = req.get_json().get('trade_data')
-    trade_dataframe = pandas.DataFrame(json.loads(trade_data))
-    # Confirm that the timestamp column is in the dataframe
-    if 'entry_time' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, entry_time not found",
-            status_code=400
+    try:
+        # Read the parameters and trade_data in whichever format was sent
+        params, trade_dataframe = request_pipeline.read_request(req, 'trade_data')
+        # Get the annual risk free rate, default to 0.033
+        annual_risk_free_rate = request_pipeline.get_float(params, 'annual_risk_free_rate', 0.033)
+        # Get the start_date and end_date, both are required
+        start_date = pandas.to_datetime(request_pipeline.get_required(params, 'start_date'))
+        end_date = pandas.to_datetime(request_pipeline.get_required(params, 'end_date'))
+        # Check if compact dtypes should be used
+        compact = request_pipeline.compact_mode(params)
+        # Check for trade_data with the time, price and order type columns
+        request_pipeline.require_data(trade_dataframe, 'trade_data')
+        request_pipeline.require_columns(
+            trade_dataframe, ['entry_time', 'exit_time', 'entry_price', 'exit_price', 'order_type'], 'trade_data',
+            numeric=['entry_price', 'exit_price']
         )
-    if 'exit_time' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, exit_time not found",
-            status_code=400
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Convert the times and sort the trades by exit_time if they aren't in order
+    trade_dataframe = request_pipeline.prepare_trades(trade_dataframe, compact=compact)
+    # Calculate the Sharpe Ratio
+    with instrumentation.phase('compute'):
+        sharpe_data = analysis.calc_sharpe(
+            trade_dataframe=trade_dataframe,
+            start_date=start_date,
+            end_date=end_date,
+            annual_risk_free_rate=annual_risk_free_rate,
+            compact=compact
         )
-    # Check for entry_price and exit_price
-    if 'entry_price' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, entry_price not found",
-            status_code=400
+    # Create the return payload
+    payload = {
+        'sharpe_data': sharpe_data,
+        'annual_risk_free_rate': annual_risk_free_rate
+    }
+    # Return the payload as JSON
+    return respond(req, payload)
+
+
+@app.route(route="calc-rolling-metrics", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-rolling-metrics")
+def rolling_metrics(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Rolling metrics function processed a request.')
+    try:
+        # Read the parameters and trade_data in whichever format was sent
+        params, trade_dataframe = request_pipeline.read_request(req, 'trade_data')
+        # Get the annual risk free rate, default to 0.033
+        annual_risk_free_rate = request_pipeline.get_float(params, 'annual_risk_free_rate', 0.033)
+        # Get the start_date, which is required
+        start_date = pandas.to_datetime(request_pipeline.get_required(params, 'start_date'))
+        # Get the window lengths in days, default to 20
+        windows = params.get('windows', [20])
+        # bool is a subclass of int, so true and false are checked for separately
+        if not isinstance(windows, list) or not all(isinstance(window, int) and not isinstance(window, bool) and window > 0 for window in windows):
+            raise request_pipeline.RequestError("Invalid request, windows must be a list of positive integers")
+        # Get the number of days between windows, default to 1
+        step = request_pipeline.get_int(params, 'step', 1, minimum=1)
+        # Check if expanding windows should be included
+        expanding = bool(params.get('expanding', False))
+        # Check if compact dtypes should be used
+        compact = request_pipeline.compact_mode(params)
+        # Check for trade_data with the columns used to calculate returns
+        request_pipeline.require_data(trade_dataframe, 'trade_data')
+        request_pipeline.require_columns(
+            trade_dataframe, ['order_type', 'exit_time', 'entry_price', 'exit_price'], 'trade_data',
+            numeric=['entry_price', 'exit_price']
         )
-    if 'exit_price' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, exit_price not found",
-            status_code=400
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Convert exit_time and sort the trades by it if they aren't in order
+    trade_dataframe = request_pipeline.prepare_trades(trade_dataframe, time_columns=['exit_time'], compact=compact)
+    # Calculate the metrics for every window
+    with instrumentation.phase('compute'):
+        results = metrics.calc_rolling_metrics(
+            trade_dataframe=trade_dataframe,
+            start_date=start_date,
+            windows=windows,
+            annual_risk_free_rate=annual_risk_free_rate,
+            step=step,
+            expanding=expanding,
+            compact=compact
         )
-    # Make sure exit_time is in datetime format
-    trade_dataframe['exit_time'] = pandas.to_datetime(trade_dataframe['exit_time'], unit='ms')
-    # Make sure entry_time is in datetime format
-    trade_dataframe['entry_time'] = pandas.to_datetime(trade_dataframe['entry_time'], unit='ms')
-    # Make sure the start_date is in datetime format
-    start_date = pandas.to_datetime(start_date)
-    # Make sure the end_date is in datetime format
-    end_date = pandas.to_datetime(end_date)
-    # Sort by timestamp
-    trade_dataframe = trade_dataframe.sort_values(by='exit_time')
-    # Calculate the Sharpe Ratio
-    sharpe_data = analysis.calc_sharpe(
-        trade_dataframe=trade_dataframe,
-        start_date=start_date,
-        end_date=end_date, 
-        annual_risk_free_rate=annual_risk_free_rate
-    )
+    # Convert the arrays to lists, with NaN as null
+    window_metrics = {
+        str(window): {name: json_array(values) for name, values in results[window].items()}
+        for window in windows + (['expanding'] if expanding else [])
+    }
     # Create the return payload
     payload = {
-        'sharpe_data': sharpe_data,
+        'metrics': window_metrics,
+        'dates': json_array(results['dates']),
+        'daily_rfr': results['daily_rfr'],
+        'windows': windows,
+        'step': step,
         'annual_risk_free_rate': annual_risk_free_rate
     }
-    # Convert the payload to JSON
-    payload = json.dumps(payload)
-    # Return the payload
-    return func.HttpResponse(
-        payload,
-        status_code=200
-    )
+    # Return the payload as JSON
+    return respond(req, payload)
 
 
 @app.route(route="calc-wins", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-wins")
 def wins(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Wins function processed a request.')
-    # Check for trade_data
-    trade_data = req.get_json().get('trade_data')
-    if trade_data is None:
-        return func.HttpResponse(
-            f"Invalid request, trade_data not found",
-            status_code=400
-        )
-    # Convert trade_data to a pandas dataframe
-    trade_dataframe = pandas.DataFrame(json.loads(trade_data))
-    # Confirm that the column trade_type is in the dataframe
-    if 'order_type' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, trade_type not found",
-            status_code=400
-        )
-    # Check that all the trade types are either BUY, BUY_STOP, SELL, or SELL_STOP
-    trade_types = ['BUY', 'BUY_STOP', 'SELL', 'SELL_STOP']
-    for trade_type in trade_dataframe['order_type']:
-        if trade_type not in trade_types:
-            return func.HttpResponse(
-                f"Invalid trade_type in trade_data, {trade_type} not found",
-                status_code=400
-            )
-    # Check for entry_price
-    if 'entry_price' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, entry_price not found",
-            status_code=400
-        )
-    # Check for exit_price
-    if 'exit_price' not in trade_dataframe.columns:
-        return func.HttpResponse(
-            f"Invalid columns in trade_data, exit_price not found",
-            status_code=400
-        )
+    try:
+        # Read the parameters and trade_data in whichever format was sent
+        params, trade_dataframe = request_pipeline.read_request(req, 'trade_data')
+        # Check for trade_data
+        request_pipeline.require_data(trade_dataframe, 'trade_data')
+        # Confirm that the column trade_type is in the dataframe
+        if 'order_type' not in trade_dataframe.columns:
+            raise request_pipeline.RequestError("Invalid columns in trade_data, trade_type not found")
+        # Check that all the trade types are either BUY, BUY_STOP, SELL, or SELL_STOP, in one pass over the column
+        request_pipeline.require_values(trade_dataframe['order_type'], request_pipeline.ORDER_TYPES, "Invalid trade_type in trade_data, {} not found")
+        # Check for entry_price and exit_price
+        request_pipeline.require_columns(trade_dataframe, ['entry_price', 'exit_price'], 'trade_data', numeric=['entry_price', 'exit_price'])
+    except ValueError as error:
+        return request_pipeline.error_response(error)
     # Send to calc_wins
-    trade_dataframe = analysis.calc_wins(trade_dataframe)
+    with instrumentation.phase('compute'):
+        trade_dataframe = analysis.calc_wins(trade_dataframe)
     # Calculate the win rate
     win_rate = trade_dataframe['win'].sum() / len(trade_dataframe)
     # Round win_rate to 2 decimals
@@ -360,10 +841,131 @@ def wins(req: func.HttpRequest) -> func.HttpResponse:
         'wins': wins,
         'losses': losses
     }
-    # Convert the payload to JSON
-    payload = json.dumps(payload)
-    # Return the payload
-    return func.HttpResponse(
-        payload,
-        status_code=200
-    )
+    # Return the payload as JSON
+    return respond(req, payload)
+
+
+@app.route(route="calc-portfolio", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-portfolio")
+def portfolio(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Portfolio function processed a request.')
+    try:
+        # Read the parameters and trade_data in whichever format was sent
+        params, trade_dataframe = request_pipeline.read_request(req, 'trade_data')
+        # Get the annual risk free rate, default to 0.033
+        annual_risk_free_rate = request_pipeline.get_float(params, 'annual_risk_free_rate', 0.033)
+        # Get the start_date, which is required
+        start_date = pandas.to_datetime(request_pipeline.get_required(params, 'start_date'))
+        # Get the column naming the strategy of each trade, default to strategy
+        strategy_column = params.get('strategy_column', 'strategy')
+        # Check if compact dtypes should be used
+        compact = request_pipeline.compact_mode(params)
+        # Check for trade_data with the strategy and the columns used to calculate returns
+        request_pipeline.require_data(trade_dataframe, 'trade_data')
+        request_pipeline.require_columns(
+            trade_dataframe, [strategy_column, 'order_type', 'exit_time', 'entry_price', 'exit_price'], 'trade_data',
+            numeric=['entry_price', 'exit_price']
+        )
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Convert exit_time and sort the trades by it if they aren't in order
+    trade_dataframe = request_pipeline.prepare_trades(trade_dataframe, time_columns=['exit_time'], compact=compact)
+    # Calculate the metrics of every strategy and the portfolio
+    with instrumentation.phase('compute'):
+        results = metrics.calc_portfolio(
+            trade_dataframe=trade_dataframe,
+            start_date=start_date,
+            strategy_column=strategy_column,
+            annual_risk_free_rate=annual_risk_free_rate,
+            compact=compact
+        )
+    strategies = results['strategies']
+    # Create the return payload, with NaN as null
+    payload = {
+        'strategies': strategies.index.tolist(),
+        'metrics': {name: json_array(strategies[name].to_numpy()) for name in strategies.columns},
+        'portfolio': {name: None if numpy.isnan(value) else float(value) for name, value in results['portfolio'].items()},
+        'daily_breakdown': results['daily'].reset_index().to_json(orient='records'),
+        'portfolio_daily_breakdown': results['portfolio_daily'].to_json(orient='index'),
+        'daily_rfr': results['daily_rfr'],
+        'annual_risk_free_rate': annual_risk_free_rate
+    }
+    # Return the payload as JSON
+    return respond(req, payload)
+
+
+@app.route(route="calc-backtest", methods=["GET", "POST"])
+@compute_pool.offload
+@instrumentation.timed("calc-backtest")
+def backtest_signals(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Backtest function processed a request.')
+    try:
+        # Read the parameters and candlestick_data in whichever format was sent
+        params, candle_dataframe = request_pipeline.read_request(req, 'candlestick_data')
+        # Check for candlestick_data with the timestamp and close columns
+        request_pipeline.require_data(candle_dataframe, 'candlestick_data')
+        request_pipeline.require_columns(candle_dataframe, ['candle_timestamp', 'candle_close'], numeric=['candle_close'])
+        # Get the rule which generates the trades and check the columns it uses
+        rule, rule_columns = request_pipeline.backtest_rule(params, candle_dataframe)
+        # Get the position to take and the price to fill at, default to long and close
+        direction = request_pipeline.get_choice(params, 'direction', backtest.DIRECTIONS, 'long')
+        fill = request_pipeline.get_choice(params, 'fill', backtest.FILLS, 'close')
+        if fill == 'next_open':
+            request_pipeline.require_columns(candle_dataframe, ['candle_open'], numeric=['candle_open'])
+        # Check if a trade still open at the last candle should be closed, default to True
+        close_final = bool(params.get('close_final', True))
+        # Get the annual risk free rate, default to 0.033
+        annual_risk_free_rate = request_pipeline.get_float(params, 'annual_risk_free_rate', 0.033)
+        # Get the start_date, default to the date of the first candle
+        start_date = params.get('start_date')
+        if start_date is not None:
+            start_date = pandas.to_datetime(start_date)
+        # Check if the trades should be returned, default to True
+        return_trades = bool(params.get('return_trades', True))
+        # Check if compact dtypes should be used
+        compact = request_pipeline.compact_mode(params)
+    except ValueError as error:
+        return request_pipeline.error_response(error)
+    # Drop the candle columns the rule and the fills don't use
+    used_columns = ['candle_timestamp', 'candle_open', 'candle_close', 'high', 'low'] + rule_columns
+    candle_dataframe = candle_dataframe[[column for column in candle_dataframe.columns if column in used_columns]]
+    # Convert the timestamps and sort the candles if they aren't in order
+    candle_dataframe = request_pipeline.prepare_candles(candle_dataframe, compact=compact)
+    # Generate the trades and calculate the Sharpe Ratio and wins
+    try:
+        with instrumentation.phase('compute'):
+            results = backtest.run_backtest(
+                candle_dataframe,
+                rule,
+                direction=direction,
+                fill=fill,
+                close_final=close_final,
+                start_date=start_date,
+                annual_risk_free_rate=annual_risk_free_rate,
+                compact=compact
+            )
+    except (ValueError, KeyError) as error:
+        return request_pipeline.error_response(error)
+    trade_dataframe = results['trades']
+    # Create the return payload, with NaN as null, as a backtest without trades has no ROI or Sharpe Ratio
+    payload = {
+        'rule': rule,
+        'direction': direction,
+        'fill': fill,
+        'close_final': close_final,
+        'trades': len(trade_dataframe),
+        'sharpe_data': {
+            name: None if isinstance(value, float) and numpy.isnan(value) else value
+            for name, value in results['sharpe_data'].items()
+        },
+        'win_rate': None if numpy.isnan(results['win_rate']) else results['win_rate'],
+        'wins': results['wins'],
+        'losses': results['losses'],
+        'annual_risk_free_rate': annual_risk_free_rate
+    }
+    # Return the payload with the trades in the format the client accepts
+    if not return_trades:
+        return respond(req, payload)
+    trade_columns = ['entry_time', 'exit_time', 'entry_price', 'exit_price', 'order_type', 'win', 'raw_return', 'excess_return']
+    return respond(req, payload, trade_dataframe[trade_columns], data_key='trade_data')
@@ -0,0 +1,598 @@
+import base64
+import json
+import math
+import os
+import zlib
+from collections import deque
+import numpy
+import pandas as pd
+import kernels
+
+# Longest indicator length a state can hold, as the state keeps up to this many values.
+# Set with the MAX_INDICATOR_LENGTH app setting
+MAX_INDICATOR_LENGTH = int(os.environ.get('MAX_INDICATOR_LENGTH', 10000))
+# Largest decompressed size of a state token in bytes. Set with the MAX_STATE_TOKEN_BYTES app setting
+MAX_STATE_TOKEN_BYTES = int(os.environ.get('MAX_STATE_TOKEN_BYTES', 10000000))
+
+
+# Function to check an indicator length
+def _length(value, name):
+    """
+    Function to cast an indicator length into an integer and check it's from 1 to MAX_INDICATOR_LENGTH
+    :param value: The length
+    :param name: Name of the length, for the error message
+    """
+    if isinstance(value, bool) or int(value) != value or not 1 <= value <= MAX_INDICATOR_LENGTH:
+        raise ValueError(f"invalid {name} {value}, must be a whole number from 1 to {MAX_INDICATOR_LENGTH}")
+    return int(value)
+
+
+# Function to check a value column name
+def _column(value, name):
+    if not isinstance(value, str):
+        raise ValueError(f"invalid {name} {value}, must be a column name")
+    return value
+
+
+# Function to check a list of numbers held by a state
+def _floats(values, limit, name):
+    """
+    Function to check a list from a state token holds at most limit numbers
+    :param values: The list
+    :param limit: Largest number of values the list can hold
+    :param name: Name of the list, for the error message
+    :return: List of floats
+    """
+    if not isinstance(values, list) or len(values) > limit:
+        raise ValueError(f"invalid {name}, must be a list of at most {limit} values")
+    return [float(value) for value in values]
+
+
+# Exponentially weighted mean which can be updated one value at a time
+class _EWMean:
+    """
+    Exponentially weighted mean updated one value at a time. Follows the same steps as
+    pandas ewm().mean() so the values match the full history calculation exactly.
+    :param alpha: Smoothing factor
+    :param adjust: Same as the pandas ewm adjust argument
+    :param min_periods: Number of observations needed before a value is returned
+    """
+    def __init__(self, alpha, adjust, min_periods=0):
+        self.alpha = alpha
+        self.adjust = adjust
+        self.min_periods = min_periods
+        self.weighted = math.nan
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, value):
+        """
+        Function to add a value to the mean
+        :param value: The new value, NaN values decay the weights the same way pandas does
+        :return: The current mean, or NaN while there are fewer than min_periods observations
+        """
+        is_observation = not math.isnan(value)
+        self.nobs += int(is_observation)
+        if not math.isnan(self.weighted):
+            self.old_wt *= 1 - self.alpha
+            if is_observation:
+                new_wt = 1.0 if self.adjust else self.alpha
+                if self.weighted != value:
+                    self.weighted = self.old_wt * self.weighted + new_wt * value
+                    self.weighted /= (self.old_wt + new_wt)
+                if self.adjust:
+                    self.old_wt += new_wt
+                else:
+                    self.old_wt = 1.0
+        elif is_observation:
+            self.weighted = value
+        return self.weighted if self.nobs >= max(self.min_periods, 1) else math.nan
+
+    def update_many(self, values):
+        """
+        Function to add many values at once with the NumPy kernel, giving the same means as update
+        :param values: Array of new values
+        :return: Array of the means after each value
+        """
+        output, self.weighted, self.old_wt, self.nobs = kernels.ewm_mean(
+            values, self.alpha, self.adjust, self.min_periods, self.weighted, self.old_wt, self.nobs
+        )
+        return output
+
+    def to_dict(self):
+        return {'weighted': self.weighted, 'old_wt': self.old_wt, 'nobs': self.nobs}
+
+    def load_dict(self, data):
+        self.weighted = float(data['weighted'])
+        self.old_wt = float(data['old_wt'])
+        self.nobs = int(data['nobs'])
+        if self.nobs < 0:
+            raise ValueError(f"invalid nobs {self.nobs}")
+
+
+# Rolling max or min over a fixed window which can be updated one value at a time
+class _RollingExtreme:
+    """
+    Rolling max or min using a monotonic deque, so each update is O(1) amortized.
+    Matches pandas rolling(length, min_periods=length).max() / .min()
+    :param length: Length of the window
+    :param mode: 'max' or 'min'
+    """
+    def __init__(self, length, mode):
+        self.length = _length(length, 'length')
+        self.mode = mode
+        self.count = 0
+        # Deque of [position, value] pairs with monotonic values
+        self.window = deque()
+        # Positions of NaN values still inside the window
+        self.nan_positions = deque()
+
+    def update(self, value):
+        """
+        Function to add a value to the window
+        :param value: The new value
+        :return: The max or min of the window, or NaN until the window holds length valid values
+        """
+        self.count += 1
+        oldest = self.count - self.length
+        # Remove values which have left the window
+        while self.window and self.window[0][0] <= oldest:
+            self.window.popleft()
+        while self.nan_positions and self.nan_positions[0] <= oldest:
+            self.nan_positions.popleft()
+        if math.isnan(value):
+            self.nan_positions.append(self.count)
+        else:
+            # Remove values which can no longer be the max or min
+            if self.mode == 'max':
+                while self.window and self.window[-1][1] <= value:
+                    self.window.pop()
+            else:
+                while self.window and self.window[-1][1] >= value:
+                    self.window.pop()
+            self.window.append([self.count, value])
+        valid = min(self.count, self.length) - len(self.nan_positions)
+        return self.window[0][1] if valid >= self.length else math.nan
+
+    def update_many(self, values):
+        """
+        Function to add many values at once with the NumPy kernels, giving the same values as update
+        :param values: Array of new values
+        :return: Array of the max or min of the window after each value
+        """
+        values = kernels.as_float_array(values)
+        if len(values) == 0:
+            return values
+        # Rebuild the last length - 1 values of the window. Values dropped from the deque can't be the
+        # max or min of a later window, so they are filled with -inf for max or inf for min. Positions
+        # before the first value are NaN, so those windows stay incomplete
+        first = self.count - self.length + 2
+        prefix = numpy.full(self.length - 1, -numpy.inf if self.mode == 'max' else numpy.inf)
+        prefix[:max(1 - first, 0)] = numpy.nan
+        for position, value in self.window:
+            if position >= first:
+                prefix[position - first] = value
+        for position in self.nan_positions:
+            if position >= first:
+                prefix[position - first] = numpy.nan
+        combined = numpy.concatenate([prefix, values])
+        if self.mode == 'max':
+            output = kernels.rolling_max(combined, self.length)[len(prefix):]
+        else:
+            output = kernels.rolling_min(combined, self.length)[len(prefix):]
+        # Rebuild the deque from the values in the final window
+        self.count += len(values)
+        self.window = deque()
+        self.nan_positions = deque()
+        for position in range(max(self.count - self.length + 1, 1), self.count + 1):
+            value = float(combined[position - first])
+            if math.isnan(value):
+                self.nan_positions.append(position)
+                continue
+            if self.mode == 'max':
+                while self.window and self.window[-1][1] <= value:
+                    self.window.pop()
+            else:
+                while self.window and self.window[-1][1] >= value:
+                    self.window.pop()
+            self.window.append([position, value])
+        return output
+
+    def to_dict(self):
+        return {'count': self.count, 'window': list(self.window), 'nan_positions': list(self.nan_positions)}
+
+    def load_dict(self, data):
+        self.count = int(data['count'])
+        # Every position held must be inside the last window, with at most length of them
+        positions = _floats([item[0] for item in data['window']] + data['nan_positions'], self.length, 'window')
+        if any(position != int(position) or not self.count - self.length < position <= self.count for position in positions):
+            raise ValueError(f"invalid window, positions must be within the last {self.length} of {self.count}")
+        self.window = deque([int(position), float(value)] for position, value in data['window'])
+        self.nan_positions = deque(int(position) for position in data['nan_positions'])
+
+
+# EMA which can be updated one candle at a time
+class EMAState:
+    """
+    EMA state matching indicators.calc_ema. The EMA is seeded with the simple average of
+    the first period values, the same as Pandas TA.
+    :param period: Length of EMA, default is 20
+    :param value: Which value to use, default is candle_close
+    """
+    indicator = 'ema'
+
+    def __init__(self, period=20, value='candle_close'):
+        self.period = _length(period, 'period')
+        self.value = _column(value, 'value')
+        # Values held until there are enough to seed the EMA
+        self.seed_values = []
+        self.mean = _EWMean(alpha=2 / (self.period + 1), adjust=False)
+
+    @property
+    def columns(self):
+        return [f'ema_{self.period}']
+
+    def update(self, candle):
+        """
+        Function to add a candle to the EMA
+        :param candle: Mapping of column names to values for a single candle
+        :return: Dictionary of the EMA column and its value for this candle
+        """
+        price = float(candle[self.value])
+        if len(self.seed_values) < self.period:
+            self.seed_values.append(price)
+            if len(self.seed_values) < self.period:
+                return {f'ema_{self.period}': math.nan}
+            # Seed with the simple average of the first period values
+            price = pd.Series(self.seed_values).mean()
+        return {f'ema_{self.period}': self.mean.update(price)}
+
+    def update_many(self, candles):
+        """
+        Function to add many candles to the EMA at once, giving the same values as update
+        :param candles: Mapping of column names to arrays of values
+        :return: Dictionary of the EMA column and its array of values
+        """
+        prices = kernels.as_float_array(candles[self.value])
+        output = numpy.full(len(prices), numpy.nan)
+        start = 0
+        if len(self.seed_values) < self.period:
+            start = min(self.period - len(self.seed_values), len(prices))
+            self.seed_values.extend(prices[:start].tolist())
+            if len(self.seed_values) < self.period:
+                return {f'ema_{self.period}': output}
+            # Seed with the simple average of the first period values
+            prices = prices.copy()
+            start -= 1
+            prices[start] = pd.Series(self.seed_values).mean()
+        output[start:] = self.mean.update_many(prices[start:])
+        return {f'ema_{self.period}': output}
+
+    def to_dict(self):
+        return {
+            'indicator': self.indicator,
+            'period': self.period,
+            'value': self.value,
+            'seed_values': self.seed_values,
+            'mean': self.mean.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(period=data['period'], value=data['value'])
+        state.seed_values = _floats(data['seed_values'], state.period, 'seed_values')
+        state.mean.load_dict(data['mean'])
+        return state
+
+
+# RSI which can be updated one candle at a time
+class RSIState:
+    """
+    RSI state matching indicators.calc_rsi, using Wilder smoothing of gains and losses.
+    :param period: Length of RSI, default is 14
+    :param value: Which value to use, default is candle_close
+    """
+    indicator = 'rsi'
+
+    def __init__(self, period=14, value='candle_close'):
+        self.period = _length(period, 'period')
+        self.value = _column(value, 'value')
+        self.previous = math.nan
+        self.gains = _EWMean(alpha=1 / self.period, adjust=True, min_periods=self.period)
+        self.losses = _EWMean(alpha=1 / self.period, adjust=True, min_periods=self.period)
+
+    @property
+    def columns(self):
+        return ['rsi']
+
+    def update(self, candle):
+        """
+        Function to add a candle to the RSI
+        :param candle: Mapping of column names to values for a single candle
+        :return: Dictionary of the rsi column and its value for this candle
+        """
+        price = float(candle[self.value])
+        change = price - self.previous
+        self.previous = price
+        # Split the change into a gain and a loss, leaving NaN changes as NaN
+        gain = 0.0 if change < 0 else change
+        loss = 0.0 if change > 0 else change
+        average_gain = self.gains.update(gain)
+        average_loss = self.losses.update(loss)
+        return {'rsi': 100 * average_gain / (average_gain + abs(average_loss))}
+
+    def update_many(self, candles):
+        """
+        Function to add many candles to the RSI at once, giving the same values as update
+        :param candles: Mapping of column names to arrays of values
+        :return: Dictionary of the rsi column and its array of values
+        """
+        prices = kernels.as_float_array(candles[self.value])
+        if len(prices) == 0:
+            return {'rsi': numpy.empty(0)}
+        change = prices - numpy.concatenate([[self.previous], prices[:-1]])
+        self.previous = float(prices[-1])
+        # Split the changes into gains and losses, leaving NaN changes as NaN
+        average_gain = self.gains.update_many(numpy.where(change < 0, 0.0, change))
+        average_loss = self.losses.update_many(numpy.where(change > 0, 0.0, change))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return {'rsi': 100 * average_gain / (average_gain + numpy.abs(average_loss))}
+
+    def to_dict(self):
+        return {
+            'indicator': self.indicator,
+            'period': self.period,
+            'value': self.value,
+            'previous': self.previous,
+            'gains': self.gains.to_dict(),
+            'losses': self.losses.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(period=data['period'], value=data['value'])
+        state.previous = float(data['previous'])
+        state.gains.load_dict(data['gains'])
+        state.losses.load_dict(data['losses'])
+        return state
+
+
+# Ichimoku Cloud which can be updated one candle at a time
+class IchimokuState:
+    """
+    Ichimoku Cloud state matching the columns of indicators.calc_ichimoku. The chikou span
+    (ICS) is the close kijun candles in the future, so it can't be known for new candles
+    and is not returned.
+    :param tenkan: Length of Tenkan, default is 9
+    :param kijun: Length of Kijun, default is 26
+    :param senoku: Length of Senoku, default is 52
+    """
+    indicator = 'ichimoku'
+
+    def __init__(self, tenkan=9, kijun=26, senoku=52, high_value='high', low_value='low', close_value='candle_close'):
+        self.tenkan = _length(tenkan, 'tenkan')
+        self.kijun = _length(kijun, 'kijun')
+        self.senoku = _length(senoku, 'senoku')
+        self.high_value = _column(high_value, 'high_value')
+        self.low_value = _column(low_value, 'low_value')
+        self.close_value = _column(close_value, 'close_value')
+        self.windows = {
+            f'{length}_{mode}': _RollingExtreme(length, mode)
+            for length in [self.tenkan, self.kijun, self.senoku] for mode in ['max', 'min']
+        }
+        # The last kijun spanA and spanB values, used for the unshifted spans
+        self.spans = deque(maxlen=self.kijun)
+
+    @property
+    def columns(self):
+        return [
+            f'ITS_{self.tenkan}', f'IKS_{self.kijun}',
+            'spanA_unshifted', 'spanB_unshifted', 'spanA_shifted', 'spanB_shifted'
+        ]
+
+    def _midprice(self, length, high, low):
+        highest = self.windows[f'{length}_max'].update(high)
+        lowest = self.windows[f'{length}_min'].update(low)
+        return 0.5 * (lowest + highest)
+
+    def update(self, candle):
+        """
+        Function to add a candle to the Ichimoku Cloud
+        :param candle: Mapping of column names to values for a single candle
+        :return: Dictionary of the Ichimoku columns and their values for this candle
+        """
+        high = float(candle[self.high_value])
+        low = float(candle[self.low_value])
+        # Update each distinct window once, even when the lengths are equal
+        midprices = {}
+        for length in [self.tenkan, self.kijun, self.senoku]:
+            if length not in midprices:
+                midprices[length] = self._midprice(length, high, low)
+        span_a = 0.5 * (midprices[self.tenkan] + midprices[self.kijun])
+        span_b = midprices[self.senoku]
+        # Unfilled spans are 0.0, the same as calc_ichimoku
+        span_a = 0.0 if math.isnan(span_a) else span_a
+        span_b = 0.0 if math.isnan(span_b) else span_b
+        if len(self.spans) == self.kijun:
+            span_a_unshifted, span_b_unshifted = self.spans[0]
+        else:
+            span_a_unshifted, span_b_unshifted = 0.0, 0.0
+        self.spans.append([span_a, span_b])
+        return {
+            f'ITS_{self.tenkan}': midprices[self.tenkan],
+            f'IKS_{self.kijun}': midprices[self.kijun],
+            'spanA_unshifted': span_a_unshifted,
+            'spanB_unshifted': span_b_unshifted,
+            'spanA_shifted': span_a,
+            'spanB_shifted': span_b
+        }
+
+    def update_many(self, candles):
+        """
+        Function to add many candles to the Ichimoku Cloud at once, giving the same values as update
+        :param candles: Mapping of column names to arrays of values
+        :return: Dictionary of the Ichimoku columns and their arrays of values
+        """
+        high = kernels.as_float_array(candles[self.high_value])
+        low = kernels.as_float_array(candles[self.low_value])
+        # Update each distinct window once, even when the lengths are equal
+        midprices = {}
+        for length in [self.tenkan, self.kijun, self.senoku]:
+            if length not in midprices:
+                lowest = self.windows[f'{length}_min'].update_many(low)
+                highest = self.windows[f'{length}_max'].update_many(high)
+                midprices[length] = 0.5 * (lowest + highest)
+        # Unfilled spans are 0.0, the same as calc_ichimoku
+        span_a = numpy.nan_to_num(0.5 * (midprices[self.tenkan] + midprices[self.kijun]), nan=0.0)
+        span_b = numpy.nan_to_num(midprices[self.senoku], nan=0.0)
+        # The unshifted spans are the spans kijun candles earlier, including the ones held from earlier updates
+        held = numpy.array(list(self.spans), dtype=float).reshape(-1, 2)
+        combined = numpy.concatenate([held, numpy.column_stack([span_a, span_b])])
+        unshifted = numpy.zeros((len(high), 2))
+        positions = numpy.arange(len(high)) + len(held) - self.kijun
+        unshifted[positions >= 0] = combined[positions[positions >= 0]]
+        self.spans = deque(combined[len(combined) - min(self.kijun, len(combined)):].tolist(), maxlen=self.kijun)
+        return {
+            f'ITS_{self.tenkan}': midprices[self.tenkan],
+            f'IKS_{self.kijun}': midprices[self.kijun],
+            'spanA_unshifted': unshifted[:, 0],
+            'spanB_unshifted': unshifted[:, 1],
+            'spanA_shifted': span_a,
+            'spanB_shifted': span_b
+        }
+
+    def to_dict(self):
+        return {
+            'indicator': self.indicator,
+            'tenkan': self.tenkan,
+            'kijun': self.kijun,
+            'senoku': self.senoku,
+            'high_value': self.high_value,
+            'low_value': self.low_value,
+            'close_value': self.close_value,
+            'windows': {name: window.to_dict() for name, window in self.windows.items()},
+            'spans': list(self.spans)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(
+            tenkan=data['tenkan'],
+            kijun=data['kijun'],
+            senoku=data['senoku'],
+            high_value=data['high_value'],
+            low_value=data['low_value'],
+            close_value=data['close_value']
+        )
+        if sorted(data['windows']) != sorted(state.windows):
+            raise ValueError(f"invalid windows, must be {', '.join(state.windows)}")
+        for name, window in data['windows'].items():
+            state.windows[name].load_dict(window)
+        if not isinstance(data['spans'], list) or len(data['spans']) > state.kijun or any(len(pair) != 2 for pair in data['spans']):
+            raise ValueError(f"invalid spans, must be a list of at most {state.kijun} pairs")
+        state.spans = deque((_floats(pair, 2, 'spans') for pair in data['spans']), maxlen=state.kijun)
+        return state
+
+
+# State classes for each indicator
+STATE_CLASSES = {
+    'ema': EMAState,
+    'rsi': RSIState,
+    'ichimoku': IchimokuState
+}
+
+
+# Collection of indicator states which are updated together
+class IndicatorState:
+    """
+    Collection of indicator states updated from the same candles. Candles at or before the last
+    candle already seen are skipped, so overlapping uploads are safe.
+    :param indicator_specs: List of indicator specs, the same format as indicators.calc_indicators.
+    The EMA accuracy_filter option is ignored, as warm up values are returned as NaN instead
+    """
+    def __init__(self, indicator_specs):
+        self.states = []
+        for spec in indicator_specs:
+            kwargs = dict(spec)
+            name = kwargs.pop('indicator', None)
+            kwargs.pop('accuracy_filter', None)
+            if name not in STATE_CLASSES:
+                raise ValueError(f"invalid indicator {name}")
+            self.states.append(STATE_CLASSES[name](**kwargs))
+        # Timestamp in milliseconds of the last candle seen
+        self.last_timestamp = None
+
+    @property
+    def columns(self):
+        return [column for state in self.states for column in state.columns]
+
+    @property
+    def value_columns(self):
+        return sorted({
+            getattr(state, name) for state in self.states
+            for name in ['value', 'high_value', 'low_value'] if hasattr(state, name)
+        })
+
+    def update(self, candle_dataframe):
+        """
+        Function to add new candles to every indicator
+        :param candle_dataframe: Dataframe of new candles sorted by candle_timestamp
+        :return: Dataframe of the candles which were new, with the indicator columns added
+        """
+        # Convert the timestamps to milliseconds so they can be compared with the stored state
+        timestamps = candle_dataframe['candle_timestamp']
+        if pd.api.types.is_datetime64_any_dtype(timestamps):
+            timestamps = timestamps.astype('datetime64[ms]').astype('int64')
+        timestamps = timestamps.to_numpy(dtype='int64')
+        # Skip candles which have already been seen
+        if self.last_timestamp is not None:
+            candle_dataframe = candle_dataframe[timestamps > self.last_timestamp]
+            timestamps = timestamps[timestamps > self.last_timestamp]
+        # Update each indicator with whole columns at once, which gives the same values as one candle at a time
+        candles = {column: candle_dataframe[column].to_numpy(dtype=float) for column in self.value_columns}
+        values = {}
+        for state in self.states:
+            values.update(state.update_many(candles))
+        if len(timestamps) > 0:
+            self.last_timestamp = int(timestamps[-1])
+        return candle_dataframe.assign(**values)
+
+    def to_token(self):
+        """
+        Function to serialize the state into an opaque token
+        :return: URL safe string which can be passed to from_token
+        """
+        data = {
+            'last_timestamp': self.last_timestamp,
+            'states': [state.to_dict() for state in self.states]
+        }
+        return base64.urlsafe_b64encode(zlib.compress(json.dumps(data).encode('utf-8'))).decode('ascii')
+
+    @classmethod
+    def from_token(cls, token):
+        """
+        Function to restore a state from a token created by to_token. The token comes from the client,
+        so it's decompressed up to MAX_STATE_TOKEN_BYTES and every length and buffer is checked
+        :param token: Token string
+        :return: The restored state. Raises ValueError if the token is invalid
+        """
+        if not isinstance(token, str):
+            raise ValueError("invalid state token, must be a string")
+        try:
+            decompressor = zlib.decompressobj()
+            raw = decompressor.decompress(base64.urlsafe_b64decode(token.encode('ascii')), MAX_STATE_TOKEN_BYTES)
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"larger than {MAX_STATE_TOKEN_BYTES} bytes")
+            if not decompressor.eof:
+                raise ValueError("incomplete data")
+            data = json.loads(raw)
+            state = cls([])
+            if data['last_timestamp'] is not None:
+                state.last_timestamp = int(data['last_timestamp'])
+            for item in data['states']:
+                if item['indicator'] not in STATE_CLASSES:
+                    raise ValueError(f"invalid indicator {item['indicator']}")
+                state.states.append(STATE_CLASSES[item['indicator']].from_dict(item))
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError, OverflowError, zlib.error) as error:
+            raise ValueError(f"invalid state token, {error}")
+        return state
@@ -1,17 +1,78 @@
-import pandas_ta as ta
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy
 import pandas as pd
+import kernels
+import candle_store
+
+
+# Backends which can calculate the indicators. pandas_ta uses the Pandas TA library, native uses the NumPy kernels in kernels.py
+BACKENDS = ['pandas_ta', 'native']
+# Backend used by the calc_ functions. Set with the INDICATOR_BACKEND app setting or set_backend
+_backend = os.environ.get('INDICATOR_BACKEND', 'pandas_ta')
+
+
+# Pandas TA module, imported by load_pandas_ta the first time the pandas_ta backend is used, as the import is slow
+_pandas_ta = None
+
+
+# Number of worker processes used by calc_indicators_multi. Set with the MULTI_SYMBOL_WORKERS app setting
+MULTI_SYMBOL_WORKERS = int(os.environ.get('MULTI_SYMBOL_WORKERS', os.cpu_count() or 1))
+# Process pool shared by calc_indicators_multi calls, created on first use
+_process_pool = None
+
+
+# Indicators calc_sweep can calculate, with the kernel which calculates many periods at once
+SWEEP_INDICATORS = {'ema': kernels.ema_many, 'rsi': kernels.rsi_many}
+
+
+# Function to import Pandas TA
+def load_pandas_ta():
+    """
+    Function to import Pandas TA the first time it's needed, so requests using the native backend
+    and routes without indicators don't pay for the import
+    :return: The pandas_ta module
+    """
+    global _pandas_ta
+    if _pandas_ta is None:
+        import pandas_ta
+        _pandas_ta = pandas_ta
+    return _pandas_ta
+
+
+# Function to choose the backend used to calculate indicators
+def set_backend(backend):
+    """
+    Function to choose the backend used to calculate indicators
+    :param backend: 'pandas_ta' or 'native'
+    """
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"invalid backend {backend}, must be one of {BACKENDS}")
+    _backend = backend
+
+
+# Function to get the backend used to calculate indicators
+def get_backend():
+    return _backend
 
 
 # Function to calculate RSI
 def calc_rsi(candle_dataframe, period=14, value='candle_close'):
     """
     Function to calculate RSI using Pandas TA library. https://github.com/twopirllc/pandas-ta
-    :param candlestick_data: Dataframe containing candlestick data
+    Uses the NumPy kernels instead when the native backend is selected, see set_backend
+    :param candlestick_data: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
     :param period: Length of RSI, default is 14
     :param value: Which value to use, default is candle_close
     """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
     # Calculate the RSI
-    rsi = ta.rsi(close=candle_dataframe[value], length=period)
+    if _backend == 'native':
+        rsi = kernels.rsi(candle_dataframe[value], period)
+    else:
+        rsi = load_pandas_ta().rsi(close=candle_dataframe[value], length=period)
     # Concat to the original dataframe
     candle_dataframe['rsi'] = rsi
     return candle_dataframe
@@ -20,13 +81,17 @@ def calc_rsi(candle_dataframe, period=14, value='candle_close'):
 # Function to calculate EMA
 def calc_ema(candle_dataframe, period=20, value='candle_close', accuracy_filter=True):
     """
-    Function to calculate EMA using Pandas TA library.
-    :param candlestick_data: Dataframe containing candlestick data
+    Function to calculate EMA using Pandas TA library, or the NumPy kernels with the native backend.
+    :param candlestick_data: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
     :param period: Length of EMA, default is 20
     :param value: Which value to use, default is candle_close
     """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
     # Calculate the EMA
-    ema = ta.ema(close=candle_dataframe[value], length=period)
+    if _backend == 'native':
+        ema = kernels.ema(candle_dataframe[value], period)
+    else:
+        ema = load_pandas_ta().ema(close=candle_dataframe[value], length=period)
     # Concat to the original dataframe
     ema_name = f'ema_{period}'
     candle_dataframe[ema_name] = ema
@@ -37,55 +102,274 @@ def calc_ema(candle_dataframe, period=20, value='candle_close', accuracy_filter=
 
 
 # Function to calculate the Ichimoku Cloudtenkan=9, kijun=26, senoku=52
-def calc_ichimoku(candle_dataframe, tenkan=9, kijun=26, senoku=52, high_value='high', low_value='low', close_value='candle_close'):
+def calc_ichimoku(candle_dataframe, tenkan=9, kijun=26, senoku=52, high_value='high', low_value='low', close_value='candle_close', new_columns_only=False, chikou=True):
     """
-    Function to calculate Ichimoku Cloud using Pandas TA library.
-    :param candlestick_data: Dataframe containing candlestick data
+    Function to calculate Ichimoku Cloud using Pandas TA library, or the NumPy kernels with the native backend.
+    Each output column is built once from the Tenkan, Kijun and Senoku midprices, rather than merging
+    the Pandas TA frames into the candles and shifting them.
+    :param candlestick_data: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
     :param tenkan: Length of Tenkan, default is 9
     :param kijun: Length of Kijun, default is 26
     :param senoku: Length of Senoku, default is 52
     :param value: Which value to use, default is candle_close
+    :param new_columns_only: Return only the Ichimoku columns instead of the candles with the columns added, default is False
+    :param chikou: Include the chikou span, the close kijun candles later, default is True. False leaves it out, so each row
+    only depends on earlier candles and the last kijun rows are kept
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    high = candle_dataframe[high_value]
+    low = candle_dataframe[low_value]
+    close = candle_dataframe[close_value].to_numpy(dtype=float)
+    # Calculate the Tenkan, Kijun and Senoku midprices
+    tenkan_sen = _midprice(high, low, tenkan)
+    kijun_sen = _midprice(high, low, kijun)
+    senoku_span = _midprice(high, low, senoku)
+    # spanA and spanB are the cloud for the current candle, plotted kijun candles ahead. Missing values are 0.0
+    span_a_shifted = 0.5 * (tenkan_sen + kijun_sen)
+    span_b_shifted = senoku_span
+    span_a_shifted[numpy.isnan(span_a_shifted)] = 0.0
+    span_b_shifted[numpy.isnan(span_b_shifted)] = 0.0
+    # The unshifted spans are the cloud plotted at the current candle, which was calculated kijun candles ago
+    remaining = max(len(close) - kijun, 0)
+    span_a_unshifted = numpy.zeros(len(close))
+    span_b_unshifted = numpy.zeros(len(close))
+    span_a_unshifted[len(close) - remaining:] = span_a_shifted[:remaining]
+    span_b_unshifted[len(close) - remaining:] = span_b_shifted[:remaining]
+    # The chikou span is the close kijun candles ahead
+    chikou_span = numpy.full(len(close), numpy.nan)
+    chikou_span[:remaining] = close[len(close) - remaining:]
+    ichimoku_columns = {
+        f'ITS_{tenkan}': tenkan_sen,
+        f'IKS_{kijun}': kijun_sen,
+        f'ICS_{kijun}': chikou_span,
+        'spanA_unshifted': span_a_unshifted,
+        'spanB_unshifted': span_b_unshifted,
+        'spanA_shifted': span_a_shifted,
+        'spanB_shifted': span_b_shifted
+    }
+    if not chikou:
+        del ichimoku_columns[f'ICS_{kijun}']
+        chikou_span = numpy.zeros(len(close))
+    # Keep the rows without any NaN values
+    keep = ~(numpy.isnan(tenkan_sen) | numpy.isnan(kijun_sen) | numpy.isnan(chikou_span))
+    for column in candle_dataframe.columns:
+        keep &= candle_dataframe[column].notna().to_numpy()
+    positions = numpy.flatnonzero(keep)
+    if new_columns_only:
+        return pd.DataFrame(
+            {name: values[positions] for name, values in ichimoku_columns.items()},
+            index=candle_dataframe.index[positions]
+        )
+    # Take the kept rows once, then add each column
+    candle_dataframe = candle_dataframe.take(positions)
+    for name, values in ichimoku_columns.items():
+        candle_dataframe[name] = values[positions]
+    return candle_dataframe
+
+
+# Function to get the number of earlier candles an Ichimoku row depends on
+def ichimoku_lookback(tenkan=9, kijun=26, senoku=52):
+    """
+    Function to get the number of earlier candles the Ichimoku values of a row depend on. The
+    unshifted spans were calculated kijun candles earlier over the longest window. Each row also
+    depends on the candle kijun candles later, through the chikou span.
+    :param tenkan: Length of Tenkan, default is 9
+    :param kijun: Length of Kijun, default is 26
+    :param senoku: Length of Senoku, default is 52
+    """
+    return kijun + max(tenkan, kijun, senoku) - 1
+
+
+# Function to calculate the Ichimoku Cloud spans of every candle
+def calc_cloud(candle_dataframe, tenkan=9, kijun=26, senoku=52, high_value='high', low_value='low'):
+    """
+    Function to calculate spanA_shifted and spanB_shifted, the cloud calculated at each candle, for every
+    candle. Unlike calc_ichimoku no rows are removed, and the spans are NaN until there are enough
+    candles, so the values of a candle only depend on it and the candles before it.
+    :param candle_dataframe: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
+    :param tenkan: Length of Tenkan, default is 9
+    :param kijun: Length of Kijun, default is 26
+    :param senoku: Length of Senoku, default is 52
+    :return: Tuple of (spanA_shifted array, spanB_shifted array)
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    high = candle_dataframe[high_value]
+    low = candle_dataframe[low_value]
+    span_a = 0.5 * (_midprice(high, low, tenkan) + _midprice(high, low, kijun))
+    return span_a, _midprice(high, low, senoku)
+
+
+# Function to calculate the midprice used by the Ichimoku Cloud
+def _midprice(high, low, length):
     """
-    # Calculate the ichimoku cloud
-    ichimoku = ta.ichimoku(
-        high=candle_dataframe[high_value], 
-        low=candle_dataframe[low_value], 
-        close=candle_dataframe[close_value], 
-        tenkan=tenkan, 
-        kijun=kijun, 
-        senkou=senoku
-    )
-    # Get the ISA name
-    isa_name = f'ISA_{tenkan}'
-    # Get the ISB name
-    isb_name = f'ISB_{kijun}'
-    # Rename the columns of ichimoku[1] to be the isa_name and isb_name with "_future" appended
-    ichimoku[1].rename(columns={isa_name: f"{isa_name}_future", isb_name: f"{isb_name}_future"}, inplace=True)
-    # Concat ichimoku[1] to data
-    candle_dataframe = pd.concat([candle_dataframe, ichimoku[0], ichimoku[1]], axis=1)
-    # Add columns for spanA and spanB
-    candle_dataframe["spanA"] = 0.0
-    candle_dataframe["spanB"] = 0.0
-    # For spanA set it to be the value of the isa_name as long as the values are not NaN
-    candle_dataframe.loc[candle_dataframe[isa_name].notnull(), "spanA"] = candle_dataframe[isa_name]
-    # For spanB set it to be the value of the isb_name as long as the values are not NaN
-    candle_dataframe.loc[candle_dataframe[isb_name].notnull(), "spanB"] = candle_dataframe[isb_name]
-    # For spanA set it to the value of the isa_name_future as long as the values are not NaN
-    candle_dataframe.loc[candle_dataframe[f"{isa_name}_future"].notnull(), "spanA"] = candle_dataframe[f"{isa_name}_future"]
-    # For spanB set it to the value of the isb_name_future as long as the values are not NaN
-    candle_dataframe.loc[candle_dataframe[f"{isb_name}_future"].notnull(), "spanB"] = candle_dataframe[f"{isb_name}_future"]
-    # Shift all spanA values backward by kijun
-    candle_dataframe["spanA_update"] = candle_dataframe["spanA"].shift(kijun*-1)
-    # Shift all spanB values backward by kijun
-    candle_dataframe["spanB_update"] = candle_dataframe["spanB"].shift(kijun*-1)
-    # Rename spanA and spanB to spanA_unshifted and spanB_unshifted
-    candle_dataframe.rename(columns={"spanA": "spanA_unshifted", "spanB": "spanB_unshifted"}, inplace=True)
-    # Drop isa_name, isb_name, isa_name_future, isb_name_future columns
-    candle_dataframe.drop(columns=[isa_name, isb_name, f"{isa_name}_future", f"{isb_name}_future"], inplace=True)
-    # Rename spanA_update to spanA
-    candle_dataframe.rename(columns={"spanA_update": "spanA_shifted"}, inplace=True)
-    # Rename spanB_update to spanB
-    candle_dataframe.rename(columns={"spanB_update": "spanB_shifted"}, inplace=True)
-    # Drop any rows with NaN values
-    candle_dataframe.dropna(inplace=True)
+    Function to calculate the midpoint of the rolling highest high and lowest low with the selected backend
+    :param high: Series of high prices
+    :param low: Series of low prices
+    :param length: Length of the window
+    :return: Array of midprices
+    """
+    if _backend == 'native':
+        return kernels.midprice(high, low, length)
+    midprice = load_pandas_ta().midprice(high=high, low=low, length=length)
+    # Pandas TA returns None when there are fewer candles than the length
+    if midprice is None:
+        return numpy.full(len(high), numpy.nan)
+    return midprice.to_numpy(dtype=float)
+
+
+# Function to calculate several indicators over the same candlestick data
+def calc_indicators(candle_dataframe, indicator_specs):
+    """
+    Function to calculate several indicators in one pass over the same candlestick data.
+    Each spec is a dictionary with an 'indicator' key of 'ema', 'rsi' or 'ichimoku' and any
+    keyword arguments of the matching calc_ function, for example {'indicator': 'ema', 'period': 50}.
+    Every indicator is calculated on the full history, so the values match the single indicator functions.
+    :param candle_dataframe: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
+    :param indicator_specs: List of indicator specs. Any number of EMA periods, at most one RSI and one Ichimoku
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    # Count the RSI and Ichimoku specs, as they always write to the same columns
+    indicator_names = [spec.get('indicator') for spec in indicator_specs]
+    for name in ['rsi', 'ichimoku']:
+        if indicator_names.count(name) > 1:
+            raise ValueError(f"only one {name} indicator can be requested at a time")
+    # Track the number of warm up rows the EMA accuracy filter needs to remove
+    warmup_rows = 0
+    ichimoku_spec = None
+    for spec in indicator_specs:
+        # Copy the spec so the caller's copy is left untouched
+        kwargs = dict(spec)
+        name = kwargs.pop('indicator', None)
+        if name == 'ema':
+            # Apply the accuracy filter once all indicators are calculated
+            accuracy_filter = kwargs.pop('accuracy_filter', True)
+            candle_dataframe = calc_ema(candle_dataframe, accuracy_filter=False, **kwargs)
+            if accuracy_filter:
+                warmup_rows = max(warmup_rows, kwargs.get('period', 20) * 5)
+        elif name == 'rsi':
+            candle_dataframe = calc_rsi(candle_dataframe, **kwargs)
+        elif name == 'ichimoku':
+            # Ichimoku drops rows, so calculate it after the other indicators
+            ichimoku_spec = kwargs
+        else:
+            raise ValueError(f"invalid indicator {name}")
+    # Remember which rows fall inside the EMA warm up period before Ichimoku removes any rows
+    warmup_index = candle_dataframe.index[:warmup_rows]
+    if ichimoku_spec is not None:
+        candle_dataframe = calc_ichimoku(candle_dataframe, **ichimoku_spec)
+    # Filter out the warm up rows
+    candle_dataframe = candle_dataframe.drop(index=warmup_index, errors='ignore')
     return candle_dataframe
+
+
+# Function to calculate one indicator for many periods
+def calc_sweep(candle_dataframe, indicator, periods, value='candle_close', accuracy_filter=False):
+    """
+    Function to calculate EMA or RSI for many periods in one pass, for example every EMA period from 5 to 200.
+    The prices are converted to one contiguous array once and every period is calculated from it
+    with the NumPy kernels. With numba the values are the same as calc_ema and calc_rsi with either backend.
+    Without it the kernels fall back to pandas ewm, and the values can differ from calc_ema and calc_rsi by
+    floating point rounding, a relative difference of around 1e-15 and under 1e-12.
+    :param candle_dataframe: Dataframe containing candlestick data, or a reference to stored candles, see candle_store.resolve
+    :param indicator: 'ema' or 'rsi'
+    :param periods: List of periods, or a range
+    :param value: Which value to use, default is candle_close
+    :param accuracy_filter: Set each EMA column to NaN for its first period*5 rows, default is False.
+    Rows aren't removed, as each period would remove a different number of rows
+    :return: Dataframe with the same index as candle_dataframe and one column per period, named ema_{period} or rsi_{period}
+    """
+    if indicator not in SWEEP_INDICATORS:
+        raise ValueError(f"invalid sweep indicator {indicator}, must be one of {list(SWEEP_INDICATORS)}")
+    periods = [int(period) for period in periods]
+    if len(periods) == 0:
+        raise ValueError("at least one period is required")
+    if min(periods) < 1:
+        raise ValueError(f"periods must be at least 1, got {min(periods)}")
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    # One row per period, so the transpose gives a column per period without copying
+    block = SWEEP_INDICATORS[indicator](candle_dataframe[value], periods)
+    if accuracy_filter and indicator == 'ema':
+        for row, period in enumerate(periods):
+            block[row, :period * 5] = numpy.nan
+    return pd.DataFrame(block.T, index=candle_dataframe.index, columns=[f'{indicator}_{period}' for period in periods])
+
+
+# Function to calculate indicators for many symbols
+def calc_indicators_multi(symbol_candles, indicator_specs, symbol_column='symbol', max_workers=None):
+    """
+    Function to calculate the same indicators for many symbols. Symbols are split into batches
+    and spread over a bounded process pool, so one request can use every core.
+    An error on one symbol is returned for that symbol and doesn't stop the others.
+    :param symbol_candles: Dictionary of symbol to candlestick dataframe, or a long format dataframe with a symbol column.
+    Each symbol's candles must already be sorted by candle_timestamp
+    :param indicator_specs: List of indicator specs, the same format as calc_indicators
+    :param symbol_column: Name of the symbol column when symbol_candles is a dataframe, default is symbol
+    :param max_workers: Number of worker processes to use at once, default and maximum is MULTI_SYMBOL_WORKERS. 1 runs in this process
+    :return: Tuple of (dictionary of symbol to dataframe, dictionary of symbol to error message)
+    """
+    # Split a long format dataframe into one dataframe per symbol
+    if isinstance(symbol_candles, pd.DataFrame):
+        symbol_candles = {symbol: group for symbol, group in symbol_candles.groupby(symbol_column, sort=False)}
+    if max_workers is None:
+        max_workers = MULTI_SYMBOL_WORKERS
+    max_workers = max(1, min(max_workers, MULTI_SYMBOL_WORKERS, len(symbol_candles)))
+    items = list(symbol_candles.items())
+    # Run small jobs in this process, the process pool only pays off with several symbols
+    if max_workers == 1:
+        return _calc_symbol_batch(items, indicator_specs, _backend)
+    # Use a few batches per worker so one slow symbol doesn't hold up the rest
+    batch_size = math.ceil(len(items) / (max_workers * 4))
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    executor = _get_process_pool()
+    results = {}
+    errors = {}
+    running = set()
+    for batch in batches:
+        # Keep at most max_workers batches running at once
+        if len(running) >= max_workers:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                _merge_batch(future, results, errors)
+        running.add(executor.submit(_calc_symbol_batch, batch, indicator_specs, _backend))
+    for future in running:
+        _merge_batch(future, results, errors)
+    return results, errors
+
+
+# Function to merge a finished batch into the results
+def _merge_batch(future, results, errors):
+    batch_results, batch_errors = future.result()
+    results.update(batch_results)
+    errors.update(batch_errors)
+
+
+# Function to get the shared process pool
+def _get_process_pool():
+    """
+    Function to get the shared process pool of MULTI_SYMBOL_WORKERS processes, so worker processes
+    are reused between requests
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=MULTI_SYMBOL_WORKERS)
+    return _process_pool
+
+
+# Function to calculate indicators for a batch of symbols in a worker process
+def _calc_symbol_batch(items, indicator_specs, backend):
+    """
+    Function to calculate indicators for a batch of symbols
+    :param items: List of (symbol, candlestick dataframe) pairs
+    :param indicator_specs: List of indicator specs, the same format as calc_indicators
+    :param backend: Backend to use, so worker processes match the calling process
+    :return: Tuple of (dictionary of symbol to dataframe, dictionary of symbol to error message)
+    """
+    set_backend(backend)
+    results = {}
+    errors = {}
+    for symbol, candle_dataframe in items:
+        try:
+            results[symbol] = calc_indicators(candle_dataframe.copy(), indicator_specs)
+        except Exception as error:
+            errors[symbol] = f"{type(error).__name__}: {error}"
+    return results, errors
@@ -0,0 +1,161 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+
+# Share of requests to time, from 0 to 1. Set with the REQUEST_TIMING_SAMPLE_RATE app setting, default is 0 (off)
+SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', 0))
+# Add a Server-Timing header to timed responses. Set with the REQUEST_TIMING_SERVER_TIMING app setting
+SERVER_TIMING = os.environ.get('REQUEST_TIMING_SERVER_TIMING', 'false').lower() in ['true', '1', 'yes']
+# Record the peak memory allocated while timed requests run. Set with the REQUEST_TIMING_MEMORY app setting
+TRACE_MEMORY = os.environ.get('REQUEST_TIMING_MEMORY', 'false').lower() in ['true', '1', 'yes']
+
+# Timing of the request being handled, None when the request isn't sampled
+_current = contextvars.ContextVar('request_timing', default=None)
+# Number of timed requests tracing memory, so tracing stops when the last one finishes
+_tracing_requests = 0
+_tracing_lock = threading.Lock()
+
+
+# Phase and field recorder for one request
+class RequestTiming:
+    """
+    Phase durations and other fields recorded while handling one request
+    :param route: Name of the route
+    :param trace_memory: Record the peak memory allocated during the request
+    """
+    def __init__(self, route, trace_memory=False):
+        self.route = route
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.fields = {}
+        self._start = time.perf_counter()
+        if trace_memory:
+            _start_tracing()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager adding the time spent inside it to the named phase
+        :param name: Name of the phase, such as parse, prepare, compute or serialize
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, req, response):
+        """
+        Function to stop timing and collect every field
+        :param req: The HTTP request
+        :param response: The HTTP response
+        :return: Dictionary of flat fields, with the phase durations as <phase>_ms
+        """
+        total = time.perf_counter() - self._start
+        fields = {
+            'route': self.route,
+            'status_code': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            **{f'{name}_ms': round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'request_bytes': len(req.get_body() or b''),
+            'response_bytes': len(response.get_body() or b''),
+            **self.fields
+        }
+        if self.trace_memory:
+            fields['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            _stop_tracing()
+        return fields
+
+    def server_timing(self, total_ms):
+        """
+        Function to format the phases as a Server-Timing header value
+        :param total_ms: Total duration of the request in milliseconds
+        """
+        entries = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.phases.items()]
+        entries.append(f'total;dur={total_ms:.3f}')
+        return ', '.join(entries)
+
+
+# Function to start tracing memory for a request
+def _start_tracing():
+    global _tracing_requests
+    with _tracing_lock:
+        if _tracing_requests == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_requests += 1
+        # The peak is shared by the process, so overlapping requests include each other's allocations
+        tracemalloc.reset_peak()
+
+
+# Function to stop tracing memory once no timed request needs it
+def _stop_tracing():
+    global _tracing_requests
+    with _tracing_lock:
+        _tracing_requests -= 1
+        if _tracing_requests == 0:
+            tracemalloc.stop()
+
+
+# Function to time a phase of the current request
+def phase(name):
+    """
+    Function to time a phase of the current request, for use in a with statement.
+    Does nothing when the request isn't sampled.
+    :param name: Name of the phase
+    """
+    timing = _current.get()
+    if timing is None:
+        return contextlib.nullcontext()
+    return timing.phase(name)
+
+
+# Function to record extra fields for the current request
+def record(**fields):
+    """
+    Function to record extra fields for the current request, such as row counts.
+    Does nothing when the request isn't sampled.
+    """
+    timing = _current.get()
+    if timing is not None:
+        timing.fields.update(fields)
+
+
+# Decorator to time a route handler
+def timed(route):
+    """
+    Decorator which times a sampled share of the requests to a handler. The phases and fields are
+    logged as structured fields (custom_dimensions for Application Insights), and added as a
+    Server-Timing header when REQUEST_TIMING_SERVER_TIMING is set. Requests which aren't sampled
+    only pay for one comparison.
+    :param route: Name of the route
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(req):
+            if SAMPLE_RATE <= 0 or (SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE):
+                return handler(req)
+            timing = RequestTiming(route, trace_memory=TRACE_MEMORY)
+            token = _current.set(timing)
+            try:
+                response = handler(req)
+            except BaseException:
+                if timing.trace_memory:
+                    _stop_tracing()
+                raise
+            finally:
+                _current.reset(token)
+            fields = timing.finish(req, response)
+            logging.info(f'Request timing {json.dumps(fields)}', extra={'custom_dimensions': fields})
+            if SERVER_TIMING:
+                response.headers['Server-Timing'] = timing.server_timing(fields['total_ms'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,382 @@
+import functools
+import math
+import threading
+import numpy
+
+# numba is in requirements.txt and JIT compiles the loop kernels. If it can't be imported they run as plain Python,
+# apart from the exponentially weighted means, which fall back to pandas ewm.
+# Importing numba takes a large share of a cold start, so it's imported by load_numba on the first kernel call.
+# None until then, and if it isn't installed
+numba = None
+# Set once load_numba has run
+_numba_loaded = False
+_numba_lock = threading.Lock()
+# Kernels to JIT compile, as name to Python function
+_KERNELS = {}
+
+
+# Function to mark a kernel to JIT compile when numba is available
+def _jit(function):
+    """
+    Decorator which registers a kernel with load_numba. Until numba is loaded the kernel is a placeholder
+    which loads it on the first call, after which the module attribute is the numba dispatcher itself
+    """
+    _KERNELS[function.__name__] = function
+
+    @functools.wraps(function)
+    def placeholder(*args):
+        load_numba()
+        return globals()[function.__name__](*args)
+    return placeholder
+
+
+# Function to import numba and JIT compile the kernels
+def load_numba():
+    """
+    Function to import numba, the first time it's called, and replace every kernel with its numba
+    dispatcher, or with the plain Python function if numba isn't installed. Each kernel is still
+    compiled for its argument types on its first call, see prime_kernels.
+    :return: True if numba is installed and the kernels are JIT compiled
+    """
+    global numba, _numba_loaded
+    if _numba_loaded:
+        return numba is not None
+    with _numba_lock:
+        if not _numba_loaded:
+            try:
+                import numba as numba_module
+            except ImportError:
+                numba_module = None
+            # Kernels calling other kernels find the dispatchers when they're compiled, as every name is replaced first
+            for name, function in _KERNELS.items():
+                globals()[name] = function if numba_module is None else numba_module.njit(cache=True, nogil=True)(function)
+            numba = numba_module
+            _numba_loaded = True
+    return numba is not None
+
+
+# Exponentially weighted mean following the same steps as pandas ewm().mean(), continuing from a saved state
+@_jit
+def _ewm_mean_resume(values, alpha, adjust, min_periods, weighted, old_wt, nobs):
+    output = numpy.empty(len(values))
+    old_wt_factor = 1.0 - alpha
+    new_wt = 1.0 if adjust else alpha
+    minimum = max(min_periods, 1)
+    for i in range(len(values)):
+        cur = values[i]
+        is_observation = cur == cur
+        nobs += is_observation
+        if weighted == weighted:
+            old_wt *= old_wt_factor
+            if is_observation:
+                # Skip the update on constant values, the same as pandas
+                if weighted != cur:
+                    weighted = old_wt * weighted + new_wt * cur
+                    weighted /= (old_wt + new_wt)
+                if adjust:
+                    old_wt += new_wt
+                else:
+                    old_wt = 1.0
+        elif is_observation:
+            weighted = cur
+        output[i] = weighted if nobs >= minimum else math.nan
+    return output, weighted, old_wt, nobs
+
+
+# Exponentially weighted mean following the same steps as pandas ewm().mean()
+@_jit
+def _ewm_mean(values, alpha, adjust, min_periods):
+    return _ewm_mean_resume(values, alpha, adjust, min_periods, math.nan, 1.0, 0)[0]
+
+
+# Rolling max or min using a monotonic deque stored in an array
+@_jit
+def _rolling_extreme(values, length, find_max):
+    count = len(values)
+    output = numpy.empty(count)
+    # Positions held in the deque, between head and tail
+    positions = numpy.empty(count, dtype=numpy.int64)
+    head = 0
+    tail = 0
+    # Number of NaN values in the current window
+    nan_count = 0
+    for i in range(count):
+        oldest = i - length
+        # Remove the value which has left the window
+        while head < tail and positions[head] <= oldest:
+            head += 1
+        if oldest >= 0 and values[oldest] != values[oldest]:
+            nan_count -= 1
+        cur = values[i]
+        if cur != cur:
+            nan_count += 1
+        else:
+            # Remove values which can no longer be the max or min
+            if find_max:
+                while head < tail and values[positions[tail - 1]] <= cur:
+                    tail -= 1
+            else:
+                while head < tail and values[positions[tail - 1]] >= cur:
+                    tail -= 1
+            positions[tail] = i
+            tail += 1
+        valid = min(i + 1, length) - nan_count
+        output[i] = values[positions[head]] if valid >= length and head < tail else math.nan
+    return output
+
+
+# Function to convert values into a contiguous float64 array
+def as_float_array(values):
+    """
+    Function to convert a series or array into a contiguous float64 array without copying when possible
+    :param values: Series, list or array
+    """
+    return numpy.ascontiguousarray(numpy.asarray(values, dtype=numpy.float64))
+
+
+# Function to continue an exponentially weighted mean
+def ewm_mean(values, alpha, adjust, min_periods=0, weighted=math.nan, old_wt=1.0, nobs=0):
+    """
+    Function to continue an exponentially weighted mean from a saved state, so a long series can be
+    calculated in chunks. Follows the same steps as pandas ewm().mean().
+    :param values: Array of new values
+    :param alpha: Smoothing factor
+    :param adjust: Same as the pandas ewm adjust argument
+    :param min_periods: Number of observations needed before a value is returned
+    :param weighted: Current mean, NaN before the first observation
+    :param old_wt: Current weight of the mean
+    :param nobs: Number of observations so far
+    :return: Tuple of (array of means, weighted, old_wt, nobs), the last three to continue from
+    """
+    output, weighted, old_wt, nobs = _ewm_mean_resume(
+        as_float_array(values), float(alpha), bool(adjust), int(min_periods), float(weighted), float(old_wt), int(nobs)
+    )
+    return output, float(weighted), float(old_wt), int(nobs)
+
+
+# Function to calculate an exponentially weighted mean with the fastest kernel available
+def _ewm(values, alpha, adjust, min_periods):
+    """
+    Function to calculate an exponentially weighted mean with the JIT kernel when numba is installed,
+    otherwise with pandas ewm, which is vectorized rather than a Python loop and can differ from
+    _ewm_mean in the last few bits.
+    :return: Array of means
+    """
+    if load_numba():
+        return _ewm_mean(values, alpha, adjust, min_periods)
+    # Imported here as the kernels only need numpy when numba is installed
+    import pandas
+    return pandas.Series(values).ewm(alpha=alpha, adjust=adjust, min_periods=min_periods).mean().to_numpy()
+
+
+# Function to calculate the EMA
+def ema(values, period):
+    """
+    Function to calculate the EMA, seeded with the simple average of the first period values
+    the same as Pandas TA. Without numba the values can differ from Pandas TA by floating point rounding.
+    :param values: Array of prices
+    :param period: Length of EMA
+    :return: Array of EMA values, NaN for the first period - 1 values
+    """
+    values = as_float_array(values)
+    if len(values) < period:
+        return numpy.full(len(values), numpy.nan)
+    seeded = values.copy()
+    seeded[:period - 1] = numpy.nan
+    # Seed the same way as pandas Series.mean, ignoring NaN values
+    seed_values = values[:period]
+    seeded[period - 1] = numpy.nansum(seed_values) / numpy.count_nonzero(~numpy.isnan(seed_values))
+    return _ewm(seeded, 2.0 / (period + 1), False, 0)
+
+
+# Function to calculate the RSI
+def rsi(values, period):
+    """
+    Function to calculate the RSI with Wilder smoothing the same as Pandas TA.
+    Without numba the values can differ from Pandas TA by floating point rounding.
+    :param values: Array of prices
+    :param period: Length of RSI
+    :return: Array of RSI values, NaN for the first period values
+    """
+    values = as_float_array(values)
+    change = numpy.empty(len(values))
+    change[:1] = numpy.nan
+    numpy.subtract(values[1:], values[:-1], out=change[1:])
+    # Split the changes into gains and losses, leaving NaN changes as NaN
+    gains = numpy.where(change < 0, 0.0, change)
+    losses = numpy.where(change > 0, 0.0, change)
+    alpha = 1.0 / period
+    average_gain = _ewm(gains, alpha, True, period)
+    average_loss = _ewm(losses, alpha, True, period)
+    return 100 * average_gain / (average_gain + numpy.abs(average_loss))
+
+
+# Exponentially weighted means of one array for many smoothing factors
+@_jit
+def _ewm_mean_many(values, alphas, adjust, min_periods, starts, seeds):
+    # Each row of the output is one smoothing factor. Values before starts[k] are treated as NaN
+    # and the value at starts[k] is replaced with seeds[k]
+    output = numpy.empty((len(alphas), len(values)))
+    for k in range(len(alphas)):
+        old_wt_factor = 1.0 - alphas[k]
+        new_wt = 1.0 if adjust else alphas[k]
+        weighted = math.nan
+        old_wt = 1.0
+        nobs = 0
+        minimum = max(min_periods[k], 1)
+        for i in range(len(values)):
+            if i < starts[k]:
+                output[k, i] = math.nan
+                continue
+            cur = seeds[k] if i == starts[k] else values[i]
+            is_observation = cur == cur
+            nobs += is_observation
+            if weighted == weighted:
+                old_wt *= old_wt_factor
+                if is_observation:
+                    if weighted != cur:
+                        weighted = old_wt * weighted + new_wt * cur
+                        weighted /= (old_wt + new_wt)
+                    if adjust:
+                        old_wt += new_wt
+                    else:
+                        old_wt = 1.0
+            elif is_observation:
+                weighted = cur
+            output[k, i] = weighted if nobs >= minimum else math.nan
+    return output
+
+
+# Function to calculate exponentially weighted means for many smoothing factors
+def _ewm_many(values, alphas, adjust, min_periods, starts, seeds):
+    """
+    Function to calculate exponentially weighted means of one array for many smoothing factors.
+    Uses the JIT kernel when numba is installed, otherwise pandas ewm for each factor, which can
+    differ from _ewm_mean in the last few bits.
+    :return: Array with one row per smoothing factor
+    """
+    if load_numba():
+        return _ewm_mean_many(values, alphas, adjust, min_periods, starts, seeds)
+    # Imported here as the kernels only need numpy when numba is installed
+    import pandas
+    output = numpy.empty((len(alphas), len(values)))
+    for k in range(len(alphas)):
+        column = values.copy()
+        column[:starts[k]] = numpy.nan
+        if starts[k] < len(values):
+            column[starts[k]] = seeds[k]
+        output[k] = pandas.Series(column).ewm(alpha=alphas[k], adjust=adjust, min_periods=int(min_periods[k])).mean().to_numpy()
+    return output
+
+
+# Function to calculate the EMA for many periods
+def ema_many(values, periods):
+    """
+    Function to calculate the EMA of one array for many periods at once. Gives the same values as ema for each period.
+    Without numba the values can differ from ema by floating point rounding.
+    :param values: Array of prices
+    :param periods: List of EMA lengths
+    :return: Array with one row per period
+    """
+    values = as_float_array(values)
+    periods = numpy.asarray(periods, dtype=numpy.int64)
+    # Seed each period with the simple average of its first period values, the same way as ema
+    not_nan = numpy.concatenate([[0], numpy.cumsum(~numpy.isnan(values))])
+    seeds = numpy.array([
+        numpy.nansum(values[:period]) / not_nan[period] if period <= len(values) else numpy.nan
+        for period in periods
+    ])
+    output = _ewm_many(values, 2.0 / (periods + 1), False, numpy.zeros(len(periods), dtype=numpy.int64), periods - 1, seeds)
+    # Periods longer than the data have no values
+    output[periods > len(values)] = numpy.nan
+    return output
+
+
+# Function to calculate the RSI for many periods
+def rsi_many(values, periods):
+    """
+    Function to calculate the RSI of one array for many periods at once. The gains and losses are
+    calculated once and shared by every period. Gives the same values as rsi for each period.
+    Without numba the values can differ from rsi by floating point rounding.
+    :param values: Array of prices
+    :param periods: List of RSI lengths
+    :return: Array with one row per period
+    """
+    values = as_float_array(values)
+    periods = numpy.asarray(periods, dtype=numpy.int64)
+    change = numpy.empty(len(values))
+    change[:1] = numpy.nan
+    numpy.subtract(values[1:], values[:-1], out=change[1:])
+    gains = numpy.where(change < 0, 0.0, change)
+    losses = numpy.where(change > 0, 0.0, change)
+    alphas = 1.0 / periods
+    starts = numpy.zeros(len(periods), dtype=numpy.int64)
+    average_gain = _ewm_many(gains, alphas, True, periods, starts, numpy.full(len(periods), gains[0] if len(gains) else numpy.nan))
+    average_loss = _ewm_many(losses, alphas, True, periods, starts, numpy.full(len(periods), losses[0] if len(losses) else numpy.nan))
+    return 100 * average_gain / (average_gain + numpy.abs(average_loss))
+
+
+# Rolling max or min using strided windows, used when numba isn't installed
+def _rolling_extreme_strided(values, length, find_max):
+    output = numpy.full(len(values), numpy.nan)
+    if len(values) < length:
+        return output
+    windows = numpy.lib.stride_tricks.sliding_window_view(values, length)
+    # NaN values propagate, so windows with a NaN are NaN the same as min_periods=length
+    output[length - 1:] = windows.max(axis=1) if find_max else windows.min(axis=1)
+    return output
+
+
+# Function to calculate the rolling max
+def rolling_max(values, length):
+    """
+    Function to calculate the rolling max, NaN until the window holds length values
+    :param values: Array of values
+    :param length: Length of the window
+    """
+    if not load_numba():
+        return _rolling_extreme_strided(as_float_array(values), length, True)
+    return _rolling_extreme(as_float_array(values), length, True)
+
+
+# Function to calculate the rolling min
+def rolling_min(values, length):
+    """
+    Function to calculate the rolling min, NaN until the window holds length values
+    :param values: Array of values
+    :param length: Length of the window
+    """
+    if not load_numba():
+        return _rolling_extreme_strided(as_float_array(values), length, False)
+    return _rolling_extreme(as_float_array(values), length, False)
+
+
+# Function to calculate the midprice used by the Ichimoku Cloud
+def midprice(high, low, length):
+    """
+    Function to calculate the midpoint of the rolling highest high and lowest low
+    :param high: Array of high prices
+    :param low: Array of low prices
+    :param length: Length of the window
+    """
+    return 0.5 * (rolling_min(low, length) + rolling_max(high, length))
+
+
+# Function to compile the kernels ahead of the first request
+def prime_kernels():
+    """
+    Function to load numba and run every public kernel once on a few values, so each is compiled for
+    the argument types the indicators use. With numba's cache the compiled code is also written to disk
+    for later processes.
+    :return: True if numba is installed and the kernels are JIT compiled
+    """
+    if not load_numba():
+        return False
+    values = numpy.linspace(1.0, 2.0, 8)
+    ema(values, 3)
+    rsi(values, 3)
+    ewm_mean(values, 0.5, False)
+    midprice(values, values, 3)
+    ema_many(values, [2, 3])
+    rsi_many(values, [2, 3])
+    return True
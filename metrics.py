@@ -0,0 +1,223 @@
+import numpy
+import analysis
+import kernels
+
+
+# Largest number of values held at once when calculating rolling drawdowns
+DRAWDOWN_CHUNK_VALUES = 1000000
+
+
+# Function to summarize trades by exit date
+def calc_daily_summary(trade_dataframe, start_date, annual_risk_free_rate=0.033, compact=False):
+    """
+    Function to summarize trades by exit date, the same days calc_sharpe uses for its daily breakdown
+    :param trade_dataframe: Dataframe containing trade data
+    :param start_date: Date the risk free rate starts accumulating from
+    :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param compact: Skip the risk free columns which are the same for every trade, see analysis.calc_returns
+    :return: Tuple of (dataframe of trades, wins, raw_return and excess_return per exit date, daily risk free rate)
+    """
+    trade_dataframe, daily_rfr = analysis.calc_returns(trade_dataframe, start_date, annual_risk_free_rate, compact=compact)
+    daily = trade_dataframe.groupby(trade_dataframe['exit_time'].dt.date).agg(
+        trades=('exit_time', 'count'),
+        wins=('win', 'sum'),
+        raw_return=('raw_return', 'sum'),
+        excess_return=('excess_return', 'sum')
+    )
+    return daily, daily_rfr
+
+
+# Function to calculate rolling and expanding window metrics over trade data
+def calc_rolling_metrics(trade_dataframe, start_date, windows=(20,), annual_risk_free_rate=0.033, step=1, expanding=False, compact=False):
+    """
+    Function to calculate Sharpe Ratio, win rate, ROI, raw return and max drawdown for every rolling
+    window of trading days in one pass. Each statistic comes from prefix sums over the daily summary,
+    so the cost doesn't grow with the window length. A window covering every day gives the same
+    Sharpe Ratio and ROI as calc_sharpe.
+    :param trade_dataframe: Dataframe containing trade data, sorted by exit_time
+    :param start_date: Date the risk free rate starts accumulating from
+    :param windows: Lengths of the rolling windows, in days with trades. Default is 20
+    :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param step: Number of days between the ends of consecutive windows, default is 1
+    :param expanding: Also calculate expanding windows from the first day, default is False
+    :param compact: Skip the risk free columns which are the same for every trade, see analysis.calc_returns
+    :return: Dictionary of dates, daily_rfr, and for each window length (and 'expanding') a dictionary
+    of arrays of end_date, days, trades, sharpe_ratio, win_rate, roi, raw_return and max_drawdown
+    """
+    daily, daily_rfr = calc_daily_summary(trade_dataframe, start_date, annual_risk_free_rate, compact=compact)
+    days = len(daily)
+    trades = daily['trades'].to_numpy(dtype=float)
+    raw_return = daily['raw_return'].to_numpy(dtype=float)
+    excess_return = daily['excess_return'].to_numpy(dtype=float)
+    # Center the excess returns before summing squares, so the variance doesn't lose precision
+    center = excess_return.mean() if days > 0 else 0.0
+    prefix = {
+        'trades': _prefix_sum(trades),
+        'wins': _prefix_sum(daily['wins'].to_numpy(dtype=float)),
+        'raw_return': _prefix_sum(raw_return),
+        'excess': _prefix_sum(excess_return - center),
+        'excess_squared': _prefix_sum((excess_return - center) ** 2)
+    }
+    dates = numpy.array([date.isoformat() for date in daily.index], dtype=object)
+    results = {'dates': dates, 'daily_rfr': daily_rfr}
+    for window in windows:
+        window = int(window)
+        if window < 1:
+            raise ValueError(f"window must be at least 1, got {window}")
+        # Windows end on the last day and every step days before it
+        ends = numpy.arange(days, window - 1, -step)[::-1]
+        starts = ends - window
+        # Most trades in one day of each window, for ROI
+        max_trades = kernels.rolling_max(trades, window)[ends - 1] if len(ends) > 0 else numpy.empty(0)
+        metrics = _window_metrics(prefix, starts, ends, center, daily_rfr, max_trades)
+        metrics['max_drawdown'] = _rolling_drawdown(prefix['raw_return'], window, ends)
+        metrics['end_date'] = dates[ends - 1]
+        results[window] = metrics
+    if expanding:
+        ends = numpy.arange(days, 0, -step)[::-1]
+        starts = numpy.zeros(len(ends), dtype=int)
+        max_trades = numpy.maximum.accumulate(trades)[ends - 1] if len(ends) > 0 else numpy.empty(0)
+        metrics = _window_metrics(prefix, starts, ends, center, daily_rfr, max_trades)
+        # Largest fall from the running peak of the cumulative raw return, including the starting value of 0
+        equity = prefix['raw_return']
+        drawdown = numpy.maximum.accumulate(numpy.maximum.accumulate(equity) - equity)
+        metrics['max_drawdown'] = drawdown[ends]
+        metrics['end_date'] = dates[ends - 1]
+        results['expanding'] = metrics
+    return results
+
+
+# Function to calculate the metrics of many strategies and their combined portfolio
+def calc_portfolio(trade_dataframe, start_date, strategy_column='strategy', annual_risk_free_rate=0.033, compact=False):
+    """
+    Function to calculate Sharpe Ratio, ROI, win rate and raw return for every strategy in a long format
+    trade dataframe, and for the portfolio of every trade combined, in one pass. Returns are calculated
+    once for every trade, then summarized by strategy and exit date with one groupby, and each strategy's
+    metrics come from a second groupby over its days. Each strategy gets the same values as calc_sharpe
+    on its own trades, and the portfolio the same as calc_sharpe on every trade, apart from floating point rounding.
+    :param trade_dataframe: Dataframe containing trade data with a strategy column
+    :param start_date: Date the risk free rate starts accumulating from
+    :param strategy_column: Column naming the strategy of each trade, default is strategy
+    :param annual_risk_free_rate: Annual risk free rate, default is 3.3%
+    :param compact: Skip the risk free columns which are the same for every trade, see analysis.calc_returns
+    :return: Dictionary of strategies (dataframe of metrics indexed by strategy), portfolio (dictionary of metrics),
+    daily (dataframe of trades, wins, raw_return, excess_return and rfr_amount per strategy and exit date),
+    portfolio_daily (the same per exit date for every trade) and daily_rfr
+    """
+    trade_dataframe, daily_rfr = analysis.calc_returns(trade_dataframe, start_date, annual_risk_free_rate, compact=compact)
+    # Summarize by strategy and exit date in one groupby, using midnight timestamps rather than date objects
+    exit_date = trade_dataframe['exit_time'].dt.normalize().to_numpy()
+    daily = trade_dataframe.groupby([trade_dataframe[strategy_column].to_numpy(), exit_date], sort=True).agg(
+        trades=('exit_time', 'count'),
+        wins=('win', 'sum'),
+        raw_return=('raw_return', 'sum'),
+        excess_return=('excess_return', 'sum'),
+        rfr_amount=('rfr_amount', 'first')
+    )
+    daily.index.names = [strategy_column, 'date']
+    # Combine the strategies into the portfolio's days
+    portfolio_daily = daily.groupby(level='date', sort=True).agg(
+        trades=('trades', 'sum'),
+        wins=('wins', 'sum'),
+        raw_return=('raw_return', 'sum'),
+        excess_return=('excess_return', 'sum'),
+        rfr_amount=('rfr_amount', 'first')
+    )
+    strategies = _summary_metrics(daily.groupby(level=strategy_column, sort=True), daily_rfr)
+    portfolio = _summary_metrics(portfolio_daily.groupby(numpy.zeros(len(portfolio_daily), dtype=int)), daily_rfr)
+    return {
+        'strategies': strategies,
+        'portfolio': portfolio.iloc[0].to_dict() if len(portfolio) > 0 else dict.fromkeys(portfolio.columns, numpy.nan),
+        'daily': daily,
+        'portfolio_daily': portfolio_daily,
+        'daily_rfr': daily_rfr
+    }
+
+
+# Function to calculate summary metrics for groups of days
+def _summary_metrics(grouped_days, daily_rfr):
+    """
+    Function to calculate the calc_sharpe metrics for each group of days in one vectorized pass
+    :param grouped_days: GroupBy of a daily summary with trades, wins, raw_return and excess_return columns
+    :param daily_rfr: Daily risk free rate
+    :return: Dataframe of days, trades, wins, raw_return, roi, sharpe_ratio and win_rate, one row per group
+    """
+    summary = grouped_days.agg(
+        days=('trades', 'count'),
+        trades=('trades', 'sum'),
+        max_trades=('trades', 'max'),
+        wins=('wins', 'sum'),
+        raw_return=('raw_return', 'sum'),
+        mean=('excess_return', 'mean'),
+        std=('excess_return', 'std')
+    )
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        summary['roi'] = summary['raw_return'] / (summary['max_trades'] * 1000000)
+        summary['sharpe_ratio'] = (summary['mean'] - daily_rfr) / summary['std']
+        summary['win_rate'] = summary['wins'] / summary['trades']
+    return summary.drop(columns=['max_trades', 'mean', 'std'])
+
+
+# Function to calculate a prefix sum with a leading 0
+def _prefix_sum(values):
+    prefix = numpy.zeros(len(values) + 1)
+    numpy.cumsum(values, out=prefix[1:])
+    return prefix
+
+
+# Function to calculate the metrics of many windows from prefix sums
+def _window_metrics(prefix, starts, ends, center, daily_rfr, max_trades):
+    """
+    Function to calculate the metrics of every window [start, end) of days from the prefix sums
+    :param prefix: Dictionary of prefix sums
+    :param starts: Array of the first day of each window
+    :param ends: Array of one past the last day of each window
+    :param center: Value subtracted from the excess returns before summing
+    :param daily_rfr: Daily risk free rate
+    :param max_trades: Array of the most trades in one day in each window
+    """
+    days = (ends - starts).astype(float)
+    trades = prefix['trades'][ends] - prefix['trades'][starts]
+    wins = prefix['wins'][ends] - prefix['wins'][starts]
+    raw_return = prefix['raw_return'][ends] - prefix['raw_return'][starts]
+    excess_sum = prefix['excess'][ends] - prefix['excess'][starts]
+    excess_squared_sum = prefix['excess_squared'][ends] - prefix['excess_squared'][starts]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = excess_sum / days + center
+        # Sample variance, the same as pandas std
+        variance = (excess_squared_sum - excess_sum ** 2 / days) / (days - 1)
+        std = numpy.sqrt(numpy.maximum(variance, 0.0))
+        sharpe = numpy.where(days > 1, (mean - daily_rfr) / std, numpy.nan)
+        win_rate = wins / trades
+        roi = raw_return / (max_trades * 1000000)
+    return {
+        'days': days.astype(int),
+        'trades': trades.astype(int),
+        'sharpe_ratio': sharpe,
+        'win_rate': win_rate,
+        'roi': roi,
+        'raw_return': raw_return
+    }
+
+
+# Function to calculate the max drawdown of rolling windows
+def _rolling_drawdown(equity, window, ends):
+    """
+    Function to calculate the largest fall from a running peak of the cumulative raw return within
+    each window, measured from the equity at the start of the window. Windows are processed in chunks
+    to bound memory.
+    :param equity: Prefix sum of the daily raw return, with a leading 0
+    :param window: Length of the windows in days
+    :param ends: Array of one past the last day of each window
+    """
+    drawdown = numpy.empty(len(ends))
+    if len(ends) == 0:
+        return drawdown
+    # Each window covers window + 1 equity values, from its start to its end
+    views = numpy.lib.stride_tricks.sliding_window_view(equity, window + 1)
+    chunk = max(1, DRAWDOWN_CHUNK_VALUES // (window + 1))
+    for position in range(0, len(ends), chunk):
+        values = views[ends[position:position + chunk] - window]
+        peaks = numpy.maximum.accumulate(values, axis=1)
+        drawdown[position:position + chunk] = (peaks - values).max(axis=1)
+    return drawdown
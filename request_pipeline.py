@@ -0,0 +1,363 @@
+import numpy
+import pandas
+import analysis
+import backtest
+import candle_store
+import compact_dtypes
+import instrumentation
+import wire_format
+
+
+# Columns the indicator routes can take their values from
+VALUE_COLUMNS = ['candle_open', 'high', 'low', 'candle_close', 'custom']
+# Order types the analysis routes accept
+ORDER_TYPES = analysis.BUY_ORDER_TYPES + analysis.SELL_ORDER_TYPES
+# Indicators which can be requested in a list of indicator specs
+SPEC_INDICATORS = ['rsi', 'ema', 'ichimoku']
+# Keys of an indicator spec which name a candle column
+SPEC_VALUE_KEYS = ['value', 'high_value', 'low_value', 'close_value']
+# Keys of an indicator spec which hold a length
+SPEC_LENGTH_KEYS = ['period', 'tenkan', 'kijun', 'senoku']
+# Keys each indicator spec can have, the keyword arguments of its calc_ function
+SPEC_KEYS = {
+    'rsi': ['indicator', 'period', 'value'],
+    'ema': ['indicator', 'period', 'value', 'accuracy_filter'],
+    'ichimoku': ['indicator', 'tenkan', 'kijun', 'senoku', 'high_value', 'low_value', 'close_value']
+}
+
+
+# Error for a request which can't be handled, with the message returned to the client
+class RequestError(ValueError):
+    pass
+
+
+# Function to build the response for an invalid request
+def error_response(error, status_code=400):
+    """
+    Function to build the response for an invalid request
+    :param error: RequestError, returned as is, or another ValueError, returned as "Invalid request, <error>"
+    :param status_code: HTTP status code, default is 400
+    """
+    # Import here so this module can be used without the Functions runtime
+    import azure.functions as func
+    message = str(error) if isinstance(error, RequestError) else f"Invalid request, {error}"
+    return func.HttpResponse(message, status_code=status_code)
+
+
+# Function to read the parameters and data of a request
+def read_request(req, data_key='candlestick_data'):
+    """
+    Function to parse the request body once, in whichever format was sent, timed as the parse phase.
+    Candles can also be read from the candle store with a candles parameter in place of candlestick_data
+    :param req: The HTTP request
+    :param data_key: Name of the parameter holding the data, candlestick_data or trade_data
+    :return: Tuple of (parameters dictionary, dataframe or None if no data was sent)
+    """
+    with instrumentation.phase('parse'):
+        params, dataframe = wire_format.read_request(req, data_key)
+        if dataframe is None and data_key == 'candlestick_data' and params.get('candles') is not None:
+            dataframe = stored_candles(params['candles'])
+    if dataframe is not None:
+        instrumentation.record(input_rows=len(dataframe))
+    return params, dataframe
+
+
+# Function to read candles from the candle store
+def stored_candles(reference):
+    """
+    Function to read the candles named by a candles parameter from the candle store, without copying them
+    :param reference: Dictionary of symbol and timeframe, and optionally start and end as inclusive millisecond timestamps
+    """
+    if not isinstance(reference, dict):
+        raise RequestError("Invalid value for candles, must be an object with symbol and timeframe")
+    store = candle_store.store_from_settings()
+    if store is None:
+        raise RequestError("Invalid request, the candle store isn't configured")
+    return store.load(
+        get_required(reference, 'symbol'),
+        get_required(reference, 'timeframe'),
+        get_int(reference, 'start', None),
+        get_int(reference, 'end', None)
+    )
+
+
+# Function to read an integer parameter
+def get_int(params, name, default, minimum=None):
+    """
+    Function to read an integer parameter
+    :param params: Dictionary of request parameters
+    :param name: Name of the parameter
+    :param default: Value used when the parameter isn't sent
+    :param minimum: Smallest value allowed, or None for no limit
+    """
+    value = params.get(name)
+    if value is None:
+        return default
+    # bool is a subclass of int, but true and false aren't numbers
+    if isinstance(value, bool):
+        raise RequestError(f"Invalid value for {name}: {value}")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"Invalid value for {name}: {value}")
+    if minimum is not None and number < minimum:
+        raise RequestError(f"Invalid value for {name}: {value}, must be at least {minimum}")
+    return number
+
+
+# Function to read a number parameter
+def get_float(params, name, default):
+    """
+    Function to read a number parameter
+    :param params: Dictionary of request parameters
+    :param name: Name of the parameter
+    :param default: Value used when the parameter isn't sent
+    """
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"Invalid value for {name}: {value}")
+
+
+# Function to read a parameter which must be one of a set of choices
+def get_choice(params, name, choices, default):
+    """
+    Function to read a parameter which must be one of a set of choices
+    :param params: Dictionary of request parameters
+    :param name: Name of the parameter
+    :param choices: Allowed values
+    :param default: Value used when the parameter isn't sent
+    """
+    value = params.get(name)
+    if value is None:
+        return default
+    if value not in choices:
+        raise RequestError(f"Invalid value for {name}: {value}")
+    return value
+
+
+# Function to read a parameter which must be sent
+def get_required(params, name):
+    """
+    Function to read a parameter which must be sent
+    :param params: Dictionary of request parameters
+    :param name: Name of the parameter
+    """
+    value = params.get(name)
+    if value is None:
+        raise RequestError(f"Invalid request, {name} not found")
+    return value
+
+
+# Function to read if compact dtypes are used
+def compact_mode(params):
+    """
+    Function to read the compact parameter, which stores prices as float32 and order_type as a categorical
+    :param params: Dictionary of request parameters
+    :return: True or False, default is the COMPACT_DTYPES app setting
+    """
+    return bool(params.get('compact', compact_dtypes.COMPACT_DTYPES))
+
+
+# Function to read the output options shared by the indicator routes
+def output_options(params):
+    """
+    Function to read the options which limit the returned data and the precision it's calculated with
+    :param params: Dictionary of request parameters
+    :return: Dictionary of columns (list or None), last_n (int or None), after_timestamp (datetime or None) and compact
+    """
+    columns = params.get('columns')
+    if columns is not None and (not isinstance(columns, list) or not all(isinstance(column, str) for column in columns)):
+        raise ValueError("columns must be a list of column names")
+    last_n = params.get('last_n')
+    if last_n is not None:
+        last_n = int(last_n)
+        if last_n < 0:
+            raise ValueError("last_n must not be negative")
+    after_timestamp = params.get('after_timestamp')
+    if after_timestamp is not None:
+        after_timestamp = pandas.to_datetime(int(after_timestamp), unit='ms')
+    return {'columns': columns, 'last_n': last_n, 'after_timestamp': after_timestamp, 'compact': compact_mode(params)}
+
+
+# Function to check the request data was sent
+def require_data(dataframe, data_key='candlestick_data'):
+    """
+    Function to check the request data was sent
+    :param dataframe: Dataframe from read_request
+    :param data_key: Name of the parameter holding the data
+    """
+    if dataframe is None:
+        raise RequestError(f"Invalid request, {data_key} not found")
+
+
+# Function to check the columns of the request data
+def require_columns(dataframe, columns, label='candlestick', numeric=()):
+    """
+    Function to check the request data has every column, using only the column index and dtypes
+    :param dataframe: Dataframe from read_request
+    :param columns: Columns which must be present, checked in order
+    :param label: Name of the data in the error message, candlestick or trade_data
+    :param numeric: Columns which must also hold numbers
+    """
+    for column in columns:
+        if column not in dataframe.columns:
+            raise RequestError(f"Invalid columns in {label}, {column} not found")
+    for column in numeric:
+        if dataframe[column].dtype.kind not in 'biuf':
+            raise RequestError(f"Invalid columns in {label}, {column} must be numeric")
+
+
+# Function to check every value of a column is allowed
+def require_values(series, allowed, message):
+    """
+    Function to check every value of a column is allowed, in one vectorized pass
+    :param series: Column to check
+    :param allowed: Allowed values
+    :param message: Error message, with {} replaced by the first value which isn't allowed
+    """
+    invalid = ~series.isin(allowed).to_numpy()
+    if invalid.any():
+        raise RequestError(message.format(series.to_numpy()[invalid.argmax()]))
+
+
+# Function to check a list of indicator specs
+def indicator_specs(params, candle_dataframe=None, name='indicators'):
+    """
+    Function to read and check a list of indicator specs, casting the lengths into integers
+    :param params: Dictionary of request parameters
+    :param candle_dataframe: Dataframe of candles to check the value columns against, or None to skip the check
+    :param name: Name of the parameter holding the specs
+    :return: Tuple of (list of specs, list of candle columns the specs use)
+    """
+    specs = params.get(name)
+    if not isinstance(specs, list) or len(specs) == 0:
+        raise RequestError(f"Invalid request, {name} not found")
+    used_columns = []
+    for spec in specs:
+        if not isinstance(spec, dict) or spec.get('indicator') not in SPEC_INDICATORS:
+            raise RequestError(f"Invalid indicator: {spec}")
+        # Unknown keys would reach the calc_ functions as keyword arguments
+        unknown_keys = [key for key in spec if key not in SPEC_KEYS[spec['indicator']]]
+        if len(unknown_keys) > 0:
+            raise RequestError(f"Invalid keys for {spec['indicator']}: {', '.join(map(str, unknown_keys))}")
+        # Check the columns used by the indicator
+        for value_key in SPEC_VALUE_KEYS:
+            value = spec.get(value_key)
+            if value is None:
+                continue
+            if value not in VALUE_COLUMNS:
+                raise RequestError(f"Invalid value for {value_key}: {value}")
+            if candle_dataframe is not None:
+                require_columns(candle_dataframe, [value])
+            used_columns.append(value)
+        # Cast the lengths into integers
+        for length_key in SPEC_LENGTH_KEYS:
+            if spec.get(length_key) is not None:
+                spec[length_key] = get_int(spec, length_key, None, minimum=1)
+    return specs, used_columns
+
+
+# Function to check a backtest rule
+def backtest_rule(params, candle_dataframe=None, name='rule'):
+    """
+    Function to read and check a backtest rule, casting the lengths into integers and the thresholds into floats
+    :param params: Dictionary of request parameters
+    :param candle_dataframe: Dataframe of candles to check the value columns against, or None to skip the check
+    :param name: Name of the parameter holding the rule
+    :return: Tuple of (rule, list of candle columns the rule uses)
+    """
+    rule = params.get(name)
+    if not isinstance(rule, dict) or rule.get('rule') not in backtest.RULES:
+        raise RequestError(f"Invalid rule: {rule}")
+    used_columns = []
+    for value_key in SPEC_VALUE_KEYS:
+        value = rule.get(value_key)
+        if value is None:
+            continue
+        if value not in VALUE_COLUMNS:
+            raise RequestError(f"Invalid value for {value_key}: {value}")
+        if candle_dataframe is not None:
+            require_columns(candle_dataframe, [value])
+        used_columns.append(value)
+    for length_key in SPEC_LENGTH_KEYS + ['fast', 'slow']:
+        if rule.get(length_key) is not None:
+            rule[length_key] = get_int(rule, length_key, None, minimum=1)
+    for threshold_key in ['lower', 'upper']:
+        if rule.get(threshold_key) is not None:
+            rule[threshold_key] = get_float(rule, threshold_key, None)
+    return rule, used_columns
+
+
+# Function to convert a timestamp column into datetimes
+def to_datetime(series):
+    """
+    Function to convert a column of millisecond timestamps into datetimes, leaving datetime columns as they are
+    :param series: Column to convert
+    """
+    if pandas.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pandas.to_datetime(series, unit='ms')
+
+
+# Function to check if a dataframe is already sorted
+def is_sorted(dataframe, columns):
+    """
+    Function to check if a dataframe is already sorted by the columns, without sorting it
+    :param dataframe: Dataframe to check
+    :param columns: Columns to sort by, the first column first
+    """
+    if len(columns) == 1:
+        return dataframe[columns[0]].is_monotonic_increasing
+    if len(dataframe) < 2:
+        return True
+    # Each pair of neighbouring rows must be in order on the first column which differs
+    ordered = numpy.zeros(len(dataframe) - 1, dtype=bool)
+    equal = numpy.ones(len(dataframe) - 1, dtype=bool)
+    for column in columns:
+        values = dataframe[column].to_numpy()
+        ordered |= equal & (values[:-1] < values[1:])
+        equal &= values[:-1] == values[1:]
+    return bool((ordered | equal).all())
+
+
+# Function to convert and sort candles
+def prepare_candles(candle_dataframe, sort_by=('candle_timestamp',), kind='quicksort', compact=False):
+    """
+    Function to convert candle_timestamp into datetimes and sort the candles, timed as the prepare phase.
+    Candles which are already in order, as most clients send them, aren't sorted again.
+    :param candle_dataframe: Dataframe of candles
+    :param sort_by: Columns to sort by, default is candle_timestamp
+    :param kind: Sort algorithm used when the candles aren't in order
+    :param compact: Store the prices as float32 before sorting, see compact_dtypes.compact_candles
+    """
+    with instrumentation.phase('prepare'):
+        candle_dataframe['candle_timestamp'] = to_datetime(candle_dataframe['candle_timestamp'])
+        if compact:
+            candle_dataframe = compact_dtypes.compact_candles(candle_dataframe)
+        if not is_sorted(candle_dataframe, list(sort_by)):
+            candle_dataframe = candle_dataframe.sort_values(by=list(sort_by), kind=kind)
+    return candle_dataframe
+
+
+# Function to convert and sort trades
+def prepare_trades(trade_dataframe, time_columns=('exit_time', 'entry_time'), compact=False):
+    """
+    Function to convert the time columns of trades into datetimes and sort the trades by exit_time,
+    timed as the prepare phase. Trades which are already in order aren't sorted again.
+    :param trade_dataframe: Dataframe of trades
+    :param time_columns: Columns to convert, if present
+    :param compact: Store order_type as a categorical and the prices as float32, see compact_dtypes.compact_trades
+    """
+    with instrumentation.phase('prepare'):
+        for column in time_columns:
+            if column in trade_dataframe.columns:
+                trade_dataframe[column] = to_datetime(trade_dataframe[column])
+        if compact:
+            trade_dataframe = compact_dtypes.compact_trades(trade_dataframe)
+        if not is_sorted(trade_dataframe, ['exit_time']):
+            trade_dataframe = trade_dataframe.sort_values(by='exit_time')
+    return trade_dataframe
@@ -0,0 +1,136 @@
+import re
+import numpy
+import pandas as pd
+import candle_store
+import indicators
+
+
+# Length of each timeframe unit in milliseconds, for timeframes such as 30s, 5m, 1h or 1d
+TIMEFRAME_UNITS = {'s': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000}
+# How each candle column is combined into a bar. Other columns are left out of the bars
+AGGREGATIONS = {'candle_open': 'first', 'high': 'max', 'low': 'min', 'candle_close': 'last', 'custom': 'last', 'volume': 'sum'}
+
+
+# Function to read the length of a timeframe
+def timeframe_milliseconds(timeframe):
+    """
+    Function to read a timeframe such as 5m into its length in milliseconds
+    :param timeframe: A whole number followed by s, m, h or d
+    """
+    match = re.fullmatch(r'(\d+)([smhd])', str(timeframe).strip())
+    if match is None or int(match.group(1)) < 1:
+        raise ValueError(f"invalid timeframe {timeframe}, must be a whole number followed by one of {', '.join(TIMEFRAME_UNITS)}, such as 5m")
+    return int(match.group(1)) * TIMEFRAME_UNITS[match.group(2)]
+
+
+# Function to resample candles into bars of a longer timeframe
+def resample_candles(candle_dataframe, timeframe):
+    """
+    Function to combine candles into bars of a longer timeframe in one vectorized pass. Bars start at
+    multiples of the timeframe since 1970-01-01 UTC, so 1d bars start at midnight UTC. Bars take the first
+    open, highest high, lowest low, last close and custom value, and total volume of their candles.
+    Only bars with candles are returned.
+    :param candle_dataframe: Dataframe containing candlestick data sorted by candle_timestamp, or a reference to stored candles, see candle_store.resolve
+    :param timeframe: Timeframe of the bars, such as 5m, see timeframe_milliseconds
+    :return: Dataframe of bars with candle_timestamp, the start of each bar, and the candle columns in AGGREGATIONS
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    _, bars = _resample(_milliseconds(candle_dataframe['candle_timestamp']), candle_dataframe, timeframe_milliseconds(timeframe))
+    return bars
+
+
+# Function to resample candles into bars
+def _resample(timestamps, candle_dataframe, period):
+    """
+    Function to combine candles into bars of period milliseconds
+    :param timestamps: Array of the candle timestamps in milliseconds, sorted
+    :param candle_dataframe: Dataframe of candles or bars of a shorter timeframe
+    :param period: Length of the bars in milliseconds
+    :return: Tuple of (array of bar start timestamps in milliseconds, dataframe of bars)
+    """
+    buckets = timestamps // period
+    # Each bar starts at the first candle of its bucket and ends before the first candle of the next
+    starts = numpy.flatnonzero(numpy.concatenate(([True], buckets[1:] != buckets[:-1]))) if len(buckets) > 0 else numpy.empty(0, dtype=int)
+    ends = numpy.concatenate((starts[1:], [len(buckets)])) - 1
+    bar_timestamps = buckets[starts] * period
+    bars = {'candle_timestamp': pd.to_datetime(bar_timestamps, unit='ms')}
+    for column, aggregation in AGGREGATIONS.items():
+        if column not in candle_dataframe.columns:
+            continue
+        values = candle_dataframe[column].to_numpy()
+        if len(starts) == 0:
+            bars[column] = values[:0]
+        elif aggregation == 'first':
+            bars[column] = values[starts]
+        elif aggregation == 'last':
+            bars[column] = values[ends]
+        elif aggregation == 'max':
+            # fmax and fmin skip missing values, the same as pandas
+            bars[column] = numpy.fmax.reduceat(values, starts)
+        elif aggregation == 'min':
+            bars[column] = numpy.fmin.reduceat(values, starts)
+        else:
+            bars[column] = numpy.add.reduceat(numpy.nan_to_num(values), starts)
+    return bar_timestamps, pd.DataFrame(bars)
+
+
+# Function to calculate indicators on several timeframes aligned to the candles
+def calc_multi_timeframe(candle_dataframe, timeframes, indicator_specs, base_timeframe=None):
+    """
+    Function to resample candles into each timeframe, calculate the indicators on the bars with
+    calc_indicators and add them to the candles. Each timeframe is resampled from the longest timeframe
+    before it which divides it, rather than from the candles. Each candle gets the values of the last
+    bar which had closed by the candle's close, the same as merge_asof on the bar close, so no value
+    depends on a later candle. Ichimoku is calculated without the chikou span, which uses later bars.
+    :param candle_dataframe: Dataframe containing candlestick data sorted by candle_timestamp, or a reference to stored candles, see candle_store.resolve
+    :param timeframes: List of timeframes, such as ['5m', '1h', '1d'], see timeframe_milliseconds. Each must be a multiple of base_timeframe
+    :param indicator_specs: List of indicator specs, the same format as indicators.calc_indicators
+    :param base_timeframe: Timeframe of the candles, default is the shortest gap between two candles
+    :return: Dataframe of the candles with a column for each indicator column and timeframe, named {column}_{timeframe}
+    """
+    candle_dataframe = candle_store.resolve(candle_dataframe)
+    timestamps = _milliseconds(candle_dataframe['candle_timestamp'])
+    if numpy.any(timestamps[1:] < timestamps[:-1]):
+        raise ValueError("candles must be sorted by candle_timestamp")
+    if base_timeframe is not None:
+        base_period = timeframe_milliseconds(base_timeframe)
+    else:
+        gaps = numpy.diff(timestamps)
+        gaps = gaps[gaps > 0]
+        if len(gaps) == 0:
+            raise ValueError("base_timeframe is needed when there are fewer than two candles")
+        base_period = int(gaps.min())
+    # Drop repeated timeframes and order them from shortest to longest
+    periods = {timeframe: timeframe_milliseconds(timeframe) for timeframe in timeframes}
+    for timeframe, period in periods.items():
+        if period % base_period != 0:
+            raise ValueError(f"timeframe {timeframe} must be a multiple of the {base_period}ms candles")
+    # Ichimoku rows would depend on later bars through the chikou span
+    specs = [{**spec, 'chikou': False} if spec.get('indicator') == 'ichimoku' else spec for spec in indicator_specs]
+    # Time each candle closes, which is when a bar ending with it is known
+    candle_close = timestamps + base_period
+    sources = [(base_period, timestamps, candle_dataframe)]
+    aligned = {}
+    for timeframe, period in sorted(periods.items(), key=lambda item: item[1]):
+        # Resample from the longest timeframe so far which divides this one, as it has the fewest rows
+        _, source_timestamps, source = max((item for item in sources if period % item[0] == 0), key=lambda item: item[0])
+        bar_timestamps, bars = _resample(source_timestamps, source, period)
+        sources.append((period, bar_timestamps, bars))
+        results = indicators.calc_indicators(bars.copy(), specs)
+        # Rows removed for warm up are NaN
+        columns = [column for column in results.columns if column not in bars.columns]
+        results = results[columns].reindex(bars.index)
+        # Last bar which closed at or before each candle's close
+        positions = numpy.searchsorted(bar_timestamps + period, candle_close, side='right') - 1
+        closed = positions >= 0
+        for column in columns:
+            values = results[column].to_numpy(dtype=float)
+            aligned[f'{column}_{timeframe}'] = numpy.where(closed, values[numpy.maximum(positions, 0)] if len(values) > 0 else numpy.nan, numpy.nan)
+    return pd.concat([candle_dataframe, pd.DataFrame(aligned, index=candle_dataframe.index)], axis=1)
+
+
+# Function to read timestamps as milliseconds
+def _milliseconds(timestamps):
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = timestamps.astype('datetime64[ms]')
+    return numpy.asarray(timestamps).astype('int64')
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import pandas
+
+
+# Function to build a cache key from the candles and the indicator parameters
+def make_key(route, dataframe, params):
+    """
+    Function to build a cache key from a content hash of the dataframe columns and the parameters,
+    so the same candles give the same key whichever format they were sent in
+    :param route: Name of the route, so different routes never share entries
+    :param dataframe: Dataframe of the parsed request data
+    :param params: Dictionary of the parameters which change the result
+    :return: Hex digest string
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(route.encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    for name in dataframe.columns:
+        column = dataframe[name]
+        digest.update(f'{name}:{column.dtype}:{len(column)};'.encode('utf-8'))
+        if column.dtype.kind in 'biufcmM':
+            digest.update(column.to_numpy().tobytes())
+        else:
+            # Hash object columns such as strings value by value
+            digest.update(pandas.util.hash_pandas_object(column, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# Shared cache backend stored in a local SQLite file
+class SQLiteCacheBackend:
+    """
+    Shared cache backend stored in a SQLite file. Stands in for a shared cache service, so
+    worker processes on the same machine can share results. Any object with the same get and
+    set methods can be used as a backend.
+    :param path: Path of the SQLite file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, value BLOB, mimetype TEXT, expires_at REAL)'
+            )
+
+    def get(self, key):
+        """
+        Function to get a value from the backend
+        :param key: Cache key
+        :return: Tuple of (value bytes, mimetype), or None if missing or expired
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, mimetype, expires_at FROM result_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[2] < time.time():
+                with self._connection:
+                    self._connection.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                return None
+        return bytes(row[0]), row[1]
+
+    def set(self, key, value, mimetype, ttl_seconds):
+        """
+        Function to store a value in the backend
+        :param key: Cache key
+        :param value: Value bytes
+        :param mimetype: Mimetype of the value
+        :param ttl_seconds: Seconds until the value expires
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO result_cache (key, value, mimetype, expires_at) VALUES (?, ?, ?, ?)',
+                (key, value, mimetype, time.time() + ttl_seconds)
+            )
+            # Clear out expired values while we hold the lock
+            self._connection.execute('DELETE FROM result_cache WHERE expires_at < ?', (time.time(),))
+
+
+# In process cache of response bodies with LRU and TTL eviction
+class ResultCache:
+    """
+    In process cache of response bodies, evicting the least recently used entries when there are
+    too many entries or bytes, and dropping entries older than the TTL.
+    :param max_entries: Largest number of entries to keep
+    :param ttl_seconds: Seconds an entry stays valid
+    :param max_bytes: Largest total size of the cached bodies
+    :param backend: Optional shared backend checked on a local miss, such as SQLiteCacheBackend
+    """
+    def __init__(self, max_entries=256, ttl_seconds=60, max_bytes=64 * 1024 * 1024, backend=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Function to get a cached value
+        :param key: Cache key
+        :return: Tuple of (value bytes, mimetype), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, mimetype = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, mimetype
+                self._remove(key)
+                self.expirations += 1
+        if self.backend is not None:
+            shared = self.backend.get(key)
+            if shared is not None:
+                with self._lock:
+                    self.backend_hits += 1
+                self._store(key, shared[0], shared[1])
+                return shared
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, mimetype):
+        """
+        Function to store a value
+        :param key: Cache key
+        :param value: Value bytes
+        :param mimetype: Mimetype of the value
+        """
+        self._store(key, value, mimetype)
+        if self.backend is not None:
+            self.backend.set(key, value, mimetype, self.ttl_seconds)
+
+    def _store(self, key, value, mimetype):
+        # Values larger than the whole cache are never stored
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, mimetype)
+            self._bytes += len(value)
+            # Evict the least recently used entries until the cache is within its limits
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def get_response(self, key):
+        """
+        Function to get a cached HTTP response
+        :param key: Cache key, or None to skip the cache
+        :return: HttpResponse, or None on a miss
+        """
+        if key is None:
+            return None
+        cached = self.get(key)
+        if cached is None:
+            return None
+        # Import here so this module can be used without the Functions runtime
+        import azure.functions as func
+        return func.HttpResponse(cached[0], status_code=200, mimetype=cached[1])
+
+    def store_response(self, key, response):
+        """
+        Function to cache a successful HTTP response
+        :param key: Cache key, or None to skip the cache
+        :param response: HttpResponse to cache
+        :return: The response, so this can wrap a return statement
+        """
+        if key is not None and response.status_code == 200:
+            self.set(key, response.get_body(), response.mimetype)
+        return response
+
+    def stats(self):
+        """
+        Function to get the hit and miss counters and the current size
+        """
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            return {
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.backend_hits) / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+
+# Function to create the cache from the app settings
+def cache_from_settings():
+    """
+    Function to create the cache from the RESULT_CACHE_* app settings
+    :return: ResultCache, or None if RESULT_CACHE_ENABLED is false
+    """
+    if os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() in ['false', '0', 'no']:
+        return None
+    backend = None
+    sqlite_path = os.environ.get('RESULT_CACHE_SQLITE_PATH')
+    if sqlite_path:
+        backend = SQLiteCacheBackend(sqlite_path)
+    return ResultCache(
+        max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 256)),
+        ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL_SECONDS', 60)),
+        max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        backend=backend
+    )
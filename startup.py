@@ -0,0 +1,52 @@
+import logging
+import os
+import threading
+import time
+import indicators
+import kernels
+
+
+# Warm up in a background thread when the app starts. Set with the WARM_UP_ON_START app setting, default is false
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', 'false').lower() in ['true', '1', 'yes']
+
+# Timings of the last warm up, empty until one has finished
+last_warm_up = {}
+_warm_up_lock = threading.Lock()
+
+
+# Function to load and compile everything the first indicator request would
+def warm_up():
+    """
+    Function to import the modules which are loaded on first use, Pandas TA when it's the selected
+    backend and numba, and compile the kernels, so the first request doesn't pay for them. Calls
+    after the first are quick, as every step is only done once.
+    :return: Dictionary of the seconds each step took, and whether numba is used
+    """
+    with _warm_up_lock:
+        timings = {}
+        start = time.perf_counter()
+        if indicators.get_backend() == 'pandas_ta':
+            indicators.load_pandas_ta()
+        timings['pandas_ta_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+        timings['numba'] = kernels.load_numba()
+        timings['numba_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+        kernels.prime_kernels()
+        timings['kernels_seconds'] = time.perf_counter() - start
+        timings['total_seconds'] = timings['pandas_ta_seconds'] + timings['numba_seconds'] + timings['kernels_seconds']
+        last_warm_up.update(timings)
+    logging.info(f"Warm up finished in {timings['total_seconds']:.3f}s")
+    return timings
+
+
+# Function to warm up without holding up the app starting
+def start_warm_up():
+    """
+    Function to run warm_up in a daemon thread, so the host can start serving requests while it runs.
+    Requests arriving before it finishes load what they need themselves.
+    :return: The thread
+    """
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,163 @@
+"""
+Checks incremental updates match the full calculation and state tokens from clients are checked.
+
+Usage:
+    python -m pytest test
+"""
+import base64
+import json
+import os
+import sys
+import zlib
+import numpy
+import pandas
+import pytest
+
+# Make the function app modules importable when run from the repo root or the test folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import indicator_state
+import indicators
+from indicator_state import IndicatorState
+from test_kernels import assert_close, make_candles
+
+SPECS = [
+    {'indicator': 'ema', 'period': 20},
+    {'indicator': 'rsi', 'period': 14},
+    {'indicator': 'ichimoku', 'tenkan': 9, 'kijun': 26, 'senoku': 52}
+]
+
+
+# Function to build candles with millisecond timestamps, as the update routes receive them
+def candles(size=500):
+    candle_dataframe = make_candles(size)
+    candle_dataframe['candle_timestamp'] = candle_dataframe['candle_timestamp'].astype('datetime64[ms]').astype('int64')
+    # A gap in the prices is carried through the same way as the full calculation
+    candle_dataframe.loc[200:203, ['high', 'low', 'candle_close']] = numpy.nan
+    return candle_dataframe
+
+
+# Function to build a token from decoded token data
+def encode(data):
+    return base64.urlsafe_b64encode(zlib.compress(json.dumps(data).encode('utf-8'))).decode('ascii')
+
+
+# Function to decode a token into its data
+def decode(token):
+    return json.loads(zlib.decompress(base64.urlsafe_b64decode(token)))
+
+
+# Token for the first 300 candles, shared by the tests which change it
+@pytest.fixture
+def token():
+    state = IndicatorState(SPECS)
+    state.update(candles().iloc[:300])
+    return state.to_token()
+
+
+@pytest.mark.parametrize('splits', [[300], [1, 50, 51, 400], list(range(10, 500, 37))])
+def test_updates_through_tokens_match_one_update(splits):
+    candle_dataframe = candles()
+    full = IndicatorState(SPECS)
+    expected = full.update(candle_dataframe)[full.columns]
+    parts = []
+    token = None
+    for start, end in zip([0] + splits, splits + [len(candle_dataframe)]):
+        state = IndicatorState(SPECS) if token is None else IndicatorState.from_token(token)
+        parts.append(state.update(candle_dataframe.iloc[start:end])[state.columns])
+        token = state.to_token()
+    actual = numpy.concatenate([part.to_numpy(dtype=float) for part in parts])
+    assert_close(actual, expected.to_numpy(dtype=float), tolerance=0.0)
+
+
+def test_updates_match_the_full_history_calculation():
+    candle_dataframe = candles()
+    state = IndicatorState(SPECS)
+    actual = pandas.concat([
+        state.update(candle_dataframe.iloc[:300]), IndicatorState.from_token(state.to_token()).update(candle_dataframe.iloc[300:])
+    ])
+    indicators.set_backend('native')
+    try:
+        expected = indicators.calc_ema(candle_dataframe.copy(), period=20, accuracy_filter=False)
+        expected = indicators.calc_rsi(expected, period=14)
+        ichimoku = indicators.calc_ichimoku(candle_dataframe.copy(), new_columns_only=True, chikou=False)
+    finally:
+        indicators.set_backend('pandas_ta')
+    assert_close(actual['ema_20'], expected['ema_20'])
+    assert_close(actual['rsi'], expected['rsi'])
+    # calc_ichimoku drops the warm up rows and rows with missing values, which the state returns as well
+    for column in ichimoku.columns:
+        assert_close(actual[column].loc[ichimoku.index], ichimoku[column])
+
+
+def test_candles_already_seen_are_skipped(token):
+    candle_dataframe = candles()
+    state = IndicatorState.from_token(token)
+    assert len(state.update(candle_dataframe.iloc[250:350])) == 50
+
+
+def test_token_round_trip_keeps_the_state(token):
+    assert IndicatorState.from_token(token).to_token() == token
+
+
+# Changes to the decoded token data which must be rejected
+INVALID_DATA = {
+    'unknown indicator': lambda data: data['states'][0].update(indicator='macd'),
+    'period too long': lambda data: data['states'][0].update(period=indicator_state.MAX_INDICATOR_LENGTH + 1),
+    'period zero': lambda data: data['states'][1].update(period=0),
+    'period not whole': lambda data: data['states'][1].update(period=2.5),
+    'period text': lambda data: data['states'][1].update(period='14'),
+    'value not a column name': lambda data: data['states'][0].update(value=['candle_close']),
+    'seed values longer than period': lambda data: data['states'][0].update(seed_values=[1.0] * 21),
+    'nobs negative': lambda data: data['states'][1]['gains'].update(nobs=-1),
+    'window longer than length': lambda data: data['states'][2]['windows']['9_max'].update(
+        window=[[position, 1.0] for position in range(300)]
+    ),
+    'window position outside window': lambda data: data['states'][2]['windows']['9_max'].update(window=[[1, 1.0]]),
+    'window missing': lambda data: data['states'][2]['windows'].pop('52_min'),
+    'spans longer than kijun': lambda data: data['states'][2].update(spans=[[0.0, 0.0]] * 27),
+    'span not a pair': lambda data: data['states'][2].update(spans=[[0.0]]),
+    'states not a list': lambda data: data.update(states=5),
+    'state missing a key': lambda data: data['states'][1].pop('previous'),
+    'last_timestamp text': lambda data: data.update(last_timestamp='yesterday')
+}
+
+
+@pytest.mark.parametrize('name', INVALID_DATA)
+def test_token_not_matching_its_indicators_is_rejected(name, token):
+    data = decode(token)
+    INVALID_DATA[name](data)
+    with pytest.raises(ValueError, match='invalid state token'):
+        IndicatorState.from_token(encode(data))
+
+
+@pytest.mark.parametrize('bad_token', [
+    'not a token',
+    '',
+    base64.urlsafe_b64encode(b'not compressed').decode('ascii'),
+    encode([1, 2]),
+    encode({'states': []})
+])
+def test_malformed_token_is_rejected(bad_token):
+    with pytest.raises(ValueError, match='invalid state token'):
+        IndicatorState.from_token(bad_token)
+
+
+def test_truncated_token_is_rejected(token):
+    compressed = base64.urlsafe_b64decode(token)
+    truncated = base64.urlsafe_b64encode(compressed[:len(compressed) // 2]).decode('ascii')
+    with pytest.raises(ValueError, match='invalid state token, incomplete data'):
+        IndicatorState.from_token(truncated)
+
+
+@pytest.mark.parametrize('bad_token', [None, 5, ['token'], {'states': []}])
+def test_token_of_the_wrong_type_is_rejected(bad_token):
+    with pytest.raises(ValueError, match='must be a string'):
+        IndicatorState.from_token(bad_token)
+
+
+def test_oversized_token_is_rejected_without_decompressing_it(monkeypatch):
+    monkeypatch.setattr(indicator_state, 'MAX_STATE_TOKEN_BYTES', 1000)
+    # Compresses to a few bytes, but decompresses to far more than the limit
+    bomb = base64.urlsafe_b64encode(zlib.compress(b' ' * 10000000)).decode('ascii')
+    with pytest.raises(ValueError, match='larger than 1000 bytes'):
+        IndicatorState.from_token(bomb)
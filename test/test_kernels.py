@@ -0,0 +1,130 @@
+"""
+Checks the native kernels give the same values as Pandas TA, with and without numba.
+
+Usage:
+    python -m pytest test
+"""
+import os
+import sys
+import numpy
+import pandas
+import pytest
+
+# Make the function app modules importable when run from the repo root or the test folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import indicators
+import kernels
+
+# Largest relative difference allowed between the backends
+TOLERANCE = 1e-9
+
+
+# Function to build a synthetic candle dataframe
+def make_candles(size, seed=42):
+    """
+    Function to build a synthetic candle dataframe with a random walk close
+    :param size: Number of candles to generate
+    :param seed: Seed for the random number generator
+    """
+    rng = numpy.random.default_rng(seed)
+    close = 100 + numpy.cumsum(rng.normal(0, 1, size))
+    return pandas.DataFrame({
+        'candle_timestamp': pandas.to_datetime(1600000000000 + numpy.arange(size) * 60000, unit='ms'),
+        'high': close + numpy.abs(rng.normal(0, 1, size)),
+        'low': close - numpy.abs(rng.normal(0, 1, size)),
+        'candle_close': close
+    })
+
+
+# Function to check two arrays have NaN in the same places and agree elsewhere
+def assert_close(actual, expected, tolerance=TOLERANCE):
+    actual = numpy.asarray(actual, dtype=float)
+    expected = numpy.asarray(expected, dtype=float)
+    assert (numpy.isnan(actual) == numpy.isnan(expected)).all()
+    scale = numpy.maximum(numpy.abs(expected), 1.0)
+    assert numpy.nanmax(numpy.abs(actual - expected) / scale, initial=0.0) <= tolerance
+
+
+# Runs each test with the numba kernels and with the fallbacks used when numba can't be imported
+@pytest.fixture(params=['numba', 'fallback'])
+def jit(request, monkeypatch):
+    if request.param == 'numba':
+        if not kernels.load_numba():
+            pytest.skip('numba is not installed')
+    else:
+        monkeypatch.setattr(kernels, 'load_numba', lambda: False)
+        # Kernels already replaced by numba dispatchers go back to the plain Python functions
+        for name, function in kernels._KERNELS.items():
+            monkeypatch.setattr(kernels, name, function)
+    return request.param
+
+
+# Sets the indicator backend for a test and puts the default back after it
+@pytest.fixture
+def backend():
+    yield indicators.set_backend
+    indicators.set_backend('pandas_ta')
+
+
+# The calculations compared between the backends
+CALCULATIONS = {
+    'calc_rsi': lambda candles: indicators.calc_rsi(candles, period=14),
+    'calc_ema': lambda candles: indicators.calc_ema(candles, period=20, accuracy_filter=False),
+    'calc_ichimoku': lambda candles: indicators.calc_ichimoku(candles)
+}
+
+
+@pytest.mark.parametrize('name', CALCULATIONS)
+def test_native_backend_matches_pandas_ta(name, jit, backend):
+    pytest.importorskip('pandas_ta')
+    candles = make_candles(2000)
+    backend('pandas_ta')
+    expected = CALCULATIONS[name](candles.copy())
+    backend('native')
+    actual = CALCULATIONS[name](candles.copy())
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.index.equals(expected.index)
+    for column in actual.columns.difference(candles.columns):
+        assert_close(actual[column], expected[column])
+
+
+@pytest.mark.parametrize('period', [2, 14, 50])
+def test_ema_and_rsi_match_pandas_ewm(period, jit):
+    close = make_candles(1000)['candle_close']
+    # A gap in the prices is carried through the same way as pandas
+    close.iloc[100:105] = numpy.nan
+    seeded = close.copy()
+    seeded.iloc[:period - 1] = numpy.nan
+    seeded.iloc[period - 1] = close.iloc[:period].mean()
+    assert_close(kernels.ema(close, period), seeded.ewm(span=period, adjust=False).mean())
+    change = close.diff()
+    average_gain = change.clip(lower=0).where(change.notna()).ewm(alpha=1 / period, min_periods=period).mean()
+    average_loss = change.clip(upper=0).where(change.notna()).ewm(alpha=1 / period, min_periods=period).mean()
+    assert_close(kernels.rsi(close, period), 100 * average_gain / (average_gain + average_loss.abs()))
+
+
+def test_many_periods_match_one_period(jit):
+    close = make_candles(1000)['candle_close'].to_numpy()
+    periods = [2, 9, 26, 1200]
+    for row, period in zip(kernels.ema_many(close, periods), periods):
+        assert_close(row, kernels.ema(close, period))
+    for row, period in zip(kernels.rsi_many(close, periods), periods):
+        assert_close(row, kernels.rsi(close, period))
+
+
+def test_midprice_matches_pandas_rolling(jit):
+    candles = make_candles(1000)
+    expected = 0.5 * (candles['high'].rolling(26).max() + candles['low'].rolling(26).min())
+    assert_close(kernels.midprice(candles['high'], candles['low'], 26), expected)
+
+
+@pytest.mark.parametrize('adjust', [True, False])
+def test_ewm_mean_in_chunks_matches_one_pass(adjust, jit):
+    close = make_candles(1000)['candle_close'].to_numpy()
+    expected = pandas.Series(close).ewm(alpha=0.1, adjust=adjust, min_periods=14).mean()
+    state = (numpy.nan, 1.0, 0)
+    chunks = []
+    for chunk in numpy.array_split(close, 7):
+        output, *state = kernels.ewm_mean(chunk, 0.1, adjust, 14, *state)
+        chunks.append(output)
+    assert_close(numpy.concatenate(chunks), expected)
@@ -0,0 +1,102 @@
+"""
+Checks the responses of the routes, calling the handlers in process.
+
+Usage:
+    python -m pytest test
+"""
+import asyncio
+import json
+import os
+import sys
+import pandas
+import pytest
+
+# Make the function app modules importable when run from the repo root or the test folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from test_kernels import make_candles
+
+func = pytest.importorskip('azure.functions')
+
+
+# Handlers of every route, as the function app can only list its functions once per process
+@pytest.fixture(scope='module')
+def handlers():
+    import function_app
+    routes = {}
+    for function in function_app.app.get_functions():
+        for binding in function.get_bindings():
+            route = getattr(binding, 'route', None)
+            if route is not None:
+                routes[route] = function.get_user_function()
+    return routes
+
+
+# Function to send a JSON body to a route
+def post(handlers, route, body):
+    """
+    Function to call the handler of a route with a JSON body
+    :return: The HttpResponse
+    """
+    request = func.HttpRequest(
+        'POST', f'/api/{route}', body=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    return asyncio.run(handlers[route](request))
+
+
+# Function to read a response as strict JSON, which has no NaN or Infinity
+def strict_json(response):
+    def reject(constant):
+        raise ValueError(f"{constant} is not valid JSON")
+    return json.loads(response.get_body(), parse_constant=reject)
+
+
+def test_backtest_without_trades_returns_valid_json(handlers, monkeypatch):
+    import indicators
+    # The native backend needs no Pandas TA
+    monkeypatch.setattr(indicators, '_backend', 'native')
+    candles = make_candles(30)
+    response = post(handlers, 'calc-backtest', {
+        'rule': {'rule': 'ichimoku_cloud'}, 'return_trades': False, 'candlestick_data': candles.to_json(orient='records')
+    })
+    assert response.status_code == 200
+    payload = strict_json(response)
+    assert payload['trades'] == 0
+    assert payload['win_rate'] is None
+    assert payload['sharpe_data']['roi'] is None
+    assert payload['sharpe_data']['sharpe_ratio'] is None
+
+
+@pytest.mark.parametrize('token', ['not a token', 5, 'eJzLSM3JyQcABiwCFQ=='])
+def test_update_with_invalid_state_token_is_rejected(handlers, token):
+    candles = make_candles(30)
+    candles['candle_timestamp'] = candles['candle_timestamp'].astype('datetime64[ms]').astype('int64')
+    response = post(handlers, 'update-indicators', {'state': token, 'candlestick_data': candles.to_json(orient='records')})
+    assert response.status_code == 400
+    assert b'invalid state token' in response.get_body()
+
+
+# Trades for the analysis routes, one a day
+def make_trades(size=30):
+    candles = make_candles(size + 1)
+    return pandas.DataFrame({
+        'entry_time': candles['candle_timestamp'].iloc[:-1].to_numpy(),
+        'exit_time': candles['candle_timestamp'].iloc[1:].to_numpy() + pandas.Timedelta(days=1),
+        'entry_price': candles['candle_close'].iloc[:-1].to_numpy(),
+        'exit_price': candles['candle_close'].iloc[1:].to_numpy(),
+        'order_type': 'BUY'
+    })
+
+
+@pytest.mark.parametrize('windows', [[True], [False], [20, True], [0], [2.5], 20])
+def test_rolling_metrics_rejects_windows_which_are_not_positive_integers(handlers, windows):
+    response = post(handlers, 'calc-rolling-metrics', {
+        'start_date': '2020-09-01', 'windows': windows, 'trade_data': make_trades().to_json(orient='records')
+    })
+    assert response.status_code == 400
+    assert b'windows must be a list of positive integers' in response.get_body()
+
+
+def test_integer_parameters_reject_booleans(handlers):
+    response = post(handlers, 'calc-rsi', {'rsi_length': True, 'candlestick_data': make_candles(30).to_json(orient='records')})
+    assert response.status_code == 400
+    assert response.get_body() == b'Invalid value for rsi_length: True'
@@ -0,0 +1,394 @@
+import io
+import json
+import struct
+import numpy
+import pandas
+
+# pyarrow is in requirements.txt. If it can't be imported Arrow requests are refused and the JSON and raw column formats still work
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Content type for the default JSON format
+JSON_CONTENT_TYPE = 'application/json'
+# Content type for Arrow IPC streams
+ARROW_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+# Content type for raw little-endian column buffers
+COLUMNS_CONTENT_TYPE = 'application/vnd.tradeoxy.columns'
+# Content type for newline delimited JSON, one row per line
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+# Buffers in the raw column format are padded to this many bytes so each column is aligned
+COLUMN_ALIGNMENT = 8
+
+
+# Error raised when a request or response can't be converted
+class WireFormatError(ValueError):
+    pass
+
+
+# Function to choose the format of the request body
+def request_format(req):
+    """
+    Function to choose the format of the request body from the Content-Type header
+    :param req: The HTTP request
+    :return: One of JSON_CONTENT_TYPE, ARROW_CONTENT_TYPE or COLUMNS_CONTENT_TYPE
+    """
+    content_type = _content_type(req)
+    if content_type in [ARROW_CONTENT_TYPE, COLUMNS_CONTENT_TYPE]:
+        return content_type
+    return JSON_CONTENT_TYPE
+
+
+# Function to read the media type of the request body
+def _content_type(req):
+    return (req.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+
+
+# Function to choose the format of the response body
+def response_format(req):
+    """
+    Function to choose the format of the response body from the Accept header
+    :param req: The HTTP request
+    :return: One of JSON_CONTENT_TYPE, ARROW_CONTENT_TYPE or COLUMNS_CONTENT_TYPE
+    """
+    accept = (req.headers.get('Accept') or '').lower()
+    for content_type in [ARROW_CONTENT_TYPE, COLUMNS_CONTENT_TYPE]:
+        if content_type in accept:
+            return content_type
+    return JSON_CONTENT_TYPE
+
+
+# Function to read the query string parameters
+def _query_params(req):
+    """
+    Function to read the query string parameters, decoding JSON values such as numbers and booleans
+    :param req: The HTTP request
+    """
+    params = {}
+    for key, value in req.params.items():
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+# Function to check the parameters of a request are an object
+def _params_object(params, source):
+    """
+    Function to check the parameters decoded from a request are a JSON object, so other JSON values give a 400
+    :param params: The decoded parameters
+    :param source: Where the parameters were read from, for the error message
+    """
+    if not isinstance(params, dict):
+        raise WireFormatError(f"{source} must be a JSON object")
+    return params
+
+
+# Function to read the parameters and data of a request
+def read_request(req, data_key='candlestick_data'):
+    """
+    Function to read the parameters and data of a request in any of the supported formats.
+    JSON requests carry the data as a JSON string under data_key, the same as before.
+    Arrow and raw column requests carry the parameters in the body metadata and the query string,
+    and the columns are used without copying where the types allow.
+    :param req: The HTTP request
+    :param data_key: Name of the parameter holding the data, candlestick_data or trade_data
+    :return: Tuple of (parameters dictionary, dataframe or None if no data was sent)
+    """
+    body_format = request_format(req)
+    if body_format == JSON_CONTENT_TYPE:
+        params = _params_object(req.get_json(), 'request body')
+        data = params.get(data_key)
+        if data is None:
+            return params, None
+        return params, pandas.DataFrame(json.loads(data))
+    body = req.get_body()
+    if body_format == ARROW_CONTENT_TYPE:
+        params, dataframe = _read_arrow(body)
+    else:
+        params, dataframe = _read_columns(body)
+    # Query string parameters override the ones in the body
+    params.update(_query_params(req))
+    return params, dataframe
+
+
+# Function to build the response for a request
+def make_response(req, payload, dataframe=None, data_key='candlestick_data', status_code=200):
+    """
+    Function to build the response in the format asked for by the Accept header.
+    JSON responses carry the dataframe as a JSON string under data_key, the same as before.
+    Arrow and raw column responses carry the rest of the payload as metadata.
+    :param req: The HTTP request
+    :param payload: Dictionary of values to return
+    :param dataframe: Dataframe to return, or None if the response has no data
+    :param data_key: Name of the payload entry holding the dataframe
+    :param status_code: HTTP status code
+    """
+    # Import here so this module can be used without the Functions runtime
+    import azure.functions as func
+    body_format = response_format(req) if dataframe is not None else JSON_CONTENT_TYPE
+    if body_format == JSON_CONTENT_TYPE:
+        if dataframe is not None:
+            payload = {data_key: dataframe.to_json(orient='records'), **payload}
+        return func.HttpResponse(
+            json.dumps(payload),
+            status_code=status_code,
+            mimetype=JSON_CONTENT_TYPE
+        )
+    if body_format == ARROW_CONTENT_TYPE:
+        body = _write_arrow(dataframe, payload)
+    else:
+        body = _write_columns(dataframe, payload)
+    return func.HttpResponse(
+        body,
+        status_code=status_code,
+        mimetype=body_format
+    )
+
+
+# Function to read the data of a request a chunk of rows at a time
+def read_chunks(req, chunk_rows):
+    """
+    Function to read the data of a request as chunks of rows, so routes can process one chunk at a time
+    instead of building one dataframe of every row. NDJSON bodies hold one row per line, with the
+    parameters in the query string. Arrow bodies are read one record batch at a time, with the parameters
+    in the schema metadata and the query string. The body is already held whole, as the HTTP binding buffers
+    it, but chunks are only parsed as the iterator is consumed.
+    :param req: The HTTP request
+    :param chunk_rows: Largest number of rows in each chunk
+    :return: Tuple of (parameters dictionary, iterator of dataframes)
+    """
+    content_type = _content_type(req)
+    if content_type == NDJSON_CONTENT_TYPE:
+        params, chunks = {}, _ndjson_chunks(req.get_body(), chunk_rows)
+    elif content_type == ARROW_CONTENT_TYPE:
+        params, chunks = _arrow_chunks(req.get_body(), chunk_rows)
+    else:
+        raise WireFormatError(f"chunked data must be sent as {NDJSON_CONTENT_TYPE} or {ARROW_CONTENT_TYPE}")
+    # Query string parameters override the ones in the body
+    params.update(_query_params(req))
+    return params, chunks
+
+
+# Function to build a response from chunks of rows
+def make_chunked_response(req, chunks, status_code=200):
+    """
+    Function to build a response from an iterator of dataframes, encoding each chunk as it's produced
+    so only one chunk is held as a dataframe. The encoded body is built whole in memory, as the HTTP binding
+    doesn't stream responses. The body is NDJSON, or an Arrow IPC stream with one record batch per chunk
+    when the Accept header asks for Arrow. Every chunk must have the same columns.
+    :param req: The HTTP request
+    :param chunks: Iterator of dataframes
+    :param status_code: HTTP status code
+    """
+    # Import here so this module can be used without the Functions runtime
+    import azure.functions as func
+    if ARROW_CONTENT_TYPE in (req.headers.get('Accept') or '').lower():
+        body_format = ARROW_CONTENT_TYPE
+        body = _write_arrow_chunks(chunks)
+    else:
+        body_format = NDJSON_CONTENT_TYPE
+        body = b''.join(_write_ndjson(chunk) for chunk in chunks)
+    return func.HttpResponse(
+        body,
+        status_code=status_code,
+        mimetype=body_format
+    )
+
+
+# Function to read newline delimited JSON in chunks
+def _ndjson_chunks(body, chunk_rows):
+    """
+    Function to read newline delimited JSON rows in chunks, skipping blank lines
+    :param body: The request body
+    :param chunk_rows: Largest number of rows in each chunk
+    """
+    rows = []
+    for line in io.BytesIO(body):
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError as error:
+            raise WireFormatError(f"invalid NDJSON line, {error}")
+        if len(rows) == chunk_rows:
+            yield pandas.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pandas.DataFrame(rows)
+
+
+# Function to write a chunk of rows as newline delimited JSON
+def _write_ndjson(dataframe):
+    if len(dataframe) == 0:
+        return b''
+    # Datetimes are written as epoch milliseconds, the same as the JSON format
+    text = dataframe.to_json(orient='records', lines=True)
+    return (text if text.endswith('\n') else text + '\n').encode('utf-8')
+
+
+# Function to read an Arrow IPC stream in chunks
+def _arrow_chunks(body, chunk_rows):
+    """
+    Function to open an Arrow IPC stream and read it one record batch at a time, splitting large batches
+    :param body: The request body
+    :param chunk_rows: Largest number of rows in each chunk
+    :return: Tuple of (parameters dictionary, iterator of dataframes)
+    """
+    if pyarrow is None:
+        raise WireFormatError("Arrow requests need the pyarrow package")
+    try:
+        reader = pyarrow.ipc.open_stream(body)
+    except pyarrow.ArrowInvalid as error:
+        raise WireFormatError(f"invalid Arrow stream, {error}")
+    metadata = reader.schema.metadata or {}
+    params = _params_object(json.loads(metadata.get(b'params', b'{}')), 'params metadata')
+
+    def chunks():
+        try:
+            for batch in reader:
+                for offset in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(offset, chunk_rows).to_pandas(split_blocks=True)
+        except pyarrow.ArrowInvalid as error:
+            raise WireFormatError(f"invalid Arrow stream, {error}")
+    return params, chunks()
+
+
+# Function to write chunks of rows as an Arrow IPC stream
+def _write_arrow_chunks(chunks):
+    """
+    Function to write an Arrow IPC stream with one record batch per chunk. The schema is taken from
+    the first chunk and later chunks are cast to it.
+    :param chunks: Iterator of dataframes
+    """
+    if pyarrow is None:
+        raise WireFormatError("Arrow responses need the pyarrow package")
+    sink = pyarrow.BufferOutputStream()
+    schema = writer = None
+    try:
+        for chunk in chunks:
+            table = pyarrow.table(_binary_columns(chunk))
+            if writer is None:
+                schema = table.schema
+                writer = pyarrow.ipc.new_stream(sink, schema)
+            writer.write_table(table if table.schema.equals(schema) else table.cast(schema))
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(sink, pyarrow.schema([]))
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError) as error:
+        raise WireFormatError(f"chunks can't be written as one Arrow stream, {error}")
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+# Function to convert a dataframe into columns which can be sent as binary
+def _binary_columns(dataframe):
+    """
+    Function to convert datetime columns to integer milliseconds, the same as the JSON format
+    :param dataframe: Dataframe to convert
+    :return: Dictionary of column name to numpy array or pandas series
+    """
+    columns = {}
+    for name in dataframe.columns:
+        column = dataframe[name]
+        if pandas.api.types.is_datetime64_any_dtype(column):
+            column = column.astype('datetime64[ms]').astype('int64')
+        columns[str(name)] = column
+    return columns
+
+
+# Function to read an Arrow IPC stream
+def _read_arrow(body):
+    """
+    Function to read an Arrow IPC stream
+    :param body: The request body
+    :return: Tuple of (parameters dictionary, dataframe)
+    """
+    if pyarrow is None:
+        raise WireFormatError("Arrow requests need the pyarrow package")
+    try:
+        table = pyarrow.ipc.open_stream(body).read_all()
+    except pyarrow.ArrowInvalid as error:
+        raise WireFormatError(f"invalid Arrow stream, {error}")
+    metadata = table.schema.metadata or {}
+    params = _params_object(json.loads(metadata.get(b'params', b'{}')), 'params metadata')
+    # split_blocks lets primitive columns without nulls reuse the Arrow buffers
+    return params, table.to_pandas(split_blocks=True)
+
+
+# Function to write an Arrow IPC stream
+def _write_arrow(dataframe, payload):
+    """
+    Function to write an Arrow IPC stream with the payload as schema metadata
+    :param dataframe: Dataframe to write
+    :param payload: Dictionary of values to store in the metadata
+    """
+    if pyarrow is None:
+        raise WireFormatError("Arrow responses need the pyarrow package")
+    table = pyarrow.table(_binary_columns(dataframe))
+    table = table.replace_schema_metadata({'payload': json.dumps(payload)})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# Function to read raw little-endian column buffers
+def _read_columns(body):
+    """
+    Function to read the raw column format. The body is a 4 byte little-endian header length,
+    a JSON header of {"params": {...}, "columns": [{"name", "dtype", "length"}]}, then each
+    column buffer padded to COLUMN_ALIGNMENT bytes. Columns are numpy views of the body, not copies.
+    :param body: The request body
+    :return: Tuple of (parameters dictionary, dataframe)
+    """
+    try:
+        header_length = struct.unpack_from('<I', body, 0)[0]
+        header = json.loads(bytes(body[4:4 + header_length]))
+        offset = _aligned(4 + header_length)
+        columns = {}
+        for column in header['columns']:
+            dtype = numpy.dtype(column['dtype'])
+            if dtype.kind not in 'biuf' or dtype.byteorder == '>':
+                raise WireFormatError(f"unsupported dtype {column['dtype']} for column {column['name']}")
+            columns[column['name']] = numpy.frombuffer(body, dtype=dtype, count=column['length'], offset=offset)
+            offset = _aligned(offset + dtype.itemsize * column['length'])
+    except (struct.error, KeyError, TypeError) as error:
+        raise WireFormatError(f"invalid column buffers, {error}")
+    return _params_object(header.get('params', {}), 'params header'), pandas.DataFrame(columns, copy=False)
+
+
+# Function to write raw little-endian column buffers
+def _write_columns(dataframe, payload):
+    """
+    Function to write the raw column format, with the payload in the JSON header
+    :param dataframe: Dataframe to write, every column must be numeric or boolean
+    :param payload: Dictionary of values to store in the header
+    """
+    arrays = {}
+    for name, column in _binary_columns(dataframe).items():
+        array = numpy.asarray(column)
+        if array.dtype.kind not in 'biuf':
+            raise WireFormatError(f"column {name} can't be sent as raw column buffers")
+        arrays[name] = numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+    header = json.dumps({
+        'payload': payload,
+        'columns': [
+            {'name': name, 'dtype': array.dtype.str, 'length': len(array)} for name, array in arrays.items()
+        ]
+    }).encode('utf-8')
+    parts = [struct.pack('<I', len(header)), header]
+    offset = 4 + len(header)
+    for array in arrays.values():
+        parts.append(b'\0' * (_aligned(offset) - offset))
+        offset = _aligned(offset)
+        parts.append(array.tobytes())
+        offset += array.nbytes
+    return b''.join(parts)
+
+
+# Function to round an offset up to the column alignment
+def _aligned(offset):
+    return -(-offset // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT